@@ -2,19 +2,21 @@ import re
 import json
 import jieba
 import numpy as np
-import pandas as pd
 import logging
 import time
 from collections import Counter
 from datetime import datetime, timedelta
-from django.db.models import Count, Q, Max
+from django.core.exceptions import FieldError
+from django.db.models import Count, Q, Max, Min, F
+from django.db.models.functions import Floor
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, DatabaseError
 import random
 import os
 import collections
 
-from danmaku_crawler.models import Video, Danmaku
+from danmaku_crawler.models import Video, Danmaku, DanmakuText
+from danmaku_crawler import crawler_config, snapshot, timeline
 from .models import DanmakuAnalysis
 # 导入BERT情感分析器
 from .bert_sentiment import bert_analyzer
@@ -41,6 +43,18 @@ NEGATIVE_WORDS = set([
     '尬', '难受', '倒胃口', '欺骗', '敷衍', '失望', '可惜', '不好', '差评', '恶心'
 ])
 
+# 用户发送弹幕条数分布的区间 (标签, 下限, 上限)，上限为 None 表示不限
+USER_DISTRIBUTION_BUCKETS = (
+    ('1条', 1, 1),
+    ('2-5条', 2, 5),
+    ('6-10条', 6, 10),
+    ('11-20条', 11, 20),
+    ('20条以上', 21, None),
+)
+
+# 分析用到的弹幕字段，不写快照时只从数据库读取这些列
+ANALYSIS_FIELDS = ('dmid', 'page_id', 'page_duration', 'progress', 'content', 'user_hash')
+
 class DanmakuAnalyzer:
     """弹幕分析器类"""
     
@@ -58,40 +72,107 @@ class DanmakuAnalyzer:
         else:
             self.video = video
         
-        # 查询该视频的所有弹幕
-        danmaku_queryset = Danmaku.objects.filter(video=self.video).order_by('progress')
-        
-        # 检查是否有弹幕数据
-        if not danmaku_queryset.exists():
+        self._danmakus = None
+        self._page_info = None
+        self._danmaku_count = None
+        # 时间线和用户活跃度可以在数据库中聚合，只有这两类分析时不必加载逐条弹幕
+        self.sql_pushdown = analyzer_config.PERFORMANCE.get('sql_pushdown', True)
+        self.second_buckets = analyzer_config.PERFORMANCE.get('second_buckets', True)
+        
+        # 爬取完成时写入的列式快照仍然有效时直接以内存映射方式读取，不再全表扫描
+        danmaku_snapshot = snapshot.load_snapshot(self.video.source) if self.video.source_id else None
+        if danmaku_snapshot is not None:
+            self.danmakus = danmaku_snapshot
+            self.page_info = danmaku_snapshot.page_info
+            logger.info(f"从列式快照初始化分析器: {self.video.title} (BV: {self.video.bvid}), 弹幕数: {len(self.danmakus)}")
+        elif not self.sql_pushdown:
+            self.load_from_database()
+        
+        if not self.danmaku_count:
             logger.warning(f"视频没有弹幕数据: {self.video.title} (BV: {self.video.bvid})")
             raise ValueError(f"视频没有弹幕数据: {self.video.title}")
-        
-        # 获取弹幕数据，用于分析
-        self.danmakus = list(danmaku_queryset)
-        logger.info(f"成功初始化分析器: {self.video.title} (BV: {self.video.bvid}), 弹幕数: {len(self.danmakus)}")
-        
-        # 获取分P信息 (page_id 和 duration)
-        # 从弹幕数据中聚合获取，避免额外查询或依赖爬虫逻辑
-        page_info_query = danmaku_queryset.values('page_id').annotate(
-            duration=Max('page_duration') # 获取每个 page_id 的最大时长
-        ).order_by('page_id') # 按 page_id 排序
-
-        self.page_info = list(page_info_query)
-        if not self.page_info:
+    
+    @property
+    def danmakus(self):
+        """列式弹幕，第一次访问时从数据库加载"""
+        if self._danmakus is None:
+            self.load_from_database()
+        return self._danmakus
+    
+    @danmakus.setter
+    def danmakus(self, value):
+        self._danmakus = value
+        self._danmaku_count = len(value)
+    
+    @property
+    def danmaku_count(self):
+        """弹幕数，弹幕尚未加载时用 COUNT 查询"""
+        if self._danmaku_count is None:
+            self._danmaku_count = self.video.danmakus.count() if self.video.source_id else 0
+        return self._danmaku_count
+    
+    @property
+    def page_info(self):
+        """分P信息 [{'page_id': 分P编号, 'duration': 时长}]，弹幕尚未加载时在数据库中按分P聚合"""
+        if self._page_info is None:
+            if self._danmakus is not None:
+                page_info = self._danmakus.page_info
+            else:
+                page_info = list(
+                    self.video.danmakus.values('page_id').annotate(duration=Max('page_duration')).order_by('page_id')
+                )
+            self.page_info = page_info
+        return self._page_info
+    
+    @page_info.setter
+    def page_info(self, page_info):
+        if not page_info:
             logger.warning(f"无法从弹幕数据中获取分P信息 for video {self.video.bvid}")
             # 尝试创建一个默认的单P信息 (如果视频总时长已知)
             if self.video.duration > 0:
-                 self.page_info = [{'page_id': 1, 'duration': self.video.duration}]
+                 page_info = [{'page_id': 1, 'duration': self.video.duration}]
             else:
                  # 如果连视频总时长都未知，无法进行准确的时间线分析
                  logger.error(f"视频 {self.video.bvid} 总时长未知且无分P信息，时间线分析可能不准确")
                  # 可以给一个默认值，或者在 analyze_timeline 中处理
-                 self.page_info = [{'page_id': 1, 'duration': 0}] # 至少保证 page_info 是列表
+                 page_info = [{'page_id': 1, 'duration': 0}] # 至少保证 page_info 是列表
 
-        logger.info(f"获取到分P信息: {self.page_info}")
+        logger.info(f"获取到分P信息: {page_info}")
+        self._page_info = page_info
+    
+    def load_from_database(self):
+        """
+        从数据库一次流式读取加载弹幕和分P信息
         
-        # 转换为DataFrame以便分析 - 先获取values再转为DataFrame
-        self.df = pd.DataFrame(list(danmaku_queryset.values()))
+        只读取分析需要的字段(values_list + iterator)，按批转换为列式数组，分P信息在同一次读取中计算；
+        配置允许写入快照时额外读取快照字段，读取完成后直接保存为列式快照供下次分析使用。
+        """
+        source = self.video.source
+        if source is None:
+            self.danmakus = snapshot.build_snapshot([], ANALYSIS_FIELDS)
+            return
+        
+        # 快照以弹幕源当前的弹幕数为有效性依据，没有爬取时间的弹幕源(如直播)不写快照
+        snapshot_config = crawler_config.SNAPSHOT
+        write = (snapshot_config.get('enabled', True) and snapshot_config.get('write_on_analysis', True)
+                 and source.last_crawled is not None)
+        fields = snapshot.SNAPSHOT_FIELDS if write else ANALYSIS_FIELDS
+        
+        chunk_size = snapshot_config.get('chunk_size', 20000)
+        danmaku_snapshot = snapshot.build_snapshot(
+            snapshot.iter_snapshot_rows(source, fields, chunk_size), fields, chunk_size
+        )
+        # 分析直接使用列式数组(文本为UTF-8字节、用户哈希去重编号)，不构造逐条记录
+        self.danmakus = danmaku_snapshot
+        if self._page_info is None:
+            self.page_info = danmaku_snapshot.page_info
+        logger.info(f"成功初始化分析器: {self.video.title} (BV: {self.video.bvid}), 弹幕数: {len(self.danmakus)}")
+        
+        if write and len(danmaku_snapshot) and source.danmaku_count == len(danmaku_snapshot):
+            try:
+                snapshot.save_snapshot(source, danmaku_snapshot)
+            except Exception as e:
+                logger.warning(f"写入视频 {self.video.bvid} 的列式快照失败: {str(e)}")
     
     def segment_text(self, text):
         """中文分词并去除停用词"""
@@ -107,14 +188,22 @@ class DanmakuAnalyzer:
         Returns:
             包含关键词和权重的字典
         """
-        # 合并所有弹幕文本
-        all_text = ' '.join([d.content for d in self.danmakus])
-        
-        # 分词
-        words = self.segment_text(all_text)
-        
-        # 统计词频
-        word_counts = Counter(words)
+        # 入库时统计过去重文本且覆盖全部弹幕时，每种文本只分词一次并按出现次数加权
+        text_counts = list(DanmakuText.objects.filter(source_id=self.video.source_id).values_list('text', 'count'))
+        if text_counts and sum(count for _, count in text_counts) == self.danmaku_count:
+            word_counts = Counter()
+            for text, count in text_counts:
+                for word in self.segment_text(text):
+                    word_counts[word] += count
+        else:
+            # 合并所有弹幕文本
+            all_text = ' '.join(self.danmakus.texts())
+            
+            # 分词
+            words = self.segment_text(all_text)
+            
+            # 统计词频
+            word_counts = Counter(words)
         total_words = sum(word_counts.values())
         
         # 计算TF值（词频/总词数）
@@ -157,7 +246,7 @@ class DanmakuAnalyzer:
             }
         
         # 提取弹幕文本
-        texts = [d.content for d in self.danmakus]
+        texts = self.danmakus.texts()
         
         # 对大量弹幕进行采样处理，避免处理时间过长
         max_sample_size = analyzer_config.SENTIMENT_ANALYSIS.get('max_sample_size', 15000)  # 从配置读取最大采样数量
@@ -604,7 +693,7 @@ class DanmakuAnalyzer:
         
         使用相对于分P的 progress 计算绝对时间线，并返回分P边界。
         """
-        if not self.danmakus:
+        if not self.danmaku_count:
             logger.warning(f"视频 {self.video.bvid} 没有弹幕数据，无法进行时间线分析")
             return { 'timeline': [], 'peaks': [], 'episode_boundaries': [], 'total_count': 0 }
 
@@ -634,43 +723,18 @@ class DanmakuAnalyzer:
         page_start_times = {b['page_id']: b['start_time_sec'] for b in episode_boundaries}
 
         # --- 准备时间线数据  ---
-        # 使用 defaultdict 按视频进度统计弹幕数量 (按计算出的绝对秒数)
-        timeline_data = collections.defaultdict(int)
-        valid_danmaku_count = 0
-        for d in self.danmakus:
-            if d.progress is not None and d.page_id is not None:
-                try:
-                    # 获取该弹幕所属分P的绝对开始时间
-                    page_start_sec = page_start_times.get(d.page_id)
-                    if page_start_sec is None:
-                         logger.warning(f"弹幕 (dmid: {d.dmid}) 的 page_id ({d.page_id}) 未在 boundaries 中找到，跳过")
-                         continue
-
-                    # progress 是相对于分P的毫秒数
-                    relative_sec = float(d.progress) / 1000
-
-                    # 计算绝对秒数
-                    absolute_sec = int(page_start_sec + relative_sec)
-
-                    # 确保计算出的绝对秒数非负
-                    if absolute_sec >= 0:
-                        timeline_data[absolute_sec] += 1
-                        valid_danmaku_count += 1
-                    else:
-                        # 这个情况理论上不应该发生，除非 page_start_sec 为负数？
-                        logger.warning(f"计算出的绝对秒数 ({absolute_sec}) 为负数。Page Start: {page_start_sec}, Relative Sec: {relative_sec}. 跳过弹幕 dmid: {d.dmid}")
-
-                except (ValueError, TypeError):
-                    logger.warning(f"无法处理弹幕进度值: {d.progress} (dmid: {d.dmid})，跳过此弹幕") # 减少日志
-                    continue
-            else:
-                #  缺少 progress 或 page_id 的弹幕无法定位
-                 logger.warning(f"弹幕缺少 progress 或 page_id, dmid: {d.dmid}, page_id: {d.page_id}, progress: {d.progress}")
-                 pass
+        # 优先读取入库时维护的每秒弹幕数；弹幕未加载到内存时在数据库中按 (分P, 秒) 聚合，数据库不支持时回退到内存计算
+        timeline_data = None
+        if self.second_buckets and self.video.source is not None:
+            timeline_data = self._timeline_from_buckets(page_start_times)
+        if timeline_data is None and self._danmakus is None and self.sql_pushdown:
+            timeline_data = self._timeline_from_database(page_start_times)
+        if timeline_data is None:
+            timeline_data = self._timeline_in_memory(page_start_times)
 
         if not timeline_data:
             logger.warning(f"视频 {self.video.bvid} 计算后没有有效的弹幕时间数据 (timeline_data is empty)")
-            return { 'timeline': [], 'peaks': [], 'episode_boundaries': episode_boundaries, 'total_count': len(self.danmakus) }
+            return { 'timeline': [], 'peaks': [], 'episode_boundaries': episode_boundaries, 'total_count': self.danmaku_count }
 
         # --- 准备 full_timeline (逻辑不变，因为 time 已经是绝对秒数) ---
         # 创建一个查找函数或字典 (复用之前的逻辑，用于添加 page_id 到 timeline 点)
@@ -726,7 +790,7 @@ class DanmakuAnalyzer:
             'timeline': full_timeline,
             'peaks': all_peaks,
             'episode_boundaries': episode_boundaries,
-            'total_count': len(self.danmakus) # 或者用 valid_danmaku_count 更准确? 但 total_count 可能指数据库总数
+            'total_count': self.danmaku_count # 或者用 valid_danmaku_count 更准确? 但 total_count 可能指数据库总数
         }
 
         # --- 保存分析结果 (逻辑不变) ---
@@ -738,40 +802,109 @@ class DanmakuAnalyzer:
 
         return result
     
+    def _timeline_in_memory(self, page_start_times):
+        """按分P开始时间把内存中弹幕的相对进度换算为绝对秒数并计数，整列一次计算
+
+        Args:
+            page_start_times: {分P编号: 分P开始的绝对秒数}
+
+        Returns:
+            dict: {绝对秒数: 弹幕数}
+        """
+        page_ids = np.asarray(self.danmakus.page_id)
+        unique_pages, page_index = np.unique(page_ids, return_inverse=True)
+        page_starts = np.array([page_start_times.get(p, np.nan) for p in unique_pages.tolist()], dtype=np.float64)
+        starts = page_starts[page_index.ravel()]
+        located = ~np.isnan(starts)
+        if not located.all():
+            missing_pages = sorted(set(unique_pages.tolist()) - set(page_start_times))
+            logger.warning(f"{int((~located).sum())} 条弹幕的 page_id ({missing_pages}) 未在 boundaries 中找到，跳过")
+
+        # progress 是相对于分P的毫秒数，绝对秒数向零取整
+        absolute_secs = (starts[located] + np.asarray(self.danmakus.progress)[located] / 1000).astype(np.int64)
+        negative = absolute_secs < 0
+        if negative.any():
+            logger.warning(f"{int(negative.sum())} 条弹幕计算出的绝对秒数为负数，跳过")
+            absolute_secs = absolute_secs[~negative]
+        seconds, second_counts = np.unique(absolute_secs, return_counts=True)
+        return dict(zip(seconds.tolist(), second_counts.tolist()))
+
+    def _timeline_from_buckets(self, page_start_times):
+        """读取弹幕源入库时维护的每秒弹幕数，尚未建立时先按弹幕表重建
+
+        Args:
+            page_start_times: {分P编号: 分P开始的绝对秒数}
+
+        Returns:
+            dict: {绝对秒数: 弹幕数}，读取失败时返回None
+        """
+        try:
+            buckets = timeline.get_second_buckets(self.video.source)
+        except DatabaseError as e:
+            logger.warning(f"读取每秒弹幕数失败，回退到聚合弹幕表: {str(e)}")
+            return None
+        return self._absolute_timeline(buckets, page_start_times)
+
+    def _timeline_from_database(self, page_start_times):
+        """在数据库中按 (分P, FLOOR(progress/1000)) 分组计数，只有聚合后的行返回到应用
+
+        Args:
+            page_start_times: {分P编号: 分P开始的绝对秒数}
+
+        Returns:
+            dict: {绝对秒数: 弹幕数}，数据库不支持所需的 SQL 时返回None
+        """
+        try:
+            buckets = list(
+                self.video.danmakus.annotate(second=Floor(F('progress') / 1000))
+                .values('page_id', 'second').annotate(count=Count('id')).order_by()
+                .values_list('page_id', 'second', 'count')
+            )
+        except (DatabaseError, FieldError) as e:
+            logger.warning(f"数据库聚合时间线失败，回退到内存计算: {str(e)}")
+            return None
+        return self._absolute_timeline(buckets, page_start_times)
+
+    def _absolute_timeline(self, buckets, page_start_times):
+        """把 (分P, 分P内秒数, 弹幕数) 换算为绝对时间线 {绝对秒数: 弹幕数}"""
+        timeline_data = collections.defaultdict(int)
+        skipped = 0
+        for page_id, second, count in buckets:
+            page_start_sec = page_start_times.get(page_id)
+            if page_start_sec is None or second is None:
+                skipped += count
+                continue
+            absolute_sec = int(page_start_sec + second)
+            if absolute_sec >= 0:
+                timeline_data[absolute_sec] += count
+            else:
+                skipped += count
+        if skipped:
+            logger.warning(f"{skipped} 条弹幕无法定位到分P时间线，跳过")
+        return dict(timeline_data)
+
     def analyze_user_activity(self):
         """用户活跃度分析
         
         Returns:
             包含用户活跃度分析结果的字典
         """
-        # 按用户哈希统计弹幕数量
-        user_counts = {}
-        for d in self.danmakus:
-            if d.user_hash not in user_counts:
-                user_counts[d.user_hash] = 0
-            user_counts[d.user_hash] += 1
-        
-        # 转换为列表格式
-        users = [{'user_hash': u, 'count': c} for u, c in user_counts.items()]
-        users.sort(key=lambda x: x['count'], reverse=True)
-        
-        # 计算发送弹幕用户数
-        total_users = len(users)
+        # 弹幕未加载到内存时在数据库中按用户聚合，数据库不支持时回退到内存计算
+        activity = None
+        if self._danmakus is None and self.sql_pushdown:
+            activity = self._user_activity_from_database()
+        if activity is None:
+            activity = self._user_activity_in_memory()
+        users, total_users, distribution = activity
         
         # 计算平均每个用户发送弹幕数
-        avg_per_user = len(self.danmakus) / total_users if total_users > 0 else 0
+        avg_per_user = self.danmaku_count / total_users if total_users > 0 else 0
         
         result = {
-            'top_users': users[:20],  # 取前20个活跃用户
+            'top_users': users,  # 取前20个活跃用户
             'total_users': total_users,
             'avg_per_user': avg_per_user,
-            'user_distribution': {
-                '1条': sum(1 for u in users if u['count'] == 1),
-                '2-5条': sum(1 for u in users if 2 <= u['count'] <= 5),
-                '6-10条': sum(1 for u in users if 6 <= u['count'] <= 10),
-                '11-20条': sum(1 for u in users if 11 <= u['count'] <= 20),
-                '20条以上': sum(1 for u in users if u['count'] > 20),
-            }
+            'user_distribution': distribution,
         }
         
         # 保存分析结果
@@ -783,6 +916,54 @@ class DanmakuAnalyzer:
         
         return result
     
+    def _user_activity_in_memory(self, top_n=20):
+        """按用户编号统计内存中的弹幕
+
+        Returns:
+            tuple: (前 top_n 个活跃用户, 用户数, 发送条数分布)
+        """
+        # 稳定排序保持同样次数的用户按首次出现的顺序排列
+        user_counts = np.bincount(self.danmakus.user_id, minlength=len(self.danmakus.users))
+        order = np.argsort(-user_counts, kind='stable')
+        user_table = self.danmakus.users
+        users = [
+            {'user_hash': user_table[i].decode('utf-8', 'replace'), 'count': int(user_counts[i])}
+            for i in order[:top_n].tolist()
+        ]
+        distribution = {}
+        for label, low, high in USER_DISTRIBUTION_BUCKETS:
+            mask = user_counts >= low
+            if high:
+                mask &= user_counts <= high
+            distribution[label] = int(mask.sum())
+        return users, int((user_counts > 0).sum()), distribution
+
+    def _user_activity_from_database(self, top_n=20):
+        """在数据库中按 user_hash 分组计数，活跃用户用 ORDER BY ... LIMIT 取得，分布在同一查询中按区间计数
+
+        Returns:
+            tuple: (前 top_n 个活跃用户, 用户数, 发送条数分布)，数据库不支持所需的 SQL 时返回None
+        """
+        per_user = self.video.danmakus.values('user_hash').annotate(count=Count('id')).order_by()
+        buckets = {}
+        for i, (_, low, high) in enumerate(USER_DISTRIBUTION_BUCKETS):
+            condition = Q(count__gte=low) & Q(count__lte=high) if high else Q(count__gte=low)
+            buckets[f"bucket_{i}"] = Count('user_hash', filter=condition)
+        try:
+            # 同样次数的用户按首次出现的顺序排列，与内存计算一致
+            top_users = list(
+                per_user.annotate(first_progress=Min('progress'), first_id=Min('id'))
+                .order_by('-count', 'first_progress', 'first_id')[:top_n]
+            )
+            stats = per_user.aggregate(total_users=Count('user_hash'), **buckets)
+        except (DatabaseError, FieldError) as e:
+            logger.warning(f"数据库聚合用户活跃度失败，回退到内存计算: {str(e)}")
+            return None
+
+        users = [{'user_hash': u['user_hash'], 'count': u['count']} for u in top_users]
+        distribution = {label: stats[f"bucket_{i}"] for i, (label, _, _) in enumerate(USER_DISTRIBUTION_BUCKETS)}
+        return users, stats['total_users'], distribution
+
     def analyze_all(self, use_bert=True, batch_size=None, max_processing_time=300):
         """运行所有分析
         
@@ -829,7 +1010,7 @@ class DanmakuAnalyzer:
                     'title': self.video.title,
                     'author': self.video.owner,
                     'duration': self.video.duration,
-                    'danmaku_count': len(self.danmakus)
+                    'danmaku_count': self.danmaku_count
                 },
                 'keywords': keywords_result,
                 'sentiment': sentiment_result,
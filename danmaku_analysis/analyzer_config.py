@@ -99,4 +99,6 @@ PERFORMANCE = {
     'cache_ttl': 3600 * 24,         # 缓存有效期(秒)，默认1天
     'batch_processing': True,       # 是否使用批处理
     'timeout_seconds': 600,         # 分析超时时间(秒)
+    'sql_pushdown': True,           # 弹幕未加载到内存时，时间线和用户活跃度在数据库中聚合计算
+    'second_buckets': True,         # 时间线直接读取入库时维护的每秒弹幕数(DanmakuSecondBucket)
 } 
\ No newline at end of file
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DanmakuAnalysisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'danmaku_analysis'
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa: F401
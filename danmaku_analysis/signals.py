@@ -0,0 +1,17 @@
+import logging
+from django.dispatch import receiver
+
+from danmaku_crawler.signals import danmaku_ingested
+from .models import DanmakuAnalysis
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(danmaku_ingested)
+def invalidate_analysis_cache(sender, source, created_count=0, **kwargs):
+    """视频有新弹幕入库时作废引用该弹幕源的所有视频已缓存的分析结果，下次分析时重新计算"""
+    if not created_count:
+        return
+    deleted_count, _ = DanmakuAnalysis.objects.filter(video__source=source).delete()
+    if deleted_count:
+        logger.info(f"视频 {source.bvid} 新增 {created_count} 条弹幕，已作废 {deleted_count} 条缓存的分析结果")
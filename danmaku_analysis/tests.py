@@ -1,3 +1,134 @@
+"""
+弹幕分析的行为测试：弹幕加载、列式快照和时间线(含每秒弹幕数表)、用户活跃度的各条计算路径
+
+运行: python manage.py test danmaku_analysis --settings=danmaku_system.test_settings
+"""
+
+import tempfile
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from danmaku_crawler import columnar, crawler_config, danmu_pb2, ingest, snapshot
+from danmaku_crawler.models import VideoSource, Video, Danmaku
+from . import analyzer_config
+from .analyzer import DanmakuAnalyzer
+
+# 读取每秒弹幕数表、按数据库聚合、内存计算三种方式读取时间线的配置
+TIMELINE_PATHS = {
+    'buckets': {'second_buckets': True, 'sql_pushdown': True},
+    'database': {'second_buckets': False, 'sql_pushdown': True},
+    'memory': {'second_buckets': False, 'sql_pushdown': False},
+}
+
+
+def insert_danmakus(source, page_id, count, duration, start_dmid):
+    """向弹幕源的一个分P写入 count 条弹幕，中间一段时间弹幕密集"""
+    reply = danmu_pb2.DmSegMobileReply()
+    for i in range(count):
+        # 三分之一的弹幕集中在第 60~64 秒，形成峰值
+        stime = 60000 + i % 5000 if i % 3 == 0 else i * 7919 % (duration * 1000)
+        reply.elems.add(dmid=str(start_dmid + i), text=f"弹幕{i % 17}", stime=stime,
+                        date=1700000000 + i, uhash=f"user{i % 11 if i % 4 else 0}")
+    danmakus = columnar.decode_segment(reply.SerializeToString())
+    ingest.insert_rows(ingest.build_rows(danmakus, source.id, page_num=page_id, page_duration=duration))
+
+
+class AnalyzerTestCase(TestCase):
+    """分析器的弹幕加载、列式快照复用和各条计算路径"""
+
+    def setUp(self):
+        self.source = VideoSource.objects.create(bvid='BV1test00001', title='测试视频', owner='o', duration=900,
+                                                 second_buckets_ready=True)
+        insert_danmakus(self.source, 1, 900, 600, start_dmid=1)
+        insert_danmakus(self.source, 2, 300, 300, start_dmid=10001)
+        self.source.danmaku_count = 1200
+        self.source.save()
+        self.video = Video.objects.create(bvid=self.source.bvid, title=self.source.title, owner='o',
+                                          duration=900, source=self.source)
+        patcher = mock.patch.dict(crawler_config.SNAPSHOT, enabled=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def analyze(self, path, method):
+        with mock.patch.dict(analyzer_config.PERFORMANCE, TIMELINE_PATHS[path]):
+            return getattr(DanmakuAnalyzer(self.video), method)()
+
+    def test_load_reads_rows_and_pages_in_one_query(self):
+        analyzer = DanmakuAnalyzer(self.video)
+
+        with self.assertNumQueries(1):
+            analyzer.load_from_database()
+
+        self.assertEqual(len(analyzer.danmakus), 1200)
+        self.assertEqual(analyzer.page_info, [{'page_id': 1, 'duration': 600}, {'page_id': 2, 'duration': 300}])
+        progress = analyzer.danmakus.progress.tolist()
+        self.assertEqual(progress, sorted(progress))
+
+    def test_video_without_danmaku_is_rejected(self):
+        empty = Video.objects.create(bvid='BV1test00002', title='空视频', owner='o')
+        with self.assertRaises(ValueError):
+            DanmakuAnalyzer(empty)
+
+    def test_columns_match_rows(self):
+        danmakus = DanmakuAnalyzer(self.video).danmakus
+        rows = list(Danmaku.objects.filter(source=self.source).order_by('progress', 'id')
+                    .values_list('page_id', 'progress', 'content', 'user_hash'))
+
+        self.assertEqual([(d.page_id, d.progress, d.content, d.user_hash) for d in danmakus.records()], rows)
+        self.assertEqual(danmakus.texts(), [row[2] for row in rows])
+
+    def test_snapshot_written_on_analysis_is_reused(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source.last_crawled = timezone.now()
+        self.source.save()
+
+        with mock.patch.dict(crawler_config.SNAPSHOT, enabled=True, root=tmp.name), \
+                mock.patch.dict(analyzer_config.PERFORMANCE, sql_pushdown=False):
+            loaded = DanmakuAnalyzer(self.video)
+            mapped = DanmakuAnalyzer(self.video)
+
+            # 第二个分析器读取第一个分析器写入的快照，而不是再次查询数据库
+            self.assertIsNone(loaded.danmakus.meta.get('version'))
+            self.assertEqual(mapped.danmakus.meta.get('version'), snapshot.SNAPSHOT_VERSION)
+            self.assertEqual(mapped.page_info, loaded.page_info)
+            self.assertEqual(mapped.analyze_keywords(), loaded.analyze_keywords())
+            self.assertEqual(mapped.analyze_user_activity(), loaded.analyze_user_activity())
+
+    def test_timeline_paths_agree(self):
+        results = {path: self.analyze(path, 'analyze_timeline') for path in TIMELINE_PATHS}
+
+        expected = results.pop('memory')
+        self.assertEqual(sum(item['count'] for item in expected['timeline']), 1200)
+        self.assertEqual([b['start_time_sec'] for b in expected['episode_boundaries']], [0, 600])
+        self.assertTrue(expected['peaks'])
+        for path, result in results.items():
+            with self.subTest(path=path):
+                self.assertEqual(result['timeline'], expected['timeline'])
+                self.assertEqual(result['peaks'], expected['peaks'])
+                self.assertEqual(result['episode_boundaries'], expected['episode_boundaries'])
+
+    def test_second_page_is_offset_by_first_page_duration(self):
+        timeline = self.analyze('buckets', 'analyze_timeline')['timeline']
+
+        second_page = [item for item in timeline if item['page_id'] == 2]
+        self.assertEqual(sum(item['count'] for item in second_page), 300)
+        self.assertTrue(all(item['time'] >= 600 for item in second_page))
+
+    def test_user_activity_paths_agree(self):
+        database = self.analyze('database', 'analyze_user_activity')
+        memory = self.analyze('memory', 'analyze_user_activity')
+
+        self.assertEqual(database, memory)
+        self.assertEqual(memory['total_users'], 11)
+        self.assertEqual(memory['top_users'][0]['user_hash'], 'user0')
+
+    def test_pushdown_does_not_load_rows(self):
+        with mock.patch.dict(analyzer_config.PERFORMANCE, TIMELINE_PATHS['database']):
+            analyzer = DanmakuAnalyzer(self.video)
+            analyzer.analyze_timeline()
+            analyzer.analyze_user_activity()
 
-# Create your tests here.
+        self.assertIsNone(analyzer._danmakus)
@@ -1,5 +1,12 @@
 from django.contrib import admin
-from .models import Video, Danmaku, CrawlTask
+from .models import VideoSource, Video, Danmaku, DanmakuText, DanmakuSecondBucket, CleaningRuleStat, CrawlBatch, CrawlTask, CrawlWatermark, CrawlCheckpoint
+
+@admin.register(VideoSource)
+class VideoSourceAdmin(admin.ModelAdmin):
+    list_display = ('title', 'bvid', 'owner', 'duration', 'danmaku_count', 'unique_text_count', 'text_cluster_count', 'second_buckets_ready', 'created_at', 'last_crawled')
+    search_fields = ('title', 'bvid', 'owner')
+    list_filter = ('created_at', 'last_crawled')
+    readonly_fields = ('created_at',)
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
@@ -8,21 +15,61 @@ class VideoAdmin(admin.ModelAdmin):
     list_filter = ('created_at', 'last_crawled')
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at',)
+    raw_id_fields = ('source',)
 
 @admin.register(Danmaku)
 class DanmakuAdmin(admin.ModelAdmin):
-    list_display = ('content', 'video', 'progress', 'send_time', 'mode', 'color')
-    search_fields = ('content', 'video__title', 'video__bvid')
+    list_display = ('content', 'source', 'progress', 'send_time', 'mode', 'color')
+    search_fields = ('content', 'source__title', 'source__bvid')
     list_filter = ('send_time', 'mode', 'color')
     date_hierarchy = 'send_time'
     readonly_fields = ('created_at',)
-    raw_id_fields = ('video',)
+    raw_id_fields = ('source',)
+
+@admin.register(DanmakuText)
+class DanmakuTextAdmin(admin.ModelAdmin):
+    list_display = ('text', 'canonical', 'source', 'count', 'cluster_hash')
+    search_fields = ('text', 'canonical', 'source__bvid')
+    raw_id_fields = ('source',)
+
+@admin.register(DanmakuSecondBucket)
+class DanmakuSecondBucketAdmin(admin.ModelAdmin):
+    list_display = ('source', 'page_id', 'second', 'count')
+    search_fields = ('source__bvid',)
+    raw_id_fields = ('source',)
+
+@admin.register(CleaningRuleStat)
+class CleaningRuleStatAdmin(admin.ModelAdmin):
+    list_display = ('name', 'count')
+    search_fields = ('name',)
+
+@admin.register(CrawlBatch)
+class CrawlBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'user', 'priority', 'created_at')
+    search_fields = ('name',)
+    list_filter = ('created_at',)
+    readonly_fields = ('created_at',)
 
 @admin.register(CrawlTask)
 class CrawlTaskAdmin(admin.ModelAdmin):
-    list_display = ('id', 'video', 'status', 'created_at', 'started_at', 'completed_at', 'danmaku_count')
+    list_display = ('id', 'video', 'status', 'priority', 'created_at', 'started_at', 'completed_at', 'danmaku_count', 'worker_id', 'attempts')
     search_fields = ('video__title', 'video__bvid', 'error_message')
+    exclude = ('cookie_str',)
     list_filter = ('status', 'created_at')
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at',)
-    raw_id_fields = ('video',)
+    raw_id_fields = ('video', 'leader', 'batch')
+
+@admin.register(CrawlWatermark)
+class CrawlWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('source', 'page_id', 'cid', 'max_send_time', 'max_dmid', 'danmaku_count', 'updated_at')
+    search_fields = ('source__title', 'source__bvid')
+    readonly_fields = ('updated_at',)
+    raw_id_fields = ('source',)
+
+@admin.register(CrawlCheckpoint)
+class CrawlCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('task', 'page_id', 'cid', 'segment_index', 'danmaku_count', 'created_at')
+    list_filter = ('created_at',)
+    readonly_fields = ('created_at',)
+    raw_id_fields = ('task',)
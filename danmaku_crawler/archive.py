@@ -0,0 +1,222 @@
+"""
+原始弹幕分段归档
+按内容寻址保存每次抓取到的 seg.so protobuf 原始响应(zstd 压缩，不可用时退回 gzip)，
+清洗规则或弹幕表结构变更后可以从归档离线重放解析、清洗和入库，无需重新请求B站。
+
+目录结构:
+    objects/<sha256前两位>/<sha256>.<zst|gz>   压缩后的原始响应，内容相同的分段只保存一份
+    index/<cid>.jsonl                          每次抓取的记录: 分段页码、抓取时间、内容摘要
+    videos/<bvid>.json                         视频的分P列表(cid、时长)，重放时确定分P编号
+"""
+
+import os
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from django.conf import settings
+
+from . import columnar
+from . import crawler_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_EXTENSIONS = {
+    'zstd': 'zst',
+    'gzip': 'gz',
+}
+
+
+class SegmentArchive:
+    """内容寻址的原始分段归档"""
+
+    def __init__(self, root, compression='zstd', level=3):
+        """初始化归档
+
+        Args:
+            root: 归档根目录
+            compression: 压缩方式，'zstd' 或 'gzip'
+            level: 压缩级别
+        """
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("未安装 zstandard，原始分段归档改用 gzip 压缩")
+            compression = 'gzip'
+        if compression not in CODEC_EXTENSIONS:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+
+        self.root = str(root)
+        self.compression = compression
+        self.level = level
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest, codec):
+        return os.path.join(self.root, 'objects', digest[:2], f"{digest}.{CODEC_EXTENSIONS[codec]}")
+
+    def _index_path(self, cid):
+        return os.path.join(self.root, 'index', f"{cid}.jsonl")
+
+    def _video_path(self, bvid):
+        return os.path.join(self.root, 'videos', f"{bvid}.json")
+
+    def _write_atomic(self, path, data):
+        """先写临时文件再改名，多个进程同时写同一对象时不会读到半个文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def compress(self, payload):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(payload)
+        return gzip.compress(payload, compresslevel=self.level)
+
+    def decompress(self, data, codec):
+        if codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("读取 zstd 归档需要安装 zstandard")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def put_segment(self, cid, segment_index, payload, fetched_at=None):
+        """归档一个分段的原始响应
+
+        Args:
+            cid: 分P的cid
+            segment_index: 分段页码
+            payload: seg.so 原始响应内容
+            fetched_at: 抓取时间戳(秒)，默认当前时间
+
+        Returns:
+            dict: 写入索引的记录
+        """
+        digest = hashlib.sha256(payload).hexdigest()
+        path = self._object_path(digest, self.compression)
+        if not os.path.exists(path):
+            self._write_atomic(path, self.compress(payload))
+
+        entry = {
+            'cid': cid,
+            'segment': segment_index,
+            'fetched_at': round(fetched_at or time.time(), 3),
+            'sha256': digest,
+            'size': len(payload),
+            'codec': self.compression,
+        }
+        index_path = self._index_path(cid)
+        with self._lock:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            # 单行追加写，多个进程同时追加也不会交错
+            with open(index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def save_parts(self, bvid, aid, parts, info=None):
+        """记录视频的分P列表
+
+        Args:
+            bvid: BV号
+            aid: 视频aid
+            parts: [{'cid': cid, 'duration': duration}, ...]，顺序即分P编号
+            info: 视频信息 {'title', 'owner', 'owner_mid', 'duration'}，数据库中没有弹幕源时用于重建
+        """
+        data = {'bvid': bvid, 'aid': aid, 'parts': parts, 'info': info or {}}
+        self._write_atomic(self._video_path(bvid), json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def load_video(self, bvid):
+        """读取视频的归档记录 {'bvid', 'aid', 'parts', 'info'}，未归档时返回None"""
+        try:
+            with open(self._video_path(bvid), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_parts(self, bvid):
+        """读取视频的分P列表，未归档时返回None"""
+        video = self.load_video(bvid)
+        return video['parts'] if video else None
+
+    def list_videos(self):
+        """已归档分P列表的全部BV号"""
+        videos_dir = os.path.join(self.root, 'videos')
+        if not os.path.isdir(videos_dir):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(videos_dir) if name.endswith('.json'))
+
+    def latest_entries(self, cid, before=None):
+        """每个分段最近一次抓取的记录，按页码排序
+
+        Args:
+            cid: 分P的cid
+            before: 只使用该时间戳(秒)之前的抓取记录，默认不限
+
+        Returns:
+            list: 索引记录列表
+        """
+        latest = {}
+        try:
+            with open(self._index_path(cid), encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    if before is not None and entry['fetched_at'] > before:
+                        continue
+                    current = latest.get(entry['segment'])
+                    if current is None or entry['fetched_at'] >= current['fetched_at']:
+                        latest[entry['segment']] = entry
+        except FileNotFoundError:
+            return []
+        return [latest[segment] for segment in sorted(latest)]
+
+    def read_segment(self, entry):
+        """读取并解压索引记录对应的原始响应"""
+        with open(self._object_path(entry['sha256'], entry['codec']), 'rb') as f:
+            return self.decompress(f.read(), entry['codec'])
+
+    def iter_segments(self, parts, before=None):
+        """按分P、页码顺序重放归档的分段
+
+        产出格式与 BilibiliDanmakuCrawler.iter_segments 相同，可直接交给 ingest_segments 入库。
+
+        Args:
+            parts: [(分P编号, {'cid': cid, 'duration': duration}), ...]
+            before: 只重放该时间戳(秒)之前的抓取记录，默认使用最近一次抓取
+
+        Yields:
+            tuple: (分P编号, cid_info, 页码, 弹幕列表, 该分P是否已全部产出)
+        """
+        for index, cid_info in parts:
+            entries = self.latest_entries(cid_info['cid'], before)
+            if not entries:
+                logger.warning(f"第 {index} 集(cid={cid_info['cid']})没有归档的分段")
+                yield index, cid_info, None, [], True
+                continue
+            for position, entry in enumerate(entries, start=1):
+                danmakus = columnar.decode_segment(self.read_segment(entry))
+                yield index, cid_info, entry['segment'], danmakus, position == len(entries)
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_segment_archive():
+    """按配置创建进程内共享的归档实例"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                config = crawler_config.ARCHIVE
+                root = config.get('root') or os.path.join(settings.BASE_DIR, 'segment_archive')
+                _archive = SegmentArchive(root, config.get('compression', 'zstd'), config.get('level', 3))
+    return _archive
@@ -0,0 +1,213 @@
+"""
+弹幕清洗规则引擎
+清洗规则在 crawler_config.CLEANING 中声明，进程内只编译一次：
+按列计算的规则(进度、长度)对整批弹幕生成掩码，正则和关键词规则合并为一个正则，
+只对前面规则保留下来的弹幕逐条匹配一次。
+
+每条规则的过滤数累计在进程内，入库结束时用 UPDATE ... SET count = count + n 原子累加到 CleaningRuleStat 表，
+多个爬取进程同时汇总也不会丢失计数；manage.py cleaning_stats 可以查看各规则在真实流量上的过滤情况。
+"""
+
+import re
+import logging
+import threading
+from collections import Counter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+
+from . import crawler_config
+from .columnar import as_columns
+from .models import CleaningRuleStat
+
+logger = logging.getLogger(__name__)
+
+# 按列计算的规则类型
+COLUMN_RULE_TYPES = ('progress', 'length')
+# 合并为一个正则逐条匹配的规则类型
+PATTERN_RULE_TYPES = ('regex', 'keywords')
+
+class CleaningEngine:
+    """编译后的弹幕清洗规则"""
+
+    def __init__(self, rules):
+        """编译清洗规则
+
+        Args:
+            rules: 规则列表，格式见 crawler_config.CLEANING
+
+        Raises:
+            ValueError: 规则类型未知或规则名重复
+        """
+        self.rule_names = []
+        self.column_rules = []
+        patterns = []
+        self.group_rules = {}
+
+        for rule in rules:
+            name, rule_type = rule['name'], rule['type']
+            if name in self.rule_names or name in ('total', 'kept'):
+                raise ValueError(f"清洗规则名重复或使用了保留名: {name}")
+            self.rule_names.append(name)
+
+            if rule_type in COLUMN_RULE_TYPES:
+                self.column_rules.append({
+                    'name': name,
+                    'type': rule_type,
+                    'min': rule.get('min', 0),
+                    'max': rule.get('max'),
+                    'except': frozenset(rule.get('except', ())),
+                })
+            elif rule_type in PATTERN_RULE_TYPES:
+                if rule_type == 'regex':
+                    pattern = rule['pattern']
+                else:
+                    pattern = '|'.join(re.escape(word) for word in rule['words'])
+                group = f"r{len(self.group_rules)}"
+                self.group_rules[group] = name
+                patterns.append(f"(?P<{group}>{pattern})")
+            else:
+                raise ValueError(f"未知的清洗规则类型: {rule_type}")
+
+        self.pattern = re.compile('|'.join(patterns)) if patterns else None
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._pending = Counter()
+
+    def _column_mask(self, rule, danmakus, lengths, page_duration):
+        if rule['type'] == 'progress':
+            # 弹幕进度单位为毫秒，分P时长未知时不判断
+            if not page_duration:
+                return None
+            return danmakus.stime > page_duration * 1000
+
+        mask = lengths >= rule['min']
+        if rule['max'] is not None:
+            mask &= lengths <= rule['max']
+        if rule['except']:
+            texts = danmakus.text
+            for i in np.flatnonzero(mask).tolist():
+                if texts[i] in rule['except']:
+                    mask[i] = False
+        return mask
+
+    def clean(self, danmakus, page_duration=0):
+        """
+        按规则过滤一批弹幕，每条被过滤的弹幕计入第一条命中的规则
+
+        按列计算的规则按声明顺序先执行，正则和关键词规则最后合并匹配。
+
+        Args:
+            danmakus: 列式弹幕或弹幕对象列表
+            page_duration: 分P时长(秒)
+
+        Returns:
+            tuple: (保留的列式弹幕, {规则名: 过滤条数})
+        """
+        danmakus = as_columns(danmakus)
+        total = len(danmakus)
+        dropped = Counter()
+        if not total:
+            return danmakus, dropped
+
+        keep = np.ones(total, dtype=bool)
+        lengths = danmakus.text_lengths()
+        for rule in self.column_rules:
+            mask = self._column_mask(rule, danmakus, lengths, page_duration)
+            if mask is None:
+                continue
+            mask &= keep
+            hits = int(mask.sum())
+            if hits:
+                dropped[rule['name']] += hits
+                keep &= ~mask
+
+        if self.pattern is not None:
+            indices = np.flatnonzero(keep).tolist()
+            texts = danmakus.text
+            matches = map(self.pattern.search, [texts[i] for i in indices])
+            for i, match in zip(indices, matches):
+                if match is not None:
+                    keep[i] = False
+                    dropped[self.group_rules[match.lastgroup]] += 1
+
+        cleaned = danmakus.take(keep)
+        self.record(total, len(cleaned), dropped)
+        return cleaned, dropped
+
+    def record(self, total, kept, dropped):
+        with self._lock:
+            for counter in (self._stats, self._pending):
+                counter['total'] += total
+                counter['kept'] += kept
+                counter.update(dropped)
+
+    def get_stats(self):
+        """本进程启动以来的累计统计 {'total': 总数, 'kept': 保留数, 规则名: 过滤数}"""
+        with self._lock:
+            return dict(self._stats)
+
+    def flush_stats(self):
+        """把尚未汇总的统计原子累加到数据库，供其他进程查看；写入失败时计数留到下次汇总"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        pending = {name: count for name, count in pending.items() if count}
+        if not pending:
+            return
+        try:
+            # 按规则名顺序加锁，多个进程同时汇总时不会死锁
+            with transaction.atomic():
+                for name, count in sorted(pending.items()):
+                    if not CleaningRuleStat.objects.filter(name=name).update(count=F('count') + count):
+                        _, created = CleaningRuleStat.objects.get_or_create(name=name, defaults={'count': count})
+                        if not created:
+                            # 其他进程刚创建了该规则的记录
+                            CleaningRuleStat.objects.filter(name=name).update(count=F('count') + count)
+        except Exception as e:
+            logger.warning(f"汇总弹幕清洗统计失败: {str(e)}")
+            with self._lock:
+                self._pending.update(pending)
+
+
+def get_cleaning_stats(rule_names=None):
+    """
+    读取各进程汇总到数据库中的清洗统计
+
+    Args:
+        rule_names: 规则名列表，默认使用当前配置中的规则
+
+    Returns:
+        dict: {'total': 总数, 'kept': 保留数, 'rules': {规则名: 过滤数}}
+    """
+    if rule_names is None:
+        rule_names = [rule['name'] for rule in crawler_config.CLEANING['rules']]
+    names = ['total', 'kept'] + list(rule_names)
+    values = dict(CleaningRuleStat.objects.filter(name__in=names).values_list('name', 'count'))
+    counts = {name: values.get(name, 0) for name in names}
+    return {
+        'total': counts.pop('total'),
+        'kept': counts.pop('kept'),
+        'rules': counts,
+    }
+
+
+def reset_cleaning_stats(rule_names=None):
+    """清空数据库中的清洗统计"""
+    if rule_names is None:
+        rule_names = [rule['name'] for rule in crawler_config.CLEANING['rules']]
+    CleaningRuleStat.objects.filter(name__in=['total', 'kept'] + list(rule_names)).delete()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_cleaning_engine():
+    """按配置编译进程内共享的清洗引擎"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = CleaningEngine(crawler_config.CLEANING['rules'])
+    return _engine
@@ -0,0 +1,406 @@
+"""
+列式弹幕解码
+把 seg.so 分段解码为按列存放的弹幕(数值字段为 NumPy 数组，文本字段为列表)，
+清洗、增量去重和入库行构造都按整列向量化处理，不再为每条弹幕逐个读取 protobuf 消息属性。
+
+分段直接按 protobuf 线格式解码：先顺序扫描出每条弹幕消息的字节范围，再对全部弹幕同时
+逐个字段解码 varint 和长度前缀，文本列按字节范围拼接后一次解码为字符串。
+遇到非预期的编码时退回 protobuf 解析器。
+"""
+
+import operator
+import collections
+import numpy as np
+
+from . import danmu_pb2
+
+# 数值列及其类型，dmid 不是数字的弹幕记为 0
+NUMERIC_COLUMNS = {
+    'dmid': np.int64,
+    'date': np.int64,
+    'stime': np.int64,
+    'mode': np.int32,
+    'size': np.int32,
+    'color': np.int64,
+    'weight': np.int32,
+}
+
+# 文本列
+TEXT_COLUMNS = ('text', 'uhash')
+
+INT64_LIMIT = 2 ** 63
+
+COLUMNS = ('dmid', 'text', 'date', 'stime', 'mode', 'size', 'color', 'uhash', 'weight')
+
+# DmSegMobileReply.elems 的字段标签(字段1，长度前缀)
+ELEMS_TAG = 0x0a
+# DanmakuElem 中需要解码的字段(见 danmu.proto): 字段编号 -> (列名, 线格式类型)
+ELEM_FIELDS = {
+    2: ('stime', 0),
+    3: ('mode', 0),
+    4: ('size', 0),
+    5: ('color', 0),
+    6: ('uhash', 2),
+    7: ('text', 2),
+    8: ('date', 0),
+    9: ('weight', 0),
+    12: ('dmid', 2),
+}
+# 字段标签 (字段编号 << 3 | 线格式类型) 到解码结果行号的查找表，第0行存放不需要的字段
+FIELD_ROWS = np.zeros(256, dtype=np.intp)
+for _row, (_number, (_name, _wire_type)) in enumerate(ELEM_FIELDS.items(), start=1):
+    FIELD_ROWS[_number << 3 | _wire_type] = _row
+ROW_OF = {name: row for row, (name, _) in enumerate(ELEM_FIELDS.values(), start=1)}
+# 数字字符串弹幕ID按向量化方式解析的最大长度，更长的可能超出 int64
+MAX_VECTOR_DMID_DIGITS = 18
+# 按位数右对齐后各位的权重
+DMID_POWERS = 10 ** np.arange(MAX_VECTOR_DMID_DIGITS, dtype=np.int64)
+# 读取 varint 时越过分段末尾的余量
+PADDING = bytes(16)
+
+# 逐条访问时产出的记录，字段与 protobuf 弹幕同名，dmid 为字符串
+DanmakuRecord = collections.namedtuple('DanmakuRecord', COLUMNS)
+
+
+def parse_dmids(dmids):
+    """将字符串弹幕ID批量转换为整数数组，空值和非数字ID记为 0"""
+    try:
+        values = np.array(list(map(int, dmids)), dtype=np.int64)
+        if len(values) == 0 or values.min() > 0:
+            return values
+    except (ValueError, OverflowError):
+        pass
+    return np.array(
+        [int(d) if d.isdigit() and int(d) < INT64_LIMIT else 0 for d in dmids], dtype=np.int64
+    )
+
+
+class DanmakuColumns:
+    """按列存放的一批弹幕"""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, dmid, text, date, stime, mode, size, color, uhash, weight):
+        self.dmid = dmid
+        self.text = text
+        self.date = date
+        self.stime = stime
+        self.mode = mode
+        self.size = size
+        self.color = color
+        self.uhash = uhash
+        self.weight = weight
+
+    @classmethod
+    def empty(cls):
+        columns = {name: np.empty(0, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+        columns.update({name: [] for name in TEXT_COLUMNS})
+        return cls(**columns)
+
+    @classmethod
+    def from_elems(cls, elems):
+        """
+        由弹幕对象序列(protobuf 弹幕或同名字段的记录)构造，每列一次批量读取
+
+        Args:
+            elems: 弹幕对象序列
+
+        Returns:
+            DanmakuColumns: 列式弹幕
+        """
+        if isinstance(elems, cls):
+            return elems
+        elems = list(elems)
+        count = len(elems)
+        columns = {
+            name: np.fromiter(map(operator.attrgetter(name), elems), dtype=dtype, count=count)
+            for name, dtype in NUMERIC_COLUMNS.items() if name != 'dmid'
+        }
+        columns['dmid'] = parse_dmids(list(map(operator.attrgetter('dmid'), elems)))
+        for name in TEXT_COLUMNS:
+            columns[name] = list(map(operator.attrgetter(name), elems))
+        return cls(**columns)
+
+    @classmethod
+    def concat(cls, batches):
+        """按顺序拼接多批列式弹幕"""
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        columns = {name: np.concatenate([getattr(b, name) for b in batches]) for name in NUMERIC_COLUMNS}
+        for name in TEXT_COLUMNS:
+            columns[name] = [value for b in batches for value in getattr(b, name)]
+        return cls(**columns)
+
+    def __len__(self):
+        return len(self.text)
+
+    def __iter__(self):
+        """逐条产出 DanmakuRecord，供需要弹幕对象的 ORM 入库方式使用"""
+        dmids = [str(d) if d else '' for d in self.dmid.tolist()]
+        return map(DanmakuRecord._make, zip(
+            dmids, self.text, self.date.tolist(), self.stime.tolist(), self.mode.tolist(),
+            self.size.tolist(), self.color.tolist(), self.uhash, self.weight.tolist()
+        ))
+
+    def take(self, selector):
+        """
+        按布尔掩码或下标数组选取弹幕
+
+        Args:
+            selector: 布尔掩码或整数下标数组
+
+        Returns:
+            DanmakuColumns: 选中的弹幕，全部选中时返回自身
+        """
+        selector = np.asarray(selector)
+        if selector.dtype == bool:
+            if selector.all():
+                return self
+            selector = np.flatnonzero(selector)
+        columns = {name: getattr(self, name)[selector] for name in NUMERIC_COLUMNS}
+        indices = selector.tolist()
+        for name in TEXT_COLUMNS:
+            values = getattr(self, name)
+            columns[name] = [values[i] for i in indices]
+        return self.__class__(**columns)
+
+    def text_lengths(self):
+        """每条弹幕的文本长度"""
+        return np.fromiter(map(len, self.text), dtype=np.int64, count=len(self.text))
+
+
+def as_columns(danmakus):
+    """将任意弹幕序列统一为列式弹幕"""
+    if isinstance(danmakus, DanmakuColumns):
+        return danmakus
+    return DanmakuColumns.from_elems(danmakus or [])
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 70:
+            raise ValueError("varint 过长")
+
+
+def _element_ranges(payload):
+    """顺序扫描分段的顶层字段，返回每条弹幕消息的 (起始, 结束) 字节位置数组"""
+    starts = []
+    ends = []
+    pos = 0
+    size = len(payload)
+    while pos < size:
+        # 弹幕消息通常短于128字节，标签和长度各占一个字节
+        if payload[pos] == ELEMS_TAG and payload[pos + 1] < 0x80:
+            start = pos + 2
+            pos = start + payload[pos + 1]
+            starts.append(start)
+            ends.append(pos)
+            continue
+        tag, pos = _read_varint(payload, pos)
+        wire_type = tag & 7
+        if wire_type == 2:
+            length, pos = _read_varint(payload, pos)
+            if tag == ELEMS_TAG:
+                starts.append(pos)
+                ends.append(pos + length)
+            pos += length
+        elif wire_type == 0:
+            _, pos = _read_varint(payload, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError(f"不支持的线格式类型: {wire_type}")
+    if pos != size:
+        raise ValueError("分段数据被截断")
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def _varints(buf, pos):
+    """
+    批量解码一组位置上的 varint
+
+    Args:
+        buf: 分段字节(uint8 数组，末尾留有余量)
+        pos: varint 起始位置数组
+
+    Returns:
+        tuple: (值 uint64 数组, 占用字节数数组)
+    """
+    byte = buf[pos]
+    value = (byte & 0x7f).astype(np.uint64)
+    size = np.ones(len(pos), dtype=np.int64)
+    more = np.flatnonzero(byte >= 0x80)
+    shift = 7
+    while len(more):
+        if shift >= 70:
+            raise ValueError("varint 过长")
+        byte = buf[pos[more] + size[more]]
+        value[more] |= (byte & 0x7f).astype(np.uint64) << np.uint64(shift)
+        size[more] += 1
+        more = more[byte >= 0x80]
+        shift += 7
+    return value, size
+
+
+def _decode_fields(buf, starts, ends):
+    """
+    对全部弹幕消息同时逐个字段解码，每轮处理每条消息的下一个字段
+
+    Returns:
+        tuple: (值数组, 值起始位置数组)，形状均为 (len(ELEM_FIELDS) + 1, 弹幕数)；
+        varint 字段的值为字段值，长度前缀字段的值为长度
+    """
+    count = len(starts)
+    rows_count = len(ELEM_FIELDS) + 1
+    values = np.zeros(rows_count * count, dtype=np.uint64)
+    offsets = np.zeros(rows_count * count, dtype=np.int64)
+    # 只保留仍有字段未解码的消息的位置和结束位置，每轮后压缩
+    keep = starts < ends
+    active = np.flatnonzero(keep)
+    pos = starts[keep]
+    end = ends[keep]
+    while len(active):
+        tag = buf[pos]
+        if (tag >= 0x80).any():
+            tag, tag_size = _varints(buf, pos)
+            field_pos = pos + tag_size
+        else:
+            tag = tag.astype(np.uint64)
+            field_pos = pos + 1
+        wire_type = tag & np.uint64(7)
+        has_varint = wire_type == 0
+        has_varint |= wire_type == 2
+        if has_varint.all():
+            value, size = _varints(buf, field_pos)
+            step = size + np.where(wire_type == 2, value, 0).astype(np.int64)
+        else:
+            value = np.zeros(len(active), dtype=np.uint64)
+            size = np.zeros(len(active), dtype=np.int64)
+            value[has_varint], size[has_varint] = _varints(buf, field_pos[has_varint])
+            step = np.select(
+                [wire_type == 0, wire_type == 2, wire_type == 1, wire_type == 5],
+                [size, size + value.astype(np.int64), 8, 4],
+                -1,
+            )
+            if (step < 0).any():
+                raise ValueError("不支持的线格式类型或长度")
+
+        # 同一字段出现多次时后出现的值生效，与 protobuf 解析器一致
+        flat = FIELD_ROWS[np.minimum(tag, np.uint64(255)).astype(np.intp)] * count + active
+        values[flat] = value
+        offsets[flat] = field_pos + size
+
+        pos = field_pos + step
+        keep = pos < end
+        if not keep.all():
+            if (pos[~keep] != end[~keep]).any():
+                raise ValueError("弹幕消息长度不一致")
+            active = active[keep]
+            pos = pos[keep]
+            end = end[keep]
+    return values.reshape(rows_count, count), offsets.reshape(rows_count, count)
+
+
+def _decode_strings(buf, starts, lengths):
+    """把一组字节范围一次解码为字符串列表"""
+    count = len(starts)
+    if not count:
+        return []
+    # 每个字符串后追加一个 \x00 作为分隔符，拼接后整体解码再切分。
+    # 拼接结果的第 j 个字节取自 buf[cumsum(step)[j]]：字符串内部逐字节前进，
+    # 每个字符串的第一个字节从上一个字符串末尾跳到自己的起始位置
+    spans = lengths + 1
+    item_ends = np.cumsum(spans)
+    step = np.ones(int(item_ends[-1]), dtype=np.int64)
+    step[0] = starts[0]
+    step[item_ends[:-1]] = starts[1:] - (starts[:-1] + lengths[:-1])
+    joined = buf[np.cumsum(step)]
+    joined[item_ends - 1] = 0
+    parts = joined.tobytes().decode('utf-8').split('\x00')
+    if len(parts) != count + 1:
+        # 字符串本身含有 \x00 时逐条解码
+        return [bytes(buf[s:s + n]).decode('utf-8') for s, n in zip(starts.tolist(), lengths.tolist())]
+    parts.pop()
+    return parts
+
+
+def _decode_dmids(buf, starts, lengths):
+    """把数字字符串弹幕ID直接从字节解析为整数，其余ID按 parse_dmids 的规则逐条解析"""
+    count = len(starts)
+    result = np.zeros(count, dtype=np.int64)
+    vector = (lengths > 0) & (lengths <= MAX_VECTOR_DMID_DIGITS)
+    if vector.any():
+        # 按最长的ID右对齐读取数字，左侧不足的位置为0
+        width = int(lengths[vector].max())
+        columns = np.arange(width)
+        digits = buf[np.maximum(starts + lengths - width, 0)[:, None] + columns] - np.uint8(ord('0'))
+        digits[columns < (width - lengths)[:, None]] = 0
+        vector &= (digits <= 9).all(axis=1)
+        numbers = digits.astype(np.int64) @ DMID_POWERS[width - 1::-1]
+        result[vector] = numbers[vector]
+    rest = np.flatnonzero(~vector & (lengths > 0))
+    if len(rest):
+        result[rest] = parse_dmids(_decode_strings(buf, starts[rest], lengths[rest]))
+    return result
+
+
+def _decode_wire(payload):
+    """按线格式直接把分段解码为列式弹幕，遇到非预期的编码时抛出 ValueError 或 IndexError"""
+    starts, ends = _element_ranges(payload)
+    if not len(starts):
+        return DanmakuColumns.empty()
+    buf = np.frombuffer(payload + PADDING, dtype=np.uint8)
+    values, offsets = _decode_fields(buf, starts, ends)
+
+    def signed(name, dtype):
+        # int32/int64 的负数按64位补码编码，截取低位即得到原值
+        return values[ROW_OF[name]].view(np.int64).astype(dtype)
+
+    def text(name):
+        row = ROW_OF[name]
+        lengths = values[row].astype(np.int64)
+        return offsets[row], lengths
+
+    return DanmakuColumns(
+        dmid=_decode_dmids(buf, *text('dmid')),
+        text=_decode_strings(buf, *text('text')),
+        date=signed('date', np.int64),
+        stime=signed('stime', np.int32).astype(np.int64),
+        mode=signed('mode', np.int32),
+        size=signed('size', np.int32),
+        color=(values[ROW_OF['color']] & np.uint64(0xffffffff)).astype(np.int64),
+        uhash=_decode_strings(buf, *text('uhash')),
+        weight=signed('weight', np.int32),
+    )
+
+
+def decode_segment(payload):
+    """
+    将 seg.so 原始响应解码为列式弹幕
+
+    Args:
+        payload: DmSegMobileReply protobuf 数据
+
+    Returns:
+        DanmakuColumns: 列式弹幕
+    """
+    try:
+        return _decode_wire(bytes(payload))
+    except (ValueError, IndexError):
+        # 截断或含有 group 等非预期编码的数据交给 protobuf 解析器，由它报告错误
+        pass
+    reply = danmu_pb2.DmSegMobileReply()
+    reply.ParseFromString(payload)
+    return DanmakuColumns.from_elems(reply.elems)
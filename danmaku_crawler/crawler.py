@@ -1,37 +1,96 @@
 import re
-import time
+import math
+import functools
+import operator
 import json
 import logging
-import requests
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from django.utils import timezone
 from django.db import transaction
 from django.conf import settings
+from django.core.cache import cache
 
-from .models import Video, Danmaku, CrawlTask
-from . import danmu_pb2
+from .models import VideoSource, Video, Danmaku, DanmakuText, DanmakuTextBand, CrawlTask, CrawlWatermark, CrawlCheckpoint
+from .signals import danmaku_ingested
+from . import columnar
 from . import wbisign
+from . import crawler_config
+from . import http_client
+from .http_client import get_http_client
+from .archive import get_segment_archive
+from .cleaning import get_cleaning_engine
+from .writer import DanmakuWriter
+from . import ingest
+from . import dedup
+from . import snapshot
+from . import timeline
 
 logger = logging.getLogger(__name__)
 
+BV_PATTERN = re.compile(r'BV\w{10}')
+
+
+def parse_bvid(url):
+    """从URL或字符串中提取BV号，没有时返回None"""
+    match = BV_PATTERN.search(url)
+    return match.group(0) if match else None
+
+
+_segment_pool = None
+_segment_pool_lock = threading.Lock()
+
+
+def get_segment_pool():
+    """获取进程内共享的分段请求线程池，线程数读取 crawler_config.CONCURRENCY['segment_workers']"""
+    global _segment_pool
+    if _segment_pool is None:
+        with _segment_pool_lock:
+            if _segment_pool is None:
+                workers = crawler_config.CONCURRENCY.get('segment_workers', 8)
+                _segment_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='danmaku-segment')
+    return _segment_pool
+
+
+class SegmentFetchError(Exception):
+    """弹幕分段重试后仍获取失败，与没有弹幕的空分段区分"""
+    
+    def __init__(self, cid, page, reason):
+        self.cid = cid
+        self.page = page
+        self.reason = reason
+        super().__init__(f"获取弹幕分段失败(cid={cid}, 第 {page} 页): {reason}")
+
+
 class BilibiliDanmakuCrawler:
     """B站弹幕爬虫类"""
     
     def __init__(self):
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0',
-            'Referer': 'https://www.bilibili.com',
-        }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        # 共享HTTP客户端：连接池、令牌桶限速、退避重试和熔断对所有爬虫实例生效
+        self.http = get_http_client()
+        
+        # 分段请求使用进程内共享的线程池，爬虫实例不再各自创建
+        concurrency = crawler_config.CONCURRENCY
+        self.segment_workers = concurrency.get('segment_workers', 8)
+        self.max_pending_segments = concurrency.get('max_pending_segments', 16)
+        self.segment_pool = get_segment_pool()
+        
+        # 开启归档时保存每个分段的原始响应，供 replay_segments 离线重放
+        self.archive = get_segment_archive() if crawler_config.ARCHIVE.get('enabled') else None
+        
+        # 清洗规则在进程内只编译一次
+        self.cleaner = get_cleaning_engine()
+    
+    def _get(self, url, **kwargs):
+        """通过共享HTTP客户端发送 GET 请求"""
+        return self.http.get(url, **kwargs)
     
     def parse_bvid(self, url):
         """从URL中提取BV号"""
-        bv_pattern = r'BV\w{10}'
-        match = re.search(bv_pattern, url)
-        if match:
-            return match.group(0)
-        return None
+        return parse_bvid(url)
     
     def parse_bilibili_cookie(self, cookie_str):
         """
@@ -71,15 +130,46 @@ class BilibiliDanmakuCrawler:
         
         return {k: v for k, v in target_cookies.items() if v is not None}
     
-    def get_video_info(self, bvid):
-        """获取视频信息"""
-        api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
+    def _video_info_cache_key(self, bvid):
+        return f"danmaku_crawler:video_info:{bvid}"
+    
+    def get_video_info(self, bvid, refresh=False):
+        """
+        获取视频信息
+        
+        成功的结果按BV号写入 Django 缓存，有效期内所有入口(提交任务、爬取、批量提交)
+        和所有工作进程共用，不再重复请求 view 接口。
+        
+        参数:
+            bvid: BV号
+            refresh: 为True时忽略缓存重新请求
+            
+        返回:
+            dict: 视频信息，失败时返回None
+        """
+        ttl = crawler_config.VIDEO_INFO_CACHE.get('ttl', 0)
+        cache_key = self._video_info_cache_key(bvid)
+        if ttl > 0 and not refresh:
+            try:
+                info = cache.get(cache_key)
+            except Exception as e:
+                logger.warning(f"读取视频信息缓存失败: {str(e)}")
+                info = None
+            if info:
+                return info
+        
+        api_url = http_client.api_url(f"/x/web-interface/view?bvid={bvid}")
         try:
-            response = self.session.get(api_url)
+            response = self._get(api_url)
             if response.status_code == 200:
                 data = response.json()
                 if data['code'] == 0:
                     info = data['data']
+                    if ttl > 0:
+                        try:
+                            cache.set(cache_key, info, timeout=ttl)
+                        except Exception as e:
+                            logger.warning(f"写入视频信息缓存失败: {str(e)}")
                     return info
                 else:
                     logger.error(f"获取视频信息失败: {data['message']}")
@@ -89,14 +179,30 @@ class BilibiliDanmakuCrawler:
             logger.error(f"获取视频信息异常: {str(e)}")
         return None
     
-    def get_all_cids(self, bvid):
+    def _is_sign_rejected(self, response):
+        """判断分段请求是否因WBI签名失效被拒绝"""
+        if response.status_code == 403:
+            return True
+        if 'json' in response.headers.get('Content-Type', ''):
+            try:
+                code = response.json().get('code')
+            except ValueError:
+                return False
+            return code in (-403, -352)
+        return False
+    
+    def get_all_cids(self, bvid, refresh=False):
         """
         通过 BV 号获取全部视频的 cid 和 duration。
         
+        参数:
+            bvid: BV号
+            refresh: 为True时忽略视频信息缓存
+        
         返回:
             list: 包含每个分P的 {'cid': cid, 'duration': duration} 字典的列表
         """
-        video_info = self.get_video_info(bvid)
+        video_info = self.get_video_info(bvid, refresh=refresh)
         try:
             if video_info and 'pages' in video_info:
                 return [{'cid': page['cid'], 'duration': page['duration']} for page in video_info['pages']]
@@ -107,46 +213,153 @@ class BilibiliDanmakuCrawler:
         
         return []
     
-    def get_danmaku_pb(self, cid, pid, page=1, cookie=None, max_retries=3):
+    def get_danmaku_pb(self, cid, pid, page=1, cookie=None):
         """
         获取弹幕数据(protobuf格式)
         
+        网络错误、限流和 5xx 只由共享HTTP客户端退避重试，这里不再整体重试，避免上游限流时成倍放大请求；
+        签名被拒绝时作废缓存的WBI密钥，重新签名后再请求一次。
+        只有返回200且没有弹幕的分段才视为空分段，其余失败抛出 SegmentFetchError，不会被当作空分段静默跳过。
+        
         参数:
             cid: 视频的cid
             pid: 视频的aid
             page: 弹幕分页页码
             cookie: Cookie字典
-            max_retries: 最大重试次数
             
         返回:
-            list: 弹幕数据列表
+            DanmakuColumns: 列式弹幕数据，没有弹幕时为空
+            
+        异常:
+            SegmentFetchError: HTTP客户端重试后仍未获取到分段
         """
-        query = wbisign.get_danmu_wbi_sign(cid, pid, page)
-        api_url = f'https://api.bilibili.com/x/v2/dm/web/seg.so?{query}'
-        
-        for retry in range(max_retries):
+        # 第二次请求只在签名被拒绝、刷新密钥后发送
+        for attempt in range(2):
             try:
-                response = self.session.get(api_url, cookies=cookie)
-                if response.status_code == 200:
-                    dm_seg_reply = danmu_pb2.DmSegMobileReply()
-                    dm_seg_reply.ParseFromString(response.content)
-                    
-                    if not dm_seg_reply.elems:
-                        logger.info(f"第 {page} 页没有弹幕数据")
-                        if retry < max_retries - 1:
-                            time.sleep(1)
-                            continue
-                        return []
-                    
-                    return dm_seg_reply.elems
+                query = wbisign.get_danmu_wbi_sign(cid, pid, page)
+                api_url = http_client.api_url(f'/x/v2/dm/web/seg.so?{query}')
+                response = self._get(api_url, cookies=cookie)
             except Exception as e:
-                logger.error(f"解析弹幕数据异常: {str(e)}")
-                if retry < max_retries - 1:
-                    time.sleep(2)
+                logger.error(f"请求第 {page} 页弹幕异常: {str(e)}")
+                raise SegmentFetchError(cid, page, str(e)) from e
+            if not self._is_sign_rejected(response):
+                break
+            logger.warning(f"第 {page} 页请求签名被拒绝，刷新WBI密钥后重试")
+            wbisign.wbi_key_manager.invalidate()
+        else:
+            raise SegmentFetchError(cid, page, f'签名被拒绝(HTTP {response.status_code})')
         
-        return []
+        if response.status_code != 200:
+            logger.warning(f"第 {page} 页请求返回 {response.status_code}")
+            raise SegmentFetchError(cid, page, f'HTTP {response.status_code}')
+        
+        try:
+            danmakus = columnar.decode_segment(response.content)
+        except Exception as e:
+            logger.error(f"解析弹幕数据异常: {str(e)}")
+            raise SegmentFetchError(cid, page, f'解析失败: {str(e)}') from e
+        
+        # 空分段是正常结果(该6分钟窗口内没有弹幕或已是最后一段)
+        if not len(danmakus):
+            logger.info(f"第 {page} 页没有弹幕数据")
+            return danmakus
+        
+        if self.archive:
+            self.archive_segment(cid, page, response.content)
+        return danmakus
+    
+    def archive_segment(self, cid, page, payload):
+        """
+        归档分段的原始响应，归档失败只记录日志，不影响抓取
+        
+        参数:
+            cid: 视频的cid
+            page: 弹幕分页页码
+            payload: seg.so 原始响应内容
+        """
+        try:
+            self.archive.put_segment(cid, page, payload)
+        except Exception as e:
+            logger.warning(f"归档第 {page} 页弹幕分段失败: {str(e)}")
+    
+    def plan_segments(self, duration):
+        """
+        根据分P时长计算弹幕分段数，每段对应6分钟的视频内容
+        
+        参数:
+            duration: 分P时长（秒）
+            
+        返回:
+            int: 分段数，时长未知时返回0
+        """
+        if not duration or duration <= 0:
+            return 0
+        return max(1, math.ceil(duration / crawler_config.SEGMENT_DURATION))
+    
+    def iter_segments(self, parts, pid, cookie=None, max_pages=None, skip=None):
+        """
+        并发抓取多个分P的弹幕分段，按完成顺序逐段产出
+        
+        已知时长的分P按时长规划全部分段；时长未知的分P逐页探测，直到遇到空页。
+        已提交但未被消费的分段数不超过 max_pending_segments，内存占用与视频长度无关。
+        
+        参数:
+            parts: [(分P编号, {'cid': cid, 'duration': duration}), ...]
+            pid: 视频aid
+            cookie: 用户cookie
+            max_pages: 每个分P的最大页数，默认全部
+            skip: 需要跳过的 (分P编号, 页码) 集合，如检查点中已入库的分段；仅对已知时长的分P生效
+            
+        产出:
+            tuple: (分P编号, cid_info, 页码, 弹幕列表, 该分P是否已全部产出)
+            分P的全部分段都被跳过时，产出一次页码为 None 的空结果
+        """
+        skip = skip or set()
+        planned = deque()
+        probing = set()
+        remaining = {}
+        for index, cid_info in parts:
+            segment_count = self.plan_segments(cid_info.get('duration'))
+            if segment_count:
+                if max_pages:
+                    segment_count = min(segment_count, max_pages)
+                pages = [p for p in range(1, segment_count + 1) if (index, p) not in skip]
+                if not pages:
+                    yield index, cid_info, None, [], True
+                    continue
+                planned.extend((index, cid_info, p) for p in pages)
+                remaining[index] = len(pages)
+            else:
+                # 时长未知，退回逐页探测
+                planned.append((index, cid_info, 1))
+                probing.add(index)
+                remaining[index] = 1
+        
+        pending = {}
+        try:
+            while planned or pending:
+                while planned and len(pending) < self.max_pending_segments:
+                    index, cid_info, page = planned.popleft()
+                    future = self.segment_pool.submit(self.get_danmaku_pb, cid_info['cid'], pid, page, cookie)
+                    pending[future] = (index, cid_info, page)
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, cid_info, page = pending.pop(future)
+                    danmakus = future.result()
+                    if danmakus:
+                        logger.info(f"获取到第 {index} 集第 {page} 页弹幕数据: {len(danmakus)} 条")
+                        if index in probing and not (max_pages and page >= max_pages):
+                            planned.append((index, cid_info, page + 1))
+                            remaining[index] += 1
+                    remaining[index] -= 1
+                    yield index, cid_info, page, danmakus, remaining[index] == 0
+        finally:
+            # 消费方提前退出时取消尚未开始的请求
+            for future in pending:
+                future.cancel()
     
-    def get_all_danmaku(self, cid, pid, cookie=None, max_pages=None):
+    def get_all_danmaku(self, cid, pid, cookie=None, max_pages=None, duration=None):
         """
         获取指定cid的所有弹幕
         
@@ -155,153 +368,539 @@ class BilibiliDanmakuCrawler:
             pid: 视频aid
             cookie: 用户cookie
             max_pages: 最大页数，默认全部
+            duration: 分P时长（秒），已知时按时长一次性规划全部分段
             
         返回:
-            list: 弹幕列表
+            DanmakuColumns: 按页码排序的列式弹幕
         """
-        all_danmakus = []
-        page = 1
-        
-        while True:
-            if max_pages and page > max_pages:
-                break
-                
-            danmakus = self.get_danmaku_pb(cid, pid, page, cookie)
-            if not danmakus:
-                # 没有更多弹幕数据，结束循环
-                break
-                
-            logger.info(f"获取到第 {page} 页弹幕数据: {len(danmakus)} 条")
-            all_danmakus.extend(danmakus)
-            
-            # 防止请求过快
-            time.sleep(1)
-            page += 1
+        segments = {}
+        parts = [(1, {'cid': cid, 'duration': duration})]
+        for _, _, page, danmakus, _ in self.iter_segments(parts, pid, cookie, max_pages):
+            segments[page] = danmakus
         
-        return all_danmakus
+        return columnar.DanmakuColumns.concat(segments[page] for page in sorted(segments))
     
     def clean_danmaku(self, danmakus, page_duration):
         """
-        清洗弹幕数据，过滤无效弹幕
+        清洗弹幕数据，按 crawler_config.CLEANING 中的规则过滤无效弹幕
         
         参数:
-            danmakus: 原始弹幕列表
+            danmakus: 原始弹幕(列式弹幕或弹幕对象列表)
             page_duration: 分P时长（秒）
             
         返回:
-            list: 清洗后的弹幕列表
+            DanmakuColumns: 清洗后的列式弹幕
         """
-        if not danmakus:
-            return []
-            
-        # 转换页面时长为毫秒（弹幕进度单位为毫秒）
-        page_duration_ms = page_duration * 1000 if page_duration else 0
-            
-        cleaned_danmakus = []
+        total = len(danmakus)
+        if not total:
+            return columnar.as_columns(danmakus)
+        
+        cleaned_danmakus, dropped = self.cleaner.clean(danmakus, page_duration)
+        total_filtered = total - len(cleaned_danmakus)
+        filter_rate = total_filtered / total * 100
+        
+        logger.info(f"弹幕清洗完成: 原始 {total} 条，清洗后 {len(cleaned_danmakus)} 条，过滤 {total_filtered} 条 ({filter_rate:.2f}%)")
+        if dropped and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"各规则过滤条数: {dict(dropped)}, 视频时长 {page_duration}秒")
+        return cleaned_danmakus
+    
+    def build_danmaku_objects(self, danmakus, source, page_num=1, page_duration=0):
+        """
+        逐条将protobuf弹幕转换为 Danmaku 对象(生成器，不在内存中保留整批数据)
         
-        # 无意义符号模式 - 匹配只包含符号的弹幕
-        meaningless_pattern = re.compile(r'^[\s\.\,\。\，\?\~\-\+\=\*\/\\\(\)\[\]\{\}\<\>\|\'\"\;\:\：\…\r\n]+$')
-        # 过短内容模式 - 匹配长度小于2的内容(排除常见表情和符号)
-        short_pattern = re.compile(r'^.{1,2}$')
-        # 表情符号例外列表 - 这些短字符串是有意义的
-        emoji_exceptions = set(['666', '233', '114', '555', '???', '！！！', '???', '。。。', '???', '6'])
+        与 ingest.build_rows 一致，没有数字 dmid 的弹幕无法写入 BigIntegerField 列，直接跳过。
         
-        logger.info(f"开始清洗弹幕数据: 总数 {len(danmakus)} 条, 视频时长 {page_duration}秒")
+        参数:
+            danmakus: 弹幕数据(列式弹幕或弹幕对象)
+            source: 视频弹幕源
+            page_num: 分P编号
+            page_duration: 分P时长
+            
+        产出:
+            Danmaku: 未保存的弹幕对象
+        """
+        danmakus = columnar.as_columns(danmakus)
+        valid = danmakus.dmid > 0
+        if not valid.all():
+            logger.warning(f"跳过 {len(danmakus) - int(valid.sum())} 条没有有效dmid的弹幕")
+            danmakus = danmakus.take(valid)
         
-        # 基础清洗 - 去除无效弹幕
+        # 增量模式下已入库的弹幕在 filter_new_danmaku 中过滤，这里不再逐条检查
         for d in danmakus:
-            # 1. 过滤progress大于page_duration的弹幕
-            if page_duration_ms > 0 and d.stime > page_duration_ms:
-                logger.debug(f"过滤超时弹幕: {d.text} (进度: {d.stime/1000:.1f}秒, 视频长度: {page_duration}秒)")
-                continue
-                
-            # 2. 过滤无意义符号弹幕
-            if not d.text or len(d.text.strip()) == 0 or meaningless_pattern.match(d.text):
-                logger.debug(f"过滤无意义符号弹幕: '{d.text}'")
-                continue
-                
-            # 3. 过滤过短内容（但保留常见表情符号）
-            if short_pattern.match(d.text) and d.text not in emoji_exceptions:
-                logger.debug(f"过滤过短弹幕: '{d.text}'")
-                continue
-                
-            # 保留有效弹幕
-            cleaned_danmakus.append(d)
+            # 发送时间转换
+            naive_send_time = datetime.fromtimestamp(d.date)
+            # 检查 settings.USE_TZ 并转换为 aware datetime
+            if settings.USE_TZ:
+                send_time = timezone.make_aware(naive_send_time, timezone.get_default_timezone())
+            else:
+                send_time = naive_send_time # 如果 USE_TZ=False，则保持 naive
+            
+            # 创建弹幕对象
+            yield Danmaku(
+                source=source,
+                dmid=int(d.dmid),
+                content=d.text,
+                send_time=send_time,
+                progress=d.stime,  # 视频进度，单位为毫秒
+                mode=d.mode,  # 弹幕模式
+                font_size=d.size,  # 字体大小
+                color=f"#{d.color:06x}",  # 颜色，转为十六进制格式
+                user_hash=d.uhash,  # 用户哈希
+                weight=d.weight,  # 弹幕权重
+                page_duration=page_duration,  # 分P时长
+                page_id=page_num  # 分P编号
+            )
+    
+    def save_danmaku_batch(self, danmaku_list, tracker=None):
+        """
+        批量写入一批弹幕
         
-        total_filtered = len(danmakus) - len(cleaned_danmakus)
-        filter_rate = (total_filtered / len(danmakus) * 100) if danmakus else 0
+        参数:
+            danmaku_list: Danmaku 对象列表
+            tracker: DuplicateTracker，提供时跳过已入库的弹幕，只统计实际写入的弹幕文本
+            
+        返回:
+            int: 写入的弹幕数量
+        """
+        if tracker is not None:
+            danmaku_list = ingest.exclude_existing(danmaku_list, key=operator.attrgetter('dmid'))
+        if not danmaku_list:
+            return 0
+        with transaction.atomic():
+            Danmaku.objects.bulk_create(danmaku_list, ignore_conflicts=True)
+            # 忽略冲突时不知道实际写入了哪些弹幕，涉及的秒按弹幕表重新计数
+            timeline.recount_seconds(timeline.count_seconds(
+                (d.source_id, d.page_id, d.progress) for d in danmaku_list
+            ))
+        if tracker is not None:
+            tracker.add(d.content for d in danmaku_list)
+        return len(danmaku_list)
+    
+    def save_danmaku_rows(self, rows, tracker=None):
+        """
+        使用多行 INSERT 批量写入一批弹幕行元组(高速入库方式)
         
-        logger.info(f"弹幕清洗完成: 原始 {len(danmakus)} 条，清洗后 {len(cleaned_danmakus)} 条，过滤 {total_filtered} 条 ({filter_rate:.2f}%)")
-        return cleaned_danmakus
+        参数:
+            rows: ingest.build_rows 产出的行元组列表
+            tracker: DuplicateTracker，提供时跳过已入库的弹幕，只统计实际写入的弹幕文本
+            
+        返回:
+            int: 实际写入的弹幕数量
+        """
+        if tracker is not None:
+            # 同一视频的入库由任务队列串行执行，查询到写入之间不会有其他进程写入同一批弹幕
+            rows = ingest.exclude_existing(rows)
+        count = ingest.insert_rows(rows, crawler_config.PIPELINE.get('insert_batch_size', 1000))
+        if tracker is not None:
+            tracker.add(map(ingest.CONTENT_KEY, rows))
+        return count
     
-    def parse_danmaku(self, danmakus, video_obj, page_num=1, page_duration=0):
+    def parse_danmaku(self, danmakus, source, page_num=1, page_duration=0, batch_size=None):
         """
         解析弹幕数据并保存到数据库
         
+        弹幕以迭代方式消费，每积累 batch_size 条写入一次，
+        峰值内存只与批大小有关。
+        
         参数:
-            danmakus: protobuf格式的弹幕数据
-            video_obj: 视频对象
+            danmakus: protobuf格式的弹幕数据(任意可迭代对象)
+            source: 视频弹幕源
             page_num: 分P编号
             page_duration: 分P时长
+            batch_size: 每批写入数量，默认读取配置
             
         返回:
             int: 保存的弹幕数量
         """
+        batch_size = batch_size or crawler_config.PIPELINE.get('batch_size', 1000)
         danmaku_list = []
         count = 0
         
         try:
-            with transaction.atomic():
-                for d in danmakus:
-                    # 不再检查弹幕是否存在，因为旧数据已被删除
-                    # if Danmaku.objects.filter(dmid=dm_id).exists():
-                    #     continue
-                    
-                    dm_id = d.dmid if d.dmid else f"{d.date}_{d.uhash}"
+            for danmaku in self.build_danmaku_objects(danmakus, source, page_num, page_duration):
+                danmaku_list.append(danmaku)
+                if len(danmaku_list) >= batch_size:
+                    count += self.save_danmaku_batch(danmaku_list)
+                    danmaku_list = []
+            
+            # 保存剩余的弹幕
+            count += self.save_danmaku_batch(danmaku_list)
+        
+        except Exception as e:
+            logger.error(f"解析弹幕异常: {str(e)}")
+            
+        return count
+    
+    def filter_new_danmaku(self, danmakus, source, page_num):
+        """
+        增量爬取时过滤已入库的弹幕
+        
+        dmid 大于水位线的弹幕一定是新弹幕；其余弹幕按批查询数据库确认是否已存在。
+        
+        参数:
+            danmakus: 清洗后的列式弹幕
+            source: 视频弹幕源
+            page_num: 分P编号
+            
+        返回:
+            DanmakuColumns: 尚未入库的弹幕
+        """
+        watermark = CrawlWatermark.objects.filter(source=source, page_id=page_num).first()
+        if watermark:
+            max_dmid = watermark.max_dmid
+        elif Danmaku.objects.filter(source=source, page_id=page_num).exists():
+            # 旧版本爬取的数据没有水位线，所有弹幕都需要查询确认
+            max_dmid = None
+        else:
+            # 该分P从未入库，全部都是新弹幕
+            return danmakus
+        
+        dmids = danmakus.dmid
+        candidate_mask = dmids > 0
+        if max_dmid is not None:
+            candidate_mask &= dmids <= max_dmid
+        candidates = dmids[candidate_mask].tolist()
+        existing = []
+        batch_size = crawler_config.INCREMENTAL.get('lookup_batch_size', 1000)
+        for i in range(0, len(candidates), batch_size):
+            existing.extend(
+                Danmaku.objects.filter(dmid__in=candidates[i:i + batch_size]).values_list('dmid', flat=True)
+            )
+        
+        new_danmakus = danmakus.take(~np.isin(dmids, np.array(existing, dtype=np.int64))) if existing else danmakus
+        logger.info(f"第 {page_num} 集增量过滤: 抓取 {len(danmakus)} 条，已入库 {len(danmakus) - len(new_danmakus)} 条，新增 {len(new_danmakus)} 条")
+        return new_danmakus
+    
+    def track_watermark(self, stats, danmakus):
+        """
+        用一批弹幕更新分P的最大弹幕ID和最大发送时间统计
+        
+        参数:
+            stats: 分P统计字典，包含 max_dmid、max_date
+            danmakus: 本批清洗后的列式弹幕
+        """
+        if not len(danmakus):
+            return
+        stats['max_dmid'] = max(stats['max_dmid'], int(danmakus.dmid.max()))
+        stats['max_date'] = max(stats['max_date'], int(danmakus.date.max()))
+    
+    def update_watermark(self, source, page_num, cid=None, max_dmid=0, max_date=0):
+        """
+        推进分P水位线(最大发送时间、最大弹幕ID)
+        
+        参数:
+            source: 视频弹幕源
+            page_num: 分P编号
+            cid: 分P的cid
+            max_dmid: 本次抓取到的最大弹幕ID
+            max_date: 本次抓取到的最大发送时间戳(秒)
+            
+        返回:
+            CrawlWatermark: 更新后的水位线
+        """
+        watermark, _ = CrawlWatermark.objects.get_or_create(source=source, page_id=page_num)
+        
+        watermark.max_dmid = max(watermark.max_dmid, max_dmid)
+        if max_date:
+            max_send_time = datetime.fromtimestamp(max_date)
+            if settings.USE_TZ:
+                max_send_time = timezone.make_aware(max_send_time, timezone.get_default_timezone())
+            if watermark.max_send_time is None or max_send_time > watermark.max_send_time:
+                watermark.max_send_time = max_send_time
+        
+        if cid:
+            watermark.cid = cid
+        watermark.danmaku_count = Danmaku.objects.filter(source=source, page_id=page_num).count()
+        watermark.save()
+        return watermark
+    
+    def save_checkpoints(self, task, segments):
+        """
+        记录已入库分段的检查点
+        
+        参数:
+            task: 爬取任务
+            segments: [(分P编号, cid, 页码, 弹幕数), ...]
+        """
+        CrawlCheckpoint.objects.bulk_create([
+            CrawlCheckpoint(task=task, page_id=page_id, cid=cid, segment_index=page, danmaku_count=count)
+            for page_id, cid, page, count in segments
+        ], ignore_conflicts=True)
+    
+    def finish_part(self, source, page_num, cid_info, stats):
+        """
+        分P的弹幕全部写入后推进水位线并发送入库完成信号
+        
+        参数:
+            source: 视频弹幕源
+            page_num: 分P编号
+            cid_info: 分P信息 {'cid': cid, 'duration': duration}
+            stats: 分P统计字典，包含 created、max_dmid、max_date
+        """
+        watermark = self.update_watermark(source, page_num, cid_info['cid'], stats['max_dmid'], stats['max_date'])
+        danmaku_ingested.send(
+            sender=self.__class__,
+            source=source,
+            page_id=page_num,
+            created_count=stats['created'],
+            watermark=watermark
+        )
+        logger.info(f"第 {page_num} 集弹幕保存完成，共 {stats['created']} 条")
+    
+    def ingest_segments(self, source, segments, incremental, task=None):
+        """
+        流式清洗并写入分段弹幕
+        
+        每个分段到达后立即清洗、转换，凑满一批即交给后台写入线程，
+        抓取(或读取归档)与数据库写入并行进行；分P的全部分段写入后推进水位线。
+        
+        参数:
+            source: 视频弹幕源
+            segments: 产出 (分P编号, cid_info, 页码, 弹幕列表, 该分P是否已全部产出) 的可迭代对象
+            incremental: 是否只写入尚未入库的弹幕
+            task: 爬取任务，提供时为已写入的分段记录检查点
+            
+        返回:
+            dict: 写入线程的统计信息，rows 为写入的弹幕数
+            
+        异常:
+            SegmentFetchError: 分段获取失败，此前已处理的分段写入并记录检查点后重新抛出
+        """
+        # 弹幕即将变化，旧的列式快照作废
+        snapshot.invalidate_snapshot(source)
+        # 每秒弹幕数在入库时增量维护，旧数据先按弹幕表建立
+        timeline.ensure_second_buckets(source)
+        
+        batch_size = crawler_config.PIPELINE.get('batch_size', 1000)
+        tracker = dedup.DuplicateTracker() if crawler_config.DEDUP.get('enabled', True) else None
+        part_stats = {}
+        danmaku_list = []
+        # 已进入写入缓冲区、待其所在批次写入后记录检查点的分段
+        buffered_segments = []
+        
+        # 'sql' 方式直接构造行元组多行INSERT，'orm' 方式构造 Danmaku 对象 bulk_create
+        use_sql_ingest = crawler_config.PIPELINE.get('ingest_method', 'sql') == 'sql'
+        # 去重统计在写入线程中只计入实际写入的弹幕，重复入库的弹幕不会被重复计数
+        writer = DanmakuWriter(
+            functools.partial(self.save_danmaku_rows if use_sql_ingest else self.save_danmaku_batch, tracker=tracker),
+            max_queue_size=crawler_config.PIPELINE.get('writer_queue_size', 4)
+        ).start()
+        try:
+            for index, cid_info, page, danmakus, part_done in segments:
+                page_duration = cid_info['duration'] # 获取分P时长
+                stats = part_stats.setdefault(index, {'created': 0, 'max_dmid': 0, 'max_date': 0})
+                
+                # 清洗弹幕数据
+                cleaned_danmakus = self.clean_danmaku(danmakus, page_duration)
+                if len(cleaned_danmakus):
+                    self.track_watermark(stats, cleaned_danmakus)
                     
-                    # 发送时间转换
-                    naive_send_time = datetime.fromtimestamp(d.date)
-                    # 检查 settings.USE_TZ 并转换为 aware datetime
-                    if settings.USE_TZ:
-                        send_time = timezone.make_aware(naive_send_time, timezone.get_default_timezone())
+                    # 增量模式下只保存尚未入库的弹幕
+                    if incremental:
+                        cleaned_danmakus = self.filter_new_danmaku(cleaned_danmakus, source, index)
+                    if use_sql_ingest:
+                        rows = ingest.build_rows(cleaned_danmakus, source.id, index, page_duration)
                     else:
-                        send_time = naive_send_time # 如果 USE_TZ=False，则保持 naive
-                    
-                    # 创建弹幕对象
-                    danmaku = Danmaku(
-                        video=video_obj,
-                        dmid=dm_id,
-                        content=d.text,
-                        send_time=send_time,
-                        progress=d.stime,  # 视频进度，单位为毫秒
-                        mode=d.mode,  # 弹幕模式
-                        font_size=d.size,  # 字体大小
-                        color=f"#{d.color:06x}",  # 颜色，转为十六进制格式
-                        user_hash=d.uhash,  # 用户哈希
-                        weight=d.weight,  # 弹幕权重
-                        page_duration=page_duration,  # 分P时长
-                        page_id=page_num  # 分P编号
-                    )
-                    danmaku_list.append(danmaku)
-                    count += 1
-                    
-                    # 批量保存，每1000条提交一次
-                    if len(danmaku_list) >= 1000:
-                        Danmaku.objects.bulk_create(danmaku_list, ignore_conflicts=True)
-                        danmaku_list = []
+                        rows = self.build_danmaku_objects(cleaned_danmakus, source, index, page_duration)
+                    segment_count = 0
+                    for row in rows:
+                        danmaku_list.append(row)
+                        segment_count += 1
+                        if len(danmaku_list) >= batch_size:
+                            writer.submit(danmaku_list)
+                            danmaku_list = []
+                            # 之前已处理完的分段的弹幕都已提交，写入后记录检查点
+                            if buffered_segments:
+                                writer.call(functools.partial(self.save_checkpoints, task, buffered_segments))
+                                buffered_segments = []
+                    stats['created'] += segment_count
+                else:
+                    segment_count = 0
+                
+                if task is not None and page is not None:
+                    buffered_segments.append((index, cid_info['cid'], page, segment_count))
                 
-                # 保存剩余的弹幕
-                if danmaku_list:
-                    Danmaku.objects.bulk_create(danmaku_list, ignore_conflicts=True)
+                if not part_done:
+                    continue
+                
+                # 分P的全部分段已处理，剩余弹幕写入后在写入线程中记录检查点并推进水位线
+                writer.submit(danmaku_list)
+                danmaku_list = []
+                if buffered_segments:
+                    writer.call(functools.partial(self.save_checkpoints, task, buffered_segments))
+                    buffered_segments = []
+                writer.call(functools.partial(self.finish_part, source, index, cid_info, stats))
+        except SegmentFetchError:
+            # 已完整处理的分段照常写入并记录检查点，任务失败后恢复时只重新抓取失败和尚未抓取的分段
+            writer.submit(danmaku_list)
+            if buffered_segments:
+                writer.call(functools.partial(self.save_checkpoints, task, buffered_segments))
+            raise
+        finally:
+            writer_stats = writer.close()
+            self.cleaner.flush_stats()
+            if tracker is not None and len(tracker):
+                self.save_text_stats(source, tracker)
+        return writer_stats
+    
+    def save_text_stats(self, source, tracker):
+        """
+        保存本次入库的弹幕去重统计，统计失败只记录日志，不影响入库结果
         
+        参数:
+            source: 视频弹幕源
+            tracker: 本次入库累计的 DuplicateTracker
+        """
+        try:
+            stats = dedup.save_text_stats(source, tracker)
+            logger.info(f"弹幕去重统计: 共 {stats['total']} 条, 不同文本 {stats['unique_texts']} 条, 近似重复簇 {stats['clusters']} 个")
         except Exception as e:
-            logger.error(f"解析弹幕异常: {str(e)}")
-            return 0
+            logger.warning(f"保存弹幕去重统计失败: {str(e)}")
+    
+    def save_snapshot(self, source):
+        """
+        写入弹幕源的列式快照供分析使用，写入失败只记录日志
+        
+        参数:
+            source: 视频弹幕源
+        """
+        if not crawler_config.SNAPSHOT.get('enabled', True):
+            return
+        try:
+            snapshot.write_snapshot(source)
+        except Exception as e:
+            logger.warning(f"写入弹幕源 {source.bvid} 的列式快照失败: {str(e)}")
+    
+    def get_or_create_source(self, bvid):
+        """
+        获取BV号对应的弹幕源，不存在时请求视频信息创建
+        
+        参数:
+            bvid: BV号
             
-        return count
+        返回:
+            VideoSource: 弹幕源，获取视频信息失败时返回None
+        """
+        source = VideoSource.objects.filter(bvid=bvid).first()
+        if source:
+            return source
+        
+        video_info = self.get_video_info(bvid)
+        if not video_info:
+            logger.error(f"获取视频信息失败: {bvid}")
+            return None
+        
+        source, created = VideoSource.objects.get_or_create(
+            bvid=video_info['bvid'],
+            defaults={
+                'aid': video_info['aid'],
+                'title': video_info['title'],
+                'owner': video_info['owner']['name'],
+                'owner_mid': video_info['owner']['mid'],
+                'duration': video_info['duration'],
+            }
+        )
+        if created:
+            logger.info(f"创建弹幕源: {source.title}, BV: {source.bvid}")
+        return source
+    
+    def get_or_create_video(self, source, user=None):
+        """
+        获取或创建用户对弹幕源的引用(视频记录)
+        
+        参数:
+            source: 弹幕源
+            user: 用户，为空时使用没有关联用户的视频记录
+            
+        返回:
+            Video: 视频记录
+        """
+        video_obj, created = Video.objects.get_or_create(
+            bvid=source.bvid,
+            user=user,
+            defaults={
+                'aid': source.aid,
+                'title': source.title,
+                'owner': source.owner,
+                'owner_mid': source.owner_mid,
+                'duration': source.duration,
+                'danmaku_count': source.danmaku_count,
+                'source': source,
+            }
+        )
+        if created:
+            logger.info(f"创建视频记录: {video_obj.title}, BV: {source.bvid}, 用户: {user}")
+        
+        update_fields = ['source', 'last_crawled']
+        if video_obj.source_id is None:
+            # 批量提交时以BV号占位创建的视频记录，获取到视频信息后补全
+            video_obj.aid = source.aid
+            video_obj.title = source.title
+            video_obj.owner = source.owner
+            video_obj.owner_mid = source.owner_mid
+            video_obj.duration = source.duration
+            update_fields += ['aid', 'title', 'owner', 'owner_mid', 'duration']
+        video_obj.source = source
+        video_obj.last_crawled = timezone.now()
+        video_obj.save(update_fields=update_fields)
+        return video_obj
     
-    def crawl_danmaku(self, video_url_or_bvid, cookie_str=None, user=None, existing_task=None):
-        """爬取视频弹幕的主方法"""
+    def refresh_danmaku_count(self, source):
+        """
+        按数据库重新统计弹幕源的弹幕数，并同步到引用它的所有视频记录
+        
+        参数:
+            source: 弹幕源
+        """
+        source.danmaku_count = Danmaku.objects.filter(source=source).count()
+        source.save(update_fields=['danmaku_count'])
+        source.videos.update(danmaku_count=source.danmaku_count)
+    
+    def clear_source(self, source):
+        """
+        清空弹幕源的弹幕及其派生数据，用于全量重爬和按归档重建
+        
+        弹幕、水位线、去重统计(含分桶键)和每秒弹幕数在同一事务中删除，弹幕数和上次爬取时间同时清零，
+        列式快照先行作废：之后的步骤失败时，分析不会从快照读到已删除的弹幕。
+        
+        参数:
+            source: 弹幕源
+            
+        返回:
+            int: 删除的弹幕数
+        """
+        snapshot.invalidate_snapshot(source)
+        with transaction.atomic():
+            deleted_count, _ = Danmaku.objects.filter(source=source).delete()
+            CrawlWatermark.objects.filter(source=source).delete()
+            DanmakuText.objects.filter(source=source).delete()
+            DanmakuTextBand.objects.filter(source=source).delete()
+            timeline.clear_second_buckets(source)
+            source.danmaku_count = 0
+            source.unique_text_count = 0
+            source.text_cluster_count = 0
+            source.last_crawled = None
+            source.save(update_fields=['danmaku_count', 'unique_text_count', 'text_cluster_count', 'last_crawled'])
+            source.videos.update(danmaku_count=0)
+        return deleted_count
+    
+    def crawl_danmaku(self, video_url_or_bvid, cookie_str=None, user=None, existing_task=None, incremental=None):
+        """
+        爬取视频弹幕的主方法
+        
+        参数:
+            video_url_or_bvid: 视频URL或BV号
+            cookie_str: 用户Cookie字符串
+            user: 发起爬取的用户
+            existing_task: 已创建的爬取任务
+            incremental: 是否增量爬取(保留已有弹幕，只写入新增弹幕)，默认读取配置
+            
+        返回:
+            CrawlTask: 爬取任务，失败时返回None
+        """
+        if incremental is None:
+            incremental = crawler_config.INCREMENTAL.get('enabled', True)
+        
         # 判断输入是BV号还是URL
         if video_url_or_bvid.startswith('http'):
             bvid = self.parse_bvid(video_url_or_bvid)
@@ -315,46 +914,17 @@ class BilibiliDanmakuCrawler:
         # 解析Cookie
         cookies = self.parse_bilibili_cookie(cookie_str) if cookie_str else None
         
-        # 创建或获取视频对象 - 根据bvid和user的组合查找
-        video_obj = None
-        video_exists = False
-        try:
-            # 修改为根据bvid和user的组合查找
-            if user:
-                video_obj = Video.objects.get(bvid=bvid, user=user)
-            else:
-                # 如果没有提供user，则尝试查找没有关联用户的视频
-                video_obj = Video.objects.get(bvid=bvid, user__isnull=True)
-            
-            video_exists = True
-            # 更新上次爬取时间
-            video_obj.last_crawled = timezone.now()
-            video_obj.save()
-            
-            # 如果视频已存在（重新爬取），删除旧弹幕
-            logger.info(f"视频 {bvid} 已存在，删除旧弹幕数据...")
-            deleted_count, _ = Danmaku.objects.filter(video=video_obj).delete()
-            logger.info(f"删除了 {deleted_count} 条旧弹幕")
-            
-        except Video.DoesNotExist:
-            # 获取视频信息
-            video_info = self.get_video_info(bvid)
-            if not video_info:
-                logger.error(f"获取视频信息失败: {bvid}")
-                return None
-            
-            # 创建视频对象，并关联用户
-            video_obj = Video.objects.create(
-                bvid=video_info['bvid'],
-                aid=video_info['aid'],
-                title=video_info['title'],
-                owner=video_info['owner']['name'],
-                owner_mid=video_info['owner']['mid'],
-                duration=video_info['duration'],
-                last_crawled=timezone.now(),
-                user=user  # 设置用户
-            )
-            video_exists = False
+        # 弹幕按BV号共享存储，用户的视频记录只是对弹幕源的引用
+        source = self.get_or_create_source(bvid)
+        if source is None:
+            if existing_task:
+                # 批量提交的任务在执行时才获取视频信息，获取失败只影响本任务
+                existing_task.status = 'failed'
+                existing_task.error_message = f"获取视频 {bvid} 的信息失败"
+                existing_task.completed_at = timezone.now()
+                existing_task.save(update_fields=['status', 'error_message', 'completed_at'])
+            return None
+        video_obj = self.get_or_create_video(source, user)
         
         # 使用传入的任务或创建新任务
         task = None
@@ -362,7 +932,8 @@ class BilibiliDanmakuCrawler:
             task = existing_task
             # 更新任务状态为运行中
             task.status = 'running'
-            task.save()
+            # 只更新相关字段，避免覆盖任务队列心跳线程写入的租约字段
+            task.save(update_fields=['status'])
             logger.info(f"使用现有任务 ID: {task.id}, 视频: {video_obj.title}")
         else:
             # 仅在没有传入任务时创建新任务
@@ -374,50 +945,74 @@ class BilibiliDanmakuCrawler:
             )
             logger.info(f"创建新任务 ID: {task.id}, 视频: {video_obj.title}")
         
+        # 弹幕源刚被其他用户爬取过时直接复用，不再重复请求B站
+        fresh_seconds = crawler_config.SHARED_STORAGE.get('fresh_seconds', 0)
+        if incremental and fresh_seconds > 0 and source.last_crawled and not task.checkpoints.exists():
+            age = (timezone.now() - source.last_crawled).total_seconds()
+            if age < fresh_seconds:
+                logger.info(f"视频 {bvid} 的弹幕 {age:.0f} 秒前已爬取，直接复用共享弹幕")
+                self.refresh_danmaku_count(source)
+                task.status = 'completed'
+                task.danmaku_count = 0
+                task.completed_at = timezone.now()
+                task.save(update_fields=['status', 'danmaku_count', 'completed_at'])
+                return task
+        
         try:
-            # 获取所有分P的cid
-            cid_info_list = self.get_all_cids(bvid)
+            if incremental:
+                # 增量爬取：保留已有弹幕，只写入新增部分
+                logger.info(f"视频 {bvid} 增量爬取新弹幕")
+            elif task.checkpoints.exists():
+                # 从检查点恢复的全量重爬任务，旧弹幕已在上次执行时删除
+                logger.info(f"视频 {bvid} 的全量重爬任务从检查点恢复，保留已入库弹幕")
+            else:
+                # 全量重爬：删除弹幕源的旧弹幕和水位线，对引用该视频的所有用户生效
+                logger.info(f"视频 {bvid} 全量重爬，删除旧弹幕数据...")
+                deleted_count = self.clear_source(source)
+                logger.info(f"删除了 {deleted_count} 条旧弹幕")
+            
+            # 获取所有分P的cid，全量重爬时重新获取分P列表
+            cid_info_list = self.get_all_cids(bvid, refresh=not incremental)
             if not cid_info_list:
                 raise Exception("获取视频分P信息失败")
                 
-            pid = video_obj.aid
-            total_count = 0
+            pid = source.aid
+            if self.archive:
+                self.archive.save_parts(bvid, pid, cid_info_list, info={
+                    'title': source.title, 'owner': source.owner,
+                    'owner_mid': source.owner_mid, 'duration': source.duration,
+                })
             
-            # 爬取每个分P的弹幕
-            for index, cid_info in enumerate(cid_info_list, start=1):
-                cid = cid_info['cid']
-                page_duration = cid_info['duration'] # 获取分P时长
-                logger.info(f"开始爬取第 {index} 集弹幕数据(cid: {cid})")
-                
-                # 获取该分P的所有弹幕
-                danmakus = self.get_all_danmaku(cid, pid, cookies)
-                if not danmakus:
-                    logger.info(f"第 {index} 集没有弹幕数据")
-                    continue
-                
-                # 清洗弹幕数据
-                cleaned_danmakus = self.clean_danmaku(danmakus, page_duration)
-                if not cleaned_danmakus:
-                    logger.info(f"第 {index} 集清洗后没有有效弹幕数据")
-                    continue
-                
-                # 解析并保存清洗后的弹幕
-                count = self.parse_danmaku(cleaned_danmakus, video_obj, index, page_duration)
-                total_count += count
-                
-                logger.info(f"第 {index} 集弹幕保存完成，共 {count} 条")
-                time.sleep(2)  # 防止请求过快
+            parts = list(enumerate(cid_info_list, start=1))
+            logger.info(f"开始爬取弹幕数据，共 {len(parts)} 集")
+            
+            # 任务重试或恢复时跳过检查点中已入库的分段
+            checkpoints = list(task.checkpoints.values_list('page_id', 'segment_index', 'danmaku_count'))
+            done_segments = {(page_id, segment_index) for page_id, segment_index, _ in checkpoints}
+            resumed_count = sum(count for _, _, count in checkpoints)
+            if done_segments:
+                logger.info(f"任务 {task.id} 从检查点恢复，跳过已入库的 {len(done_segments)} 个分段")
+            
+            segments = self.iter_segments(parts, pid, cookies, skip=done_segments)
+            writer_stats = self.ingest_segments(source, segments, incremental, task)
+            total_count = resumed_count + writer_stats['rows']
+            
+            # 任务完成后检查点不再需要
+            task.checkpoints.all().delete()
             
             # 更新任务状态
             task.status = 'completed'
             task.danmaku_count = total_count
             task.completed_at = timezone.now()
-            task.save()
+            task.save(update_fields=['status', 'danmaku_count', 'completed_at'])
 
-            video_obj.danmaku_count = total_count
-            video_obj.save()
+            # 增量爬取时 total_count 只是新增数量，视频弹幕总数以数据库为准
+            source.last_crawled = timezone.now()
+            source.save(update_fields=['last_crawled'])
+            self.refresh_danmaku_count(source)
+            self.save_snapshot(source)
             
-            logger.info(f"爬取完成: {video_obj.title}, 共{total_count}条弹幕")
+            logger.info(f"爬取完成: {source.title}, 新增{total_count}条弹幕, 共{source.danmaku_count}条")
             return task
         
         except Exception as e:
@@ -425,13 +1020,77 @@ class BilibiliDanmakuCrawler:
             task.status = 'failed'
             task.error_message = str(e)
             task.completed_at = timezone.now()
-            task.save()
+            task.save(update_fields=['status', 'error_message', 'completed_at'])
             return None
+    
+    def restore_source(self, bvid, archive=None):
+        """
+        按归档记录重建数据库中已没有的弹幕源，不请求B站接口
+        
+        早期归档没有视频信息，标题使用BV号，时长按各分P时长合计。
+        
+        参数:
+            bvid: BV号
+            archive: 分段归档，默认使用配置的归档目录
+            
+        返回:
+            VideoSource: 弹幕源，归档中没有该视频时返回None
+        """
+        archive = archive or get_segment_archive()
+        video = archive.load_video(bvid)
+        if not video or not video.get('parts'):
+            return None
+        
+        info = video.get('info') or {}
+        source, created = VideoSource.objects.get_or_create(
+            bvid=bvid,
+            defaults={
+                'aid': video.get('aid'),
+                'title': info.get('title') or bvid,
+                'owner': info.get('owner') or '',
+                'owner_mid': info.get('owner_mid'),
+                'duration': info.get('duration') or sum(part.get('duration') or 0 for part in video['parts']),
+            }
+        )
+        if created:
+            logger.info(f"按归档记录重建弹幕源: {source.title}, BV: {bvid}")
+        return source
+    
+    def replay_danmaku(self, source, archive=None, incremental=True, before=None):
+        """
+        从原始分段归档重放解析、清洗和入库，不请求B站接口
+        
+        参数:
+            source: 视频弹幕源
+            archive: 分段归档，默认使用配置的归档目录
+            incremental: 是否只写入尚未入库的弹幕；False 时先删除旧弹幕和水位线，按当前清洗规则重建
+            before: 只重放该时间戳(秒)之前抓取的分段，默认使用每个分段最近一次抓取
+            
+        返回:
+            int: 写入的弹幕数量，归档中没有该视频时返回None
+        """
+        archive = archive or get_segment_archive()
+        cid_info_list = archive.load_parts(source.bvid)
+        if not cid_info_list:
+            logger.error(f"归档中没有视频 {source.bvid} 的分P信息")
+            return None
+        
+        if not incremental:
+            deleted_count = self.clear_source(source)
+            logger.info(f"重放前删除了 {deleted_count} 条旧弹幕")
+        
+        parts = list(enumerate(cid_info_list, start=1))
+        writer_stats = self.ingest_segments(source, archive.iter_segments(parts, before), incremental)
+        
+        self.refresh_danmaku_count(source)
+        self.save_snapshot(source)
+        logger.info(f"重放完成: {source.title}, 新增{writer_stats['rows']}条弹幕, 共{source.danmaku_count}条")
+        return writer_stats['rows']
 
 
 # 实例化爬虫
 crawler = BilibiliDanmakuCrawler()
 
-def crawl_video_danmaku(video_url_or_bvid, cookie_str=None, user=None, existing_task=None):
+def crawl_video_danmaku(video_url_or_bvid, cookie_str=None, user=None, existing_task=None, incremental=None):
     """爬取视频弹幕的快捷函数"""
-    return crawler.crawl_danmaku(video_url_or_bvid, cookie_str, user, existing_task) 
\ No newline at end of file
+    return crawler.crawl_danmaku(video_url_or_bvid, cookie_str, user, existing_task, incremental) 
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+弹幕爬虫配置文件
+包含抓取并发、限速等参数
+"""
+
+import os
+
+# 每个弹幕分段(segment_index)覆盖的视频时长(秒)
+SEGMENT_DURATION = 360
+
+# 并发抓取配置
+CONCURRENCY = {
+    'segment_workers': 8,           # 进程内同时进行中的分段(seg.so)请求数，所有爬虫实例共用
+    'max_pending_segments': 16,     # 已提交但尚未入库的最大分段数，多个分P的分段交错抓取
+}
+
+# 流式入库配置
+PIPELINE = {
+    'batch_size': 1000,             # 每批写入数据库的弹幕数，决定入库阶段的峰值内存
+    'writer_queue_size': 4,         # 后台写入队列最多积压的批次数，写满后抓取端阻塞等待
+    'ingest_method': 'sql',         # 入库方式: 'sql' 行元组+多行INSERT(高速), 'orm' Danmaku对象+bulk_create
+    'insert_batch_size': 1000,      # 'sql' 方式下每条 INSERT 语句包含的行数
+}
+
+# HTTP客户端配置，所有B站接口请求共用
+HTTP = {
+    'api_base': os.environ.get('BILIBILI_API_BASE', 'https://api.bilibili.com'),   # 接口地址，压测时指向本地替身服务器
+    'timeout': 10,                  # 单次请求超时(秒)
+    'pool_connections': 4,          # 连接池按主机缓存的数量
+    'pool_maxsize': 32,             # 每个主机的最大保持连接数，应不小于 segment_workers
+    'max_retries': 4,               # 可重试错误的最大重试次数
+    'backoff_base': 0.5,            # 指数退避基数(秒)，第n次重试最多等待 base * 2^n 秒
+    'backoff_max': 30,              # 单次退避的最长等待(秒)
+    'retry_statuses': [412, 429, 500, 502, 503, 504],   # 需要重试的状态码
+    'throttle_statuses': [412, 429],                    # 表示上游限流、触发熔断的状态码
+    'breaker_cooldown': 30,         # 熔断后暂停所有请求的初始时长(秒)，连续触发时翻倍
+    'breaker_max_cooldown': 300,    # 熔断暂停的最长时长(秒)
+}
+
+# 限速配置(令牌桶)，所有B站接口请求共用
+RATE_LIMIT = {
+    'rate': 10.0,                   # 每秒补充的令牌数，即稳定请求速率，<=0 表示不限速
+    'burst': 10,                    # 桶容量，允许的瞬时突发请求数
+}
+
+# WBI签名密钥配置
+WBI_KEYS = {
+    'ttl': 3600,                    # 密钥缓存有效期(秒)，B站密钥约每天轮换
+}
+
+# 增量爬取配置
+INCREMENTAL = {
+    'enabled': True,                # 重新爬取已有视频时默认只写入新增弹幕，False 则删除旧弹幕后全量重爬
+    'lookup_batch_size': 1000,      # 批量查询已入库弹幕ID时每批的数量
+}
+
+# 爬取任务队列配置(manage.py crawl_worker)
+JOB_QUEUE = {
+    'processes': 2,                 # 默认启动的工作进程数，即同时执行的爬取任务上限
+    'lease_seconds': 120,           # 领取任务的租约时长(秒)，超时未续租的任务可被其他进程接管
+    'heartbeat_interval': 30,       # 心跳续租间隔(秒)，应明显小于租约时长
+    'poll_interval': 2,             # 队列为空时的轮询间隔(秒)
+    'max_attempts': 3,              # 任务最多执行次数，超过后不再接管并标记失败
+    'max_running': 8,               # 所有工作进程合计同时执行的任务上限(软限制，并发领取时可能短暂超出)，0 表示只受进程数限制
+    'claim_candidates': 50,         # 每次领取时参与公平排序的用户数上限(每个用户取其下一个任务)
+}
+
+# 批量爬取配置
+BATCH = {
+    'max_size': 1000,               # 单个批次最多包含的视频数
+}
+
+# 原始分段归档配置(manage.py replay_segments 从归档离线重放)
+ARCHIVE = {
+    'enabled': False,               # 是否归档每个 seg.so 原始响应
+    'root': None,                   # 归档目录，None 表示项目目录下的 segment_archive
+    'compression': 'zstd',          # 'zstd'(需安装 zstandard) 或 'gzip'，zstd 不可用时退回 gzip
+    'level': 3,                     # 压缩级别
+}
+
+# 共享弹幕存储配置，同一BV号的弹幕只保存一份，各用户的视频记录引用同一个弹幕源
+SHARED_STORAGE = {
+    'fresh_seconds': 600,           # 弹幕源在该时长(秒)内已爬取过时，增量爬取直接复用已有弹幕，0 表示总是重新抓取
+}
+
+# 视频信息(view 接口)缓存配置，存放在 Django 缓存中，各进程共享
+VIDEO_INFO_CACHE = {
+    'ttl': 600,                     # 缓存有效期(秒)，0 表示不缓存
+}
+
+# 弹幕清洗规则(manage.py cleaning_stats 查看各规则的过滤条数)
+# 每条被过滤的弹幕只计入第一条命中的规则，按列计算的规则(progress、length)按顺序先执行，
+# 正则规则(regex、keywords)合并为一个正则最后匹配。规则类型:
+#   progress  弹幕进度超出分P时长
+#   length    文本长度在 [min, max] 内，except 中的内容除外
+#   regex     正则匹配(search)，pattern 中不能使用命名分组
+#   keywords  包含 words 中的任一关键词
+CLEANING = {
+    'rules': [
+        {'name': 'out_of_range', 'type': 'progress'},
+        {'name': 'empty', 'type': 'length', 'max': 0},
+        {'name': 'too_short', 'type': 'length', 'min': 1, 'max': 2,
+         'except': ['666', '233', '114', '555', '???', '！！！', '。。。', '6']},   # 长度不超过2时也保留的有意义短弹幕
+        {'name': 'meaningless', 'type': 'regex',
+         'pattern': r'^[\s\.\,\。\，\?\~\-\+\=\*\/\\\(\)\[\]\{\}\<\>\|\'\"\;\:\：\…\r\n]+$'},   # 只包含符号
+    ],
+}
+
+# 入库时的弹幕去重统计(规范化文本精确计数 + MinHash/LSH 近似重复聚类)，结果保存在 DanmakuText
+DEDUP = {
+    'enabled': True,                # 是否在入库时统计重复弹幕
+    'num_perm': 64,                 # MinHash 签名长度
+    'bands': 8,                     # LSH 分带数，num_perm=64、bands=8 时相似度阈值约为 0.77
+    'shingle_size': 2,              # 字符 n-gram 长度
+    'max_cluster_texts': 200000,    # 参与近似重复聚类的文本数上限，超出后新文本各自成簇
+    # 修改 num_perm、bands 或 shingle_size 后已保存的分桶键失效，需要把弹幕源的 text_bands_ready 置为 False
+}
+
+# 直播间弹幕接入配置(manage.py live_worker，需安装 websockets)
+LIVE = {
+    'room_info_url': 'https://api.live.bilibili.com/room/v1/Room/get_info',
+    'danmu_info_url': 'https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo',
+    'ws_url': 'wss://broadcastlv.chat.bilibili.com/sub',   # 获取弹幕服务器信息失败时使用的地址
+    'heartbeat_interval': 30,       # 心跳间隔(秒)
+    'batch_size': 500,              # 缓冲区达到该条数时立即写入
+    'flush_interval': 1.0,          # 定时写入缓冲区和发布统计快照的间隔(秒)
+    'writer_queue_size': 4,         # 写入线程队列中最多等待的批次数
+    'reconnect_max_delay': 60,      # 断线重连的最大退避时间(秒)
+    'rate_window': 300,             # 每秒弹幕数保留的秒数
+    'text_window': 60,              # 关键词和情感统计的滚动窗口(秒)
+    'top_keywords': 20,             # 快照中的热门关键词数
+    'snapshot_ttl': 60,             # 缓存中统计快照的有效期(秒)
+    'text_stats_interval': 60,      # 保存弹幕去重统计的间隔(秒)
+}
+
+# 列式弹幕快照配置，爬取完成后按弹幕源写入，分析时以内存映射方式读取
+SNAPSHOT = {
+    'enabled': True,                # 是否在爬取完成后写入快照
+    'root': None,                   # 快照目录，None 表示项目目录下的 danmaku_snapshots
+    'chunk_size': 20000,            # 从数据库流式读取和按列转换的批大小
+    'write_on_analysis': True,      # 分析时快照不存在，从数据库加载后顺便写入快照
+}
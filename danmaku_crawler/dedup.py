@@ -0,0 +1,472 @@
+"""
+入库时的弹幕去重统计
+刷屏弹幕("前方高能" x5000、"awsl" 的各种变体)会放大存储和分析开销。入库时把弹幕文本规范化
+(全角半角折叠、大小写、空白和标点、重复片段压缩)后按哈希精确计数，弹幕源的全部规范化文本再用
+MinHash/LSH 聚合近似重复的簇。统计结果保存在 DanmakuText 中，分析时可以只处理去重后的文本并按次数加权。
+
+每个参与聚类的文本在各 LSH 分带的分桶键保存在 DanmakuTextBand 中，之后的入库只计算新文本的签名，
+按分桶键找到可能相似的已有文本并入其簇，不再重新读取和聚类弹幕源的全部文本。
+
+原始弹幕仍全部入库，时间线等依赖逐条弹幕的分析不受影响。
+"""
+
+import re
+import zlib
+import hashlib
+import logging
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Sum, Count
+
+from . import crawler_config
+from . import ingest
+from .models import DanmakuText, DanmakuTextBand, VideoSource
+
+logger = logging.getLogger(__name__)
+
+# 连续重复的1~4字片段压缩为一次，如 "哈哈哈哈" -> "哈"、"awslawsl" -> "awsl"
+REPEAT_PATTERN = re.compile(r'(.{1,4}?)\1+', re.DOTALL)
+# 空白、标点和符号，规范化时去掉("前方高能！！！" 与 "前方高能" 视为相同)
+SYMBOL_PATTERN = re.compile(r'[\W_]+')
+
+# MinHash 使用的梅森素数，保证 a*h+b 在 uint64 内不溢出
+MERSENNE_PRIME = (1 << 31) - 1
+
+# 多行 INSERT 写入分桶键的列
+BAND_COLUMNS = ('source_id', 'band', 'key', 'text_hash')
+
+
+def canonicalize(text):
+    """
+    规范化弹幕文本
+
+    Args:
+        text: 原始弹幕文本
+
+    Returns:
+        str: 规范化后的文本
+    """
+    # NFKC 把全角字母数字和符号折叠为半角
+    text = unicodedata.normalize('NFKC', text).lower()
+    # 只由符号组成的弹幕("???")保留符号
+    text = SYMBOL_PATTERN.sub('', text) or text
+    return REPEAT_PATTERN.sub(r'\1', text)
+
+
+def text_hash(canonical):
+    """规范化文本的64位有符号哈希，用作 DanmakuText.text_hash"""
+    digest = hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class DuplicateTracker:
+    """累计一次入库过程中的弹幕文本出现次数"""
+
+    def __init__(self):
+        self.raw_counts = Counter()
+
+    def add(self, texts):
+        """记录一批已提交入库的弹幕文本"""
+        self.raw_counts.update(texts)
+
+    def __len__(self):
+        return sum(self.raw_counts.values())
+
+    def aggregate(self):
+        """
+        把原始文本计数合并为规范化文本计数，只对去重后的原始文本做规范化
+
+        Returns:
+            dict: {text_hash: [规范化文本, 代表文本(出现最多的原始写法), 次数]}
+        """
+        groups = {}
+        # 按次数从多到少处理，每组第一次出现的原始写法就是最常见的写法
+        for raw, count in self.raw_counts.most_common():
+            canonical = canonicalize(raw) or raw
+            key = text_hash(canonical)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [canonical, raw, count]
+            else:
+                group[2] += count
+        return groups
+
+
+class MinHashLSH:
+    """基于字符 n-gram 的 MinHash 签名和 LSH 分桶"""
+
+    def __init__(self, num_perm=64, bands=8, shingle_size=2, seed=1):
+        """初始化
+
+        Args:
+            num_perm: 签名长度(哈希函数个数)
+            bands: LSH 分带数，每带 num_perm // bands 行；相似度阈值约为 (1/bands)^(bands/num_perm)
+            shingle_size: 字符 n-gram 长度
+            seed: 哈希参数的随机种子
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+        # 分桶键的多项式哈希系数(奇数)，乘加按 2^64 取模
+        self.weights = rng.integers(0, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+    def shingles(self, text):
+        n = self.shingle_size
+        if len(text) <= n:
+            return [text]
+        return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+    def signatures(self, texts, chunk_size=4096):
+        """
+        计算一组文本的 MinHash 签名，每块文本的全部 n-gram 一次性向量化计算
+
+        Args:
+            texts: 文本列表
+            chunk_size: 每次计算的文本数，限制中间矩阵的内存
+
+        Returns:
+            np.ndarray: (文本数, num_perm) 的签名矩阵
+        """
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint64)
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            hashes = []
+            offsets = []
+            for text in chunk:
+                offsets.append(len(hashes))
+                hashes.extend(zlib.crc32(s.encode('utf-8')) for s in set(self.shingles(text)))
+            values = np.asarray(hashes, dtype=np.uint64)
+            permuted = (self.a * values + self.b) % MERSENNE_PRIME
+            result[start:start + len(chunk)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+        return result
+
+    def band_keys(self, signatures):
+        """
+        每个文本在各分带的分桶键，分带内签名相同的文本分桶键相同
+
+        Args:
+            signatures: 签名矩阵
+
+        Returns:
+            np.ndarray: (文本数, bands) 的 int64 分桶键
+        """
+        blocks = signatures.reshape(len(signatures), self.bands, self.rows)
+        return (blocks * self.weights).sum(axis=2, dtype=np.uint64).view(np.int64)
+
+    def clusters(self, signatures):
+        """
+        LSH 分桶后合并落入同一桶的文本
+
+        Args:
+            signatures: 签名矩阵
+
+        Returns:
+            np.ndarray: 每个文本所属簇的标签(簇中最小的下标)
+        """
+        count = len(signatures)
+        labels = np.arange(count)
+        if count < 2:
+            return labels
+        band_groups = []
+        for band in range(self.bands):
+            block = np.ascontiguousarray(signatures[:, band * self.rows:(band + 1) * self.rows])
+            _, inverse = np.unique(block.view(np.dtype((np.void, block.dtype.itemsize * self.rows))),
+                                   return_inverse=True)
+            band_groups.append(inverse.ravel())
+
+        # 标签传播：同一桶内取最小标签，直到不再变化(即连通分量)
+        changed = True
+        while changed:
+            changed = False
+            for groups in band_groups:
+                minimum = np.full(groups.max() + 1, count, dtype=labels.dtype)
+                np.minimum.at(minimum, groups, labels)
+                propagated = minimum[groups]
+                if (propagated < labels).any():
+                    labels = np.minimum(labels, propagated)
+                    changed = True
+            labels = labels[labels]
+        return labels
+
+
+def get_lsh():
+    """按 crawler_config.DEDUP 创建 MinHashLSH，分桶键依赖这些参数，修改后需要把 text_bands_ready 置为 False"""
+    config = crawler_config.DEDUP
+    return MinHashLSH(config.get('num_perm', 64), config.get('bands', 8), config.get('shingle_size', 2))
+
+
+def save_text_stats(source, tracker):
+    """
+    把一次入库累计的文本计数合并到弹幕源的 DanmakuText，并把新文本并入近似重复簇
+
+    已有文本只累加次数；分桶键尚未建立的弹幕源(功能上线前的数据)对全部文本重新聚类一次。
+
+    Args:
+        source: 视频弹幕源
+        tracker: DuplicateTracker
+
+    Returns:
+        dict: 去重统计，见 get_duplicate_stats
+    """
+    groups = tracker.aggregate()
+    with transaction.atomic():
+        # 锁住弹幕源，直播写入和补爬同时入库时依次修改文本统计和簇
+        locked = VideoSource.objects.select_for_update().get(id=source.id)
+        keys = list(groups)
+        existing = {}
+        for i in range(0, len(keys), 1000):
+            existing.update(
+                (row.text_hash, row) for row in
+                DanmakuText.objects.filter(source=source, text_hash__in=keys[i:i + 1000])
+            )
+        updated = []
+        created = []
+        for key, (canonical, raw, count) in groups.items():
+            row = existing.get(key)
+            if row is not None:
+                row.count += count
+                updated.append(row)
+            else:
+                created.append(DanmakuText(
+                    source=source, text_hash=key, canonical=canonical[:255], text=raw[:255], count=count
+                ))
+
+        new_clusters = 0
+        if locked.text_bands_ready and created:
+            assignments, new_clusters = cluster_new_texts(source, created)
+            for row in created:
+                row.cluster_hash = assignments[row.text_hash]
+        DanmakuText.objects.bulk_update(updated, ['count'], batch_size=1000)
+        DanmakuText.objects.bulk_create(created, batch_size=1000, ignore_conflicts=True)
+
+        if locked.text_bands_ready:
+            source.unique_text_count = locked.unique_text_count + len(created)
+            source.text_cluster_count = locked.text_cluster_count + new_clusters
+            VideoSource.objects.filter(id=source.id).update(
+                unique_text_count=source.unique_text_count, text_cluster_count=source.text_cluster_count
+            )
+        else:
+            update_clusters(source)
+    tracker.raw_counts.clear()
+    return get_duplicate_stats(source)
+
+
+def save_band_keys(source, text_hashes, band_keys):
+    """
+    使用多行参数化 INSERT 保存一批文本的分桶键，忽略已存在的分桶键
+
+    Args:
+        source: 视频弹幕源
+        text_hashes: 文本的 text_hash 列表
+        band_keys: MinHashLSH.band_keys 的结果，与 text_hashes 一一对应
+    """
+    rows = [
+        (source.id, band, key, text_hash)
+        for text_hash, keys in zip(text_hashes, band_keys.tolist())
+        for band, key in enumerate(keys)
+    ]
+    if not rows:
+        return
+    template = ingest.INSERT_TEMPLATES.get(connection.vendor)
+    if template is None:
+        # 不支持的数据库退回 ORM 批量写入
+        DanmakuTextBand.objects.bulk_create(
+            [DanmakuTextBand(**dict(zip(BAND_COLUMNS, row))) for row in rows], batch_size=1000, ignore_conflicts=True
+        )
+        return
+
+    max_params = connection.features.max_query_params
+    batch_size = max(1, min(1000, max_params // len(BAND_COLUMNS))) if max_params else 1000
+    table = connection.ops.quote_name(DanmakuTextBand._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(c) for c in BAND_COLUMNS)
+    placeholder = '(' + ', '.join(['%s'] * len(BAND_COLUMNS)) + ')'
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            chunk = rows[i:i + batch_size]
+            sql = template.format(table=table, columns=columns, values=', '.join([placeholder] * len(chunk)))
+            cursor.execute(sql, [value for row in chunk for value in row])
+
+
+def cluster_new_texts(source, texts):
+    """
+    按已保存的分桶键把新文本并入近似重复簇，并保存新文本的分桶键
+
+    新文本之间按 LSH 聚类；与已有文本在任一分带分桶键相同的新簇并入该文本所在的簇，同时连到
+    多个已有簇时把这些簇合并到代表文本出现次数最多的簇，已有簇的代表文本保持不变。
+    参与聚类的文本达到 max_cluster_texts 后，新文本各自成簇。
+
+    Args:
+        source: 视频弹幕源
+        texts: 尚未写入的新 DanmakuText，按出现次数降序
+
+    Returns:
+        tuple: ({text_hash: 簇标识}, 簇数的变化)
+    """
+    limit = crawler_config.DEDUP.get('max_cluster_texts', 200000)
+    banded = DanmakuTextBand.objects.filter(source=source, band=0).count()
+    room = max(limit - banded, 0)
+    clustered = texts[:room]
+    assignments = {row.text_hash: row.text_hash for row in texts[room:]}
+    new_clusters = len(texts) - len(clustered)
+    if not clustered:
+        return assignments, new_clusters
+
+    lsh = get_lsh()
+    signatures = lsh.signatures([row.canonical for row in clustered])
+    band_keys = lsh.band_keys(signatures)
+    labels = lsh.clusters(signatures).tolist()
+
+    # 新簇(以标签表示)在任一分带与哪些已有文本落入同一桶，弹幕源还没有分桶键时不需要查找
+    linked = defaultdict(set)
+    for band in range(lsh.bands if banded else 0):
+        column = band_keys[:, band]
+        found = defaultdict(list)
+        unique_keys = np.unique(column).tolist()
+        for i in range(0, len(unique_keys), 1000):
+            for key, text_hash in DanmakuTextBand.objects.filter(
+                source=source, band=band, key__in=unique_keys[i:i + 1000]
+            ).values_list('key', 'text_hash'):
+                found[key].append(text_hash)
+        if found:
+            for position in np.flatnonzero(np.isin(column, list(found))).tolist():
+                linked[labels[position]].update(found[int(column[position])])
+
+    matched = list(set().union(*linked.values()))
+    cluster_of = {}
+    for i in range(0, len(matched), 1000):
+        cluster_of.update(
+            DanmakuText.objects.filter(source=source, text_hash__in=matched[i:i + 1000])
+            .values_list('text_hash', 'cluster_hash')
+        )
+    old_clusters = list(set(cluster_of.values()))
+    representative_counts = {}
+    for i in range(0, len(old_clusters), 1000):
+        representative_counts.update(
+            DanmakuText.objects.filter(source=source, text_hash__in=old_clusters[i:i + 1000])
+            .values_list('text_hash', 'count')
+        )
+
+    # 连通分量：新簇经共同的已有簇相连
+    parent = {}
+
+    def find(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for label, text_hashes in linked.items():
+        for text_hash in text_hashes:
+            cluster = cluster_of.get(text_hash)
+            if cluster is not None:
+                root, other = find(('new', label)), find(('old', cluster))
+                if root != other:
+                    parent[root] = other
+
+    components = defaultdict(lambda: ([], []))
+    for label in set(labels):
+        components[find(('new', label))][0].append(label)
+    for cluster in old_clusters:
+        components[find(('old', cluster))][1].append(cluster)
+
+    targets = {}
+    for new_labels, clusters in components.values():
+        if clusters:
+            target = max(clusters, key=lambda cluster: (representative_counts.get(cluster, 0), cluster))
+            merged = [cluster for cluster in clusters if cluster != target]
+            for i in range(0, len(merged), 1000):
+                DanmakuText.objects.filter(source=source, cluster_hash__in=merged[i:i + 1000]).update(cluster_hash=target)
+            new_clusters -= len(merged)
+        else:
+            # 没有连到已有簇的分量只含一个新簇，簇标签是簇内出现次数最多的文本的下标
+            target = clustered[new_labels[0]].text_hash
+            new_clusters += 1
+        for label in new_labels:
+            targets[label] = target
+
+    for row, label in zip(clustered, labels):
+        assignments[row.text_hash] = targets[label]
+    save_band_keys(source, [row.text_hash for row in clustered], band_keys)
+    return assignments, new_clusters
+
+
+def update_clusters(source):
+    """
+    对弹幕源的全部规范化文本重新做 MinHash/LSH 近似重复聚类，并重建分桶键
+
+    簇标识为簇中出现次数最多的文本的 text_hash。只对出现次数最多的 max_cluster_texts 条文本聚类，
+    其余文本各自成簇。用于分桶键尚未建立的弹幕源，之后的入库由 cluster_new_texts 增量聚类。
+    """
+    rows = list(
+        DanmakuText.objects.filter(source=source).order_by('-count', 'id')
+        .values_list('id', 'text_hash', 'canonical', 'cluster_hash')
+    )
+    limit = crawler_config.DEDUP.get('max_cluster_texts', 200000)
+    clustered = rows[:limit]
+
+    lsh = get_lsh()
+    signatures = lsh.signatures([canonical for _, _, canonical, _ in clustered])
+    labels = lsh.clusters(signatures) if clustered else []
+
+    changes = defaultdict(list)
+    for position, (row_id, key, _, cluster_hash) in enumerate(rows):
+        # 行按次数降序排列，簇标签是簇内最小下标，即出现次数最多的文本
+        cluster = clustered[labels[position]][1] if position < len(clustered) else key
+        if cluster != cluster_hash:
+            changes[cluster].append(row_id)
+    for cluster, ids in changes.items():
+        for i in range(0, len(ids), 1000):
+            DanmakuText.objects.filter(id__in=ids[i:i + 1000]).update(cluster_hash=cluster)
+
+    DanmakuTextBand.objects.filter(source=source).delete()
+    save_band_keys(source, [key for _, key, _, _ in clustered], lsh.band_keys(signatures))
+
+    cluster_count = (len(np.unique(labels)) if clustered else 0) + max(len(rows) - limit, 0)
+    VideoSource.objects.filter(id=source.id).update(
+        unique_text_count=len(rows), text_cluster_count=cluster_count, text_bands_ready=True
+    )
+    source.unique_text_count = len(rows)
+    source.text_cluster_count = cluster_count
+    source.text_bands_ready = True
+
+
+def get_duplicate_stats(source, top_n=20):
+    """
+    弹幕源的去重统计
+
+    Args:
+        source: 视频弹幕源
+        top_n: 返回刷屏最多的簇数
+
+    Returns:
+        dict: 入库弹幕数、规范化后不同文本数、近似重复簇数、重复率和刷屏最多的簇
+    """
+    total = DanmakuText.objects.filter(source=source).aggregate(total=Sum('count'))['total'] or 0
+    clusters = (
+        DanmakuText.objects.filter(source=source).values('cluster_hash')
+        .annotate(count=Sum('count'), variants=Count('id')).order_by('-count')[:top_n]
+    )
+    texts = dict(
+        DanmakuText.objects.filter(source=source, text_hash__in=[c['cluster_hash'] for c in clusters])
+        .values_list('text_hash', 'text')
+    )
+    return {
+        'total': total,
+        'unique_texts': source.unique_text_count,
+        'clusters': source.text_cluster_count,
+        'duplicate_rate': round(1 - source.text_cluster_count / total, 4) if total else 0.0,
+        'top_clusters': [
+            {'text': texts.get(c['cluster_hash'], ''), 'count': c['count'], 'variants': c['variants']}
+            for c in clusters
+        ],
+    }
@@ -1,7 +1,7 @@
 from . import danmu_pb2  # 根据 .proto 文件生成的 Python 代码
 from . import wbisign
 import re
-import requests
+from ..http_client import get_http_client
 import time
 from django.utils import timezone
 from .models import Video, Danmaku  
@@ -68,7 +68,7 @@ def get_video_info(bvid):
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0',
         'Referer': f'https://www.bilibili.com/video/{bvid}',
     }
-    response = requests.get(url, headers=headers)
+    response = get_http_client().get(url, headers=headers)
     if response.status_code == 200:
         data = response.json()
         if data['code'] == 0:
@@ -108,7 +108,7 @@ def get_all_danmu(cid, pid, cookie=None, max_pages=None, max_retries=3):
         retries = 0
         while retries < max_retries:
             try:
-                response = requests.get(url, headers=headers, cookies=cookie)
+                response = get_http_client().get(url, headers=headers, cookies=cookie)
                 if response.status_code == 200:
                     dm_seg_reply = danmu_pb2.DmSegMobileReply()
                     dm_seg_reply.ParseFromString(response.content)
@@ -0,0 +1,152 @@
+"""
+爬虫共享HTTP客户端
+所有B站接口请求共用一个带连接池的会话，统一处理限速、重试退避和熔断。
+"""
+
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import crawler_config
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0',
+    'Referer': 'https://www.bilibili.com',
+}
+
+
+class CircuitBreaker:
+    """熔断器
+
+    上游返回限流状态码(412/429)时打开熔断，冷却期间所有工作线程暂停请求；
+    连续触发时冷却时间按指数增长，请求成功后恢复。
+    """
+
+    def __init__(self, cooldown=30, max_cooldown=300):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._open_until = 0.0
+        self._trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def trip(self):
+        """上游限流，打开熔断"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                # 冷却期内其他线程已触发过
+                return
+            self._trips += 1
+            cooldown = min(self.max_cooldown, self.cooldown * (2 ** (self._trips - 1)))
+            self._open_until = now + cooldown
+        logger.warning(f"上游开始限流，暂停所有请求 {cooldown:.0f} 秒(连续第 {self._trips} 次)")
+
+    def record_success(self):
+        if self._trips:
+            with self._lock:
+                self._trips = 0
+
+    def wait(self):
+        """熔断打开时阻塞到冷却结束"""
+        while True:
+            remaining = self._open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+class BilibiliHttpClient:
+    """带连接池、限速、指数退避重试和熔断的HTTP客户端"""
+
+    def __init__(self, config=None):
+        config = config or crawler_config.HTTP
+        rate_limit = crawler_config.RATE_LIMIT
+
+        self.timeout = config.get('timeout', 10)
+        self.max_retries = config.get('max_retries', 4)
+        self.backoff_base = config.get('backoff_base', 0.5)
+        self.backoff_max = config.get('backoff_max', 30)
+        self.retry_statuses = set(config.get('retry_statuses', [412, 429, 500, 502, 503, 504]))
+        self.throttle_statuses = set(config.get('throttle_statuses', [412, 429]))
+
+        # 连接池大小需不小于并发请求数，否则多余的连接会在请求后被丢弃，失去 keep-alive 的效果
+        adapter = HTTPAdapter(
+            pool_connections=config.get('pool_connections', 4),
+            pool_maxsize=config.get('pool_maxsize', 32),
+            max_retries=0,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.rate_limiter = TokenBucket(rate_limit.get('rate', 10.0), rate_limit.get('burst', 10))
+        self.breaker = CircuitBreaker(config.get('breaker_cooldown', 30), config.get('breaker_max_cooldown', 300))
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待时间：指数退避加全随机抖动"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        """发送GET请求
+
+        限流状态码会触发熔断，可重试状态码和网络异常按指数退避重试，
+        重试次数用尽后返回最后一次响应或抛出最后一次异常。
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        response = None
+        for attempt in range(self.max_retries + 1):
+            self.breaker.wait()
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"请求异常: {str(e)}，{delay:.1f}秒后重试({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                continue
+
+            if response.status_code not in self.retry_statuses:
+                self.breaker.record_success()
+                return response
+
+            if response.status_code in self.throttle_statuses:
+                self.breaker.trip()
+            if attempt >= self.max_retries:
+                break
+            delay = self.backoff(attempt)
+            logger.warning(f"请求返回 {response.status_code}，{delay:.1f}秒后重试({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+        return response
+
+
+def api_url(path):
+    """拼接B站接口地址，接口根地址读取 crawler_config.HTTP['api_base']"""
+    return crawler_config.HTTP.get('api_base', 'https://api.bilibili.com').rstrip('/') + path
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """获取进程内共享的HTTP客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = BilibiliHttpClient()
+    return _client
@@ -0,0 +1,212 @@
+"""
+弹幕高速入库
+跳过 Danmaku 模型实例，直接构造行元组并使用多行参数化 INSERT 批量写入。
+时间戳和颜色转换按整批向量化处理。
+"""
+
+import logging
+import datetime
+import collections
+from itertools import repeat
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import timeline
+from .models import Danmaku
+from .columnar import as_columns
+
+logger = logging.getLogger(__name__)
+
+# 写入的列，顺序与 build_rows 产出的元组一致
+COLUMNS = (
+    'source_id', 'page_id', 'page_duration', 'dmid', 'content', 'send_time', 'progress',
+    'mode', 'font_size', 'color', 'user_hash', 'weight', 'created_at',
+)
+
+# 行元组中用于每秒弹幕数的 (弹幕源ID, 分P编号, 进度) 列
+SECOND_KEY = itemgetter(COLUMNS.index('source_id'), COLUMNS.index('page_id'), COLUMNS.index('progress'))
+DMID_KEY = itemgetter(COLUMNS.index('dmid'))
+CONTENT_KEY = itemgetter(COLUMNS.index('content'))
+
+# 各数据库忽略唯一键冲突的 INSERT 语法
+INSERT_TEMPLATES = {
+    'mysql': 'INSERT IGNORE INTO {table} ({columns}) VALUES {values}',
+    'sqlite': 'INSERT OR IGNORE INTO {table} ({columns}) VALUES {values}',
+    'postgresql': 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT DO NOTHING',
+}
+
+
+def convert_timestamps(timestamps):
+    """将Unix时间戳批量转换为数据库存储的 datetime
+
+    USE_TZ=True 时转换为UTC，否则转换为 TIME_ZONE 对应的本地时间，与 datetime.fromtimestamp 一致。
+
+    Args:
+        timestamps: Unix时间戳(秒)序列
+
+    Returns:
+        list: naive datetime 列表
+    """
+    if len(timestamps) == 0:
+        return []
+    index = pd.to_datetime(np.asarray(timestamps, dtype='int64'), unit='s', utc=True)
+    if not settings.USE_TZ:
+        index = index.tz_convert(timezone.get_default_timezone_name())
+    # datetime64[us] 转 object 时由 NumPy 在C层批量构造 datetime，比 to_pydatetime 快得多
+    return index.tz_localize(None).values.astype('datetime64[us]').astype(object).tolist()
+
+
+def convert_colors(colors):
+    """将整数颜色批量转换为 '#rrggbb' 格式，同一批弹幕的颜色种类很少，只格式化去重后的值"""
+    if len(colors) == 0:
+        return []
+    values, inverse = np.unique(np.asarray(colors, dtype='int64'), return_inverse=True)
+    formatted = np.array([f"#{value:06x}" for value in values.tolist()], dtype=object)
+    return formatted[inverse].tolist()
+
+
+def build_rows(danmakus, source_id, page_num=1, page_duration=0):
+    """将一批弹幕转换为待写入的行元组
+
+    没有数字 dmid 的弹幕无法写入 BigIntegerField 主键列，直接跳过。
+
+    Args:
+        danmakus: 列式弹幕(DanmakuColumns)，也可以是弹幕对象列表
+        source_id: 弹幕源ID
+        page_num: 分P编号
+        page_duration: 分P时长
+
+    Returns:
+        list: 与 COLUMNS 顺序一致的行元组列表
+    """
+    danmakus = as_columns(danmakus)
+    valid = danmakus.dmid > 0
+    if not valid.all():
+        logger.warning(f"跳过 {len(danmakus) - int(valid.sum())} 条没有有效dmid的弹幕")
+        danmakus = danmakus.take(valid)
+    count = len(danmakus)
+    if not count:
+        return []
+
+    send_times = convert_timestamps(danmakus.date)
+    colors = convert_colors(danmakus.color)
+    created_at = timezone.now()
+    if settings.USE_TZ:
+        created_at = timezone.make_naive(created_at, datetime.timezone.utc)
+
+    return list(zip(
+        repeat(source_id, count), repeat(page_num, count), repeat(page_duration, count),
+        danmakus.dmid.tolist(), danmakus.text, send_times, danmakus.stime.tolist(),
+        danmakus.mode.tolist(), danmakus.size.tolist(), colors, danmakus.uhash,
+        danmakus.weight.tolist(), repeat(created_at, count),
+    ))
+
+
+def get_batch_size(requested):
+    """根据数据库参数个数上限调整每条 INSERT 的行数"""
+    max_params = connection.features.max_query_params
+    if max_params:
+        return max(1, min(requested, max_params // len(COLUMNS)))
+    return requested
+
+
+def existing_dmids(dmids, batch_size=1000):
+    """查询已入库的弹幕ID
+
+    Args:
+        dmids: 弹幕ID序列
+        batch_size: 每条查询包含的ID数
+
+    Returns:
+        set: 其中已入库的弹幕ID
+    """
+    dmids = list(dmids)
+    max_params = connection.features.max_query_params
+    if max_params:
+        batch_size = min(batch_size, max_params)
+    existing = set()
+    for i in range(0, len(dmids), batch_size):
+        existing.update(Danmaku.objects.filter(dmid__in=dmids[i:i + batch_size]).values_list('dmid', flat=True))
+    return existing
+
+
+def exclude_existing(rows, key=DMID_KEY):
+    """去掉已入库的弹幕和本批内 dmid 重复的弹幕，剩下的弹幕写入时不会因冲突被忽略
+
+    Args:
+        rows: 行元组列表，或配合 key 使用的 Danmaku 对象列表
+        key: 取弹幕ID的函数
+
+    Returns:
+        list: 尚未入库的弹幕
+    """
+    seen = existing_dmids(map(key, rows))
+    result = []
+    for row in rows:
+        dmid = key(row)
+        if dmid not in seen:
+            seen.add(dmid)
+            result.append(row)
+    return result
+
+
+def insert_rows(rows, batch_size=1000):
+    """使用多行参数化 INSERT 批量写入弹幕行，忽略 dmid 冲突
+
+    同一事务中更新 DanmakuSecondBucket：整批写入时直接累加，部分行因冲突被忽略时按弹幕表重新计数。
+
+    Args:
+        rows: build_rows 产出的行元组列表
+        batch_size: 每条 INSERT 语句包含的行数
+
+    Returns:
+        int: 实际写入的行数
+    """
+    if not rows:
+        return 0
+
+    template = INSERT_TEMPLATES.get(connection.vendor)
+    if template is None:
+        # 不支持的数据库退回 ORM 批量写入
+        return _insert_rows_orm(rows, batch_size)
+
+    batch_size = get_batch_size(batch_size)
+    table = connection.ops.quote_name(Danmaku._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(c) for c in COLUMNS)
+    placeholder = '(' + ', '.join(['%s'] * len(COLUMNS)) + ')'
+
+    inserted = 0
+    increments = collections.Counter()
+    recount = set()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for i in range(0, len(rows), batch_size):
+                chunk = rows[i:i + batch_size]
+                sql = template.format(table=table, columns=columns, values=', '.join([placeholder] * len(chunk)))
+                cursor.execute(sql, [value for row in chunk for value in row])
+                count = cursor.rowcount if cursor.rowcount >= 0 else len(chunk)
+                inserted += count
+                seconds = timeline.count_seconds(map(SECOND_KEY, chunk))
+                if count == len(chunk):
+                    increments.update(seconds)
+                else:
+                    recount.update(seconds)
+            # 需要重新计数的秒不再累加，避免重复计入
+            for key in recount:
+                increments.pop(key, None)
+            timeline.add_seconds(increments, cursor)
+            timeline.recount_seconds(recount)
+    return inserted
+
+
+def _insert_rows_orm(rows, batch_size):
+    objs = [Danmaku(**dict(zip(COLUMNS, row))) for row in rows]
+    with transaction.atomic():
+        Danmaku.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+        # bulk_create 忽略冲突时不返回实际写入的行，按弹幕表重新计数
+        timeline.recount_seconds(timeline.count_seconds(map(SECOND_KEY, rows)))
+    return len(objs)
@@ -0,0 +1,505 @@
+"""
+基于 CrawlTask 表的持久化爬取任务队列
+Web 进程只负责把任务写入队列，由 manage.py crawl_worker 启动的工作进程领取执行。
+工作进程领取任务时获得租约并定期心跳续租，进程崩溃后租约过期，任务会被其他进程接管。
+领取顺序: 优先级高的先执行；同一优先级下优先领取当前执行中任务最少的用户的任务，多个用户的批次交错执行；
+全局执行中的任务数不超过 max_running(软限制，多个进程同时领取时可能短暂超出)。
+"""
+
+import os
+import socket
+import logging
+import threading
+from datetime import timedelta
+from django.db import connections, transaction
+from django.db.models import Q, F, Count, Sum, Min, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import VideoSource, Video, CrawlTask, CrawlBatch
+from . import crawler_config
+
+logger = logging.getLogger(__name__)
+
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+
+def lock_bvid(bvid):
+    """
+    锁住同一BV号的全部视频记录，需要在事务中调用
+
+    同一BV号的任务提交、恢复和领取在锁内先检查进行中的任务再写入，
+    并发执行时不会都认为没有进行中的任务而各自创建或领取一个独立任务。
+    视频记录在提交任务前已经创建，(bvid, user) 联合唯一索引保证只锁住该BV号的记录。
+    """
+    list(Video.objects.select_for_update().filter(bvid=bvid).order_by('id').values_list('id', flat=True))
+
+
+def find_inflight_task(video, full_refresh=False, exclude=None):
+    """
+    查找同一BV号上等待中或执行中、可以合并的任务
+
+    增量爬取可以合并到任意进行中的任务；全量重爬只合并到同样是全量重爬的任务，
+    没有时单独排队，工作进程在同一BV号的任务执行结束后才会领取它。
+    弹幕源按BV号共享，按BV号匹配时尚未获取视频信息(还没有弹幕源)的任务也能合并。
+
+    参数:
+        video: 视频对象
+        full_refresh: 新任务是否全量重爬
+        exclude: 不参与匹配的任务，恢复任务时排除任务自身
+
+    返回:
+        CrawlTask: 可合并的任务，没有时返回None
+    """
+    tasks = CrawlTask.objects.filter(
+        video__bvid=video.bvid, status__in=ACTIVE_STATUSES, leader__isnull=True
+    )
+    if full_refresh:
+        tasks = tasks.filter(full_refresh=True)
+    if exclude is not None:
+        tasks = tasks.exclude(id=exclude.id)
+    return tasks.order_by('created_at').first()
+
+
+def can_full_refresh(video, user):
+    """
+    判断用户能否对视频发起全量重爬
+
+    全量重爬会删除弹幕源上的全部弹幕、水位线和统计，影响引用该弹幕源的所有用户：
+    管理员可以直接重爬，普通用户只能重爬只有自己引用的弹幕源。
+
+    参数:
+        video: 视频对象
+        user: 提交任务的用户
+
+    返回:
+        bool: 是否允许全量重爬
+    """
+    if user is not None and user.is_staff:
+        return True
+    if video.source_id is None:
+        return True
+    return not Video.objects.filter(source_id=video.source_id).exclude(id=video.id).exists()
+
+
+def enqueue_crawl_task(video, user=None, cookie_str=None, full_refresh=False, batch=None, priority=0):
+    """
+    提交爬取任务到队列
+
+    同一视频已有任务在等待或执行时，新任务合并到该任务上，不会重复爬取，
+    该任务结束时合并的任务同步得到相同的结果。
+
+    参数:
+        video: 视频对象
+        user: 提交任务的用户
+        cookie_str: 用户Cookie字符串
+        full_refresh: 是否全量重爬
+        batch: 所属批次
+        priority: 优先级，数值越大越先执行
+
+    返回:
+        CrawlTask: 等待执行的任务，合并时 leader 为正在执行的任务
+    """
+    with transaction.atomic():
+        lock_bvid(video.bvid)
+        leader = find_inflight_task(video, full_refresh)
+        task = CrawlTask.objects.create(
+            video=video,
+            status=leader.status if leader else 'pending',
+            started_at=leader.started_at if leader else None,
+            user=user,
+            cookie_str=cookie_str or '',
+            full_refresh=full_refresh,
+            leader=leader,
+            batch=batch,
+            priority=priority,
+        )
+    if leader:
+        logger.info(f"任务 {task.id} 合并到进行中的任务 {leader.id}，视频: {video.bvid}")
+        _sync_finished_leader(task, leader)
+    return task
+
+
+def _sync_finished_leader(task, leader):
+    """合并前任务可能刚好结束，此时直接同步结果"""
+    leader.refresh_from_db(fields=['status'])
+    if leader.status not in ACTIVE_STATUSES:
+        complete_followers(leader)
+        task.refresh_from_db()
+
+
+def resume_crawl_task(task):
+    """
+    重新排队失败的任务
+
+    同一BV号已有可合并的任务在等待或执行时合并到该任务上，否则作为独立任务重新排队，
+    工作进程执行时跳过已记录检查点的分段继续抓取。
+
+    参数:
+        task: 失败的任务
+
+    返回:
+        CrawlTask: 重新排队的任务
+    """
+    with transaction.atomic():
+        lock_bvid(task.video.bvid)
+        leader = find_inflight_task(task.video, task.full_refresh, exclude=task)
+        task.status = leader.status if leader else 'pending'
+        task.started_at = leader.started_at if leader else None
+        task.error_message = ''
+        task.completed_at = None
+        task.attempts = 0
+        task.worker_id = ''
+        task.lease_expires_at = None
+        task.leader = leader
+        task.save(update_fields=[
+            'status', 'started_at', 'error_message', 'completed_at', 'attempts', 'worker_id', 'lease_expires_at', 'leader',
+        ])
+    if leader:
+        logger.info(f"恢复的任务 {task.id} 合并到进行中的任务 {leader.id}，视频: {task.video.bvid}")
+        _sync_finished_leader(task, leader)
+    return task
+
+
+def complete_followers(leader):
+    """
+    把任务的最终结果同步给合并到它上面的任务
+
+    参数:
+        leader: 已结束的任务
+    """
+    leader.refresh_from_db(fields=['status', 'danmaku_count', 'error_message', 'completed_at'])
+    if leader.status in ACTIVE_STATUSES:
+        return 0
+    count = CrawlTask.objects.filter(leader=leader, status__in=ACTIVE_STATUSES).update(
+        status=leader.status,
+        danmaku_count=leader.danmaku_count,
+        error_message=leader.error_message,
+        completed_at=leader.completed_at or timezone.now(),
+    )
+    if count:
+        logger.info(f"任务 {leader.id} 已结束({leader.status})，同步结果到 {count} 个合并的任务")
+    return count
+
+
+def submit_crawl_batch(videos, user=None, name='', priority=0, cookie_str=None, full_refresh=False):
+    """
+    批量提交爬取任务
+
+    提交时只解析BV号并写入队列，不请求B站接口；视频信息由工作进程执行任务时获取，
+    尚未入库的视频先以BV号作为标题创建视频记录，获取信息失败只影响对应的任务。
+
+    参数:
+        videos: BV号或视频URL列表，重复的视频只提交一次
+        user: 提交任务的用户
+        name: 批次名称
+        priority: 批次内任务的优先级
+        cookie_str: 用户Cookie字符串
+        full_refresh: 是否全量重爬
+
+    返回:
+        tuple: (CrawlBatch 批次, 无法解析BV号的输入列表)
+    """
+    from .crawler import parse_bvid
+
+    max_size = crawler_config.BATCH.get('max_size', 1000)
+    if len(videos) > max_size:
+        raise ValueError(f"单个批次最多包含 {max_size} 个视频")
+
+    invalid = []
+    bvids = []
+    for item in videos:
+        item = item.strip()
+        bvid = parse_bvid(item)
+        if not bvid:
+            invalid.append(item)
+        elif bvid not in bvids:
+            bvids.append(bvid)
+
+    batch = CrawlBatch.objects.create(name=name, user=user, priority=priority)
+    sources = VideoSource.objects.in_bulk(bvids, field_name='bvid')
+    for bvid in bvids:
+        source = sources.get(bvid)
+        if source is not None:
+            defaults = {
+                'aid': source.aid, 'title': source.title, 'owner': source.owner, 'owner_mid': source.owner_mid,
+                'duration': source.duration, 'danmaku_count': source.danmaku_count, 'source': source,
+            }
+        else:
+            defaults = {'title': bvid, 'owner': ''}
+        video, _ = Video.objects.get_or_create(bvid=bvid, user=user, defaults=defaults)
+        enqueue_crawl_task(video, user, cookie_str, full_refresh, batch=batch, priority=priority)
+
+    logger.info(f"批次 {batch.id} 已提交 {len(bvids)} 个视频，无效 {len(invalid)} 个")
+    return batch, invalid
+
+
+def get_batch_progress(batch):
+    """
+    汇总批次的执行进度和吞吐量
+
+    参数:
+        batch: 批次
+
+    返回:
+        dict: 各状态任务数、完成比例、新增弹幕数以及吞吐量
+    """
+    tasks = CrawlTask.objects.filter(batch=batch)
+    counts = dict(tasks.values_list('status').annotate(count=Count('id')).order_by())
+    summary = tasks.aggregate(
+        total=Count('id'),
+        danmaku_count=Sum('danmaku_count'),
+        started_at=Min('started_at'),
+        completed_at=Max('completed_at'),
+    )
+    total = summary['total']
+    finished = counts.get('completed', 0) + counts.get('failed', 0)
+    danmaku_count = summary['danmaku_count'] or 0
+
+    # 进行中时按当前时间计算耗时，全部结束后按最后完成时间计算
+    elapsed = 0.0
+    if summary['started_at']:
+        end = summary['completed_at'] if finished == total and summary['completed_at'] else timezone.now()
+        elapsed = max((end - summary['started_at']).total_seconds(), 0.0)
+
+    return {
+        'total': total,
+        'pending': counts.get('pending', 0),
+        'running': counts.get('running', 0),
+        'completed': counts.get('completed', 0),
+        'failed': counts.get('failed', 0),
+        'progress': round(finished / total, 4) if total else 1.0,
+        'danmaku_count': danmaku_count,
+        'elapsed_seconds': round(elapsed, 1),
+        'videos_per_minute': round(finished / elapsed * 60, 2) if elapsed else 0.0,
+        'danmaku_per_second': round(danmaku_count / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class CrawlWorker:
+    """爬取任务工作者，循环领取并执行队列中的任务"""
+
+    def __init__(self, worker_id=None, config=None):
+        config = config or crawler_config.JOB_QUEUE
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = config.get('lease_seconds', 120)
+        self.heartbeat_interval = config.get('heartbeat_interval', 30)
+        self.poll_interval = config.get('poll_interval', 2)
+        self.max_attempts = config.get('max_attempts', 3)
+        self.max_running = config.get('max_running', 0)
+        self.claim_candidates = config.get('claim_candidates', 50)
+        self.stop_event = threading.Event()
+
+    def _claimable(self, now):
+        """等待中的任务，以及租约已过期(执行进程已失联)的运行中任务"""
+        return CrawlTask.objects.filter(
+            Q(status='pending') | Q(status='running', lease_expires_at__lt=now),
+            leader__isnull=True,
+        )
+
+    def fail_exhausted_tasks(self):
+        """执行次数用尽且租约过期的任务标记为失败"""
+        now = timezone.now()
+        exhausted = CrawlTask.objects.filter(
+            status='running', lease_expires_at__lt=now, attempts__gte=self.max_attempts, leader__isnull=True
+        )
+        task_ids = list(exhausted.values_list('id', flat=True))
+        if not task_ids:
+            return
+        count = exhausted.filter(id__in=task_ids).update(
+            status='failed',
+            error_message='任务执行进程多次中断，超过最大执行次数',
+            completed_at=now,
+            lease_expires_at=None,
+        )
+        if count:
+            logger.warning(f"{count} 个任务超过最大执行次数，已标记为失败")
+        for task in CrawlTask.objects.filter(id__in=task_ids, status='failed'):
+            complete_followers(task)
+
+    def _running(self, now):
+        """租约有效的执行中任务"""
+        return CrawlTask.objects.filter(status='running', leader__isnull=True, lease_expires_at__gte=now)
+
+    def get_candidates(self, now):
+        """
+        按优先级和用户公平性排序的候选任务
+
+        每个用户只取其下一个待执行任务(优先级最高、最早提交)；同一优先级下，
+        当前执行中任务少的用户排在前面，再按用户最近一次开始执行任务的时间轮转，
+        多个用户的大批量任务因此交错执行，不会被先提交的批次独占。
+        同一BV号已有任务在执行时，该BV号的其他任务不参与领取，一个弹幕源同时只有一个任务在爬取。
+        排队用户超过 claim_candidates 个时，按用户最高优先级和最近一次开始执行的时间取前面的用户，
+        长时间没有执行过任务的用户总能进入候选。
+        """
+        claimable = self._claimable(now).exclude(video__bvid__in=self._running(now).values('video__bvid'))
+        last_started = CrawlTask.objects.filter(
+            user_id=OuterRef('user_id'), leader__isnull=True, started_at__isnull=False
+        ).order_by('-started_at').values('started_at')[:1]
+        users = (
+            claimable.order_by().values('user_id')
+            .annotate(top_priority=Max('priority'), last_started_at=Subquery(last_started))
+            .order_by('-top_priority', F('last_started_at').asc(nulls_first=True), 'user_id')
+        )
+        candidates = []
+        for user_id in [row['user_id'] for row in users[:self.claim_candidates]]:
+            head = claimable.filter(user_id=user_id).order_by('-priority', 'created_at').values(
+                'id', 'status', 'worker_id', 'attempts', 'priority', 'user_id', 'created_at', 'video__bvid'
+            ).first()
+            if head:
+                head['last_started_at'] = CrawlTask.objects.filter(
+                    user_id=user_id, leader__isnull=True, started_at__isnull=False
+                ).aggregate(last=Max('started_at'))['last']
+                candidates.append(head)
+
+        running_by_user = dict(
+            self._running(now).values_list('user_id').annotate(count=Count('id')).order_by()
+        )
+        return sorted(
+            candidates,
+            key=lambda c: (
+                -c['priority'],
+                running_by_user.get(c['user_id'], 0),
+                # 从未执行过任务的用户最先，其余按最近一次开始时间从早到晚
+                c['last_started_at'] is not None,
+                c['last_started_at'] or now,
+                c['created_at'],
+                c['id'],
+            )
+        )
+
+    def claim_task(self):
+        """
+        领取一个任务
+
+        使用带条件的 UPDATE 抢占任务，多个进程同时领取同一任务时只有一个能成功。
+        max_running 是软限制：先计数再领取，多个进程同时领取时执行中的任务数可能短暂超出上限。
+        同一BV号的不同任务由 lock_bvid 串行领取，锁内确认该BV号没有租约有效的执行中任务后才抢占，
+        全量重爬因此不会在其他任务写入弹幕时清空弹幕源。
+
+        返回:
+            CrawlTask: 领取到的任务，队列为空或已达到全局并发上限时返回None
+        """
+        self.fail_exhausted_tasks()
+        now = timezone.now()
+        if self.max_running and self._running(now).count() >= self.max_running:
+            return None
+
+        for candidate in self.get_candidates(now):
+            if self._claim(candidate, now):
+                return CrawlTask.objects.select_related('video', 'user').get(id=candidate['id'])
+        return None
+
+    def _claim(self, candidate, now):
+        """抢占一个候选任务，成功时返回True"""
+        with transaction.atomic():
+            lock_bvid(candidate['video__bvid'])
+            busy = self._running(now).filter(video__bvid=candidate['video__bvid']).exclude(id=candidate['id'])
+            if busy.exists():
+                return False
+            claimed = CrawlTask.objects.filter(
+                id=candidate['id'],
+                status=candidate['status'],
+                worker_id=candidate['worker_id'],
+                attempts=candidate['attempts'],
+            ).update(
+                status='running',
+                worker_id=self.worker_id,
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                heartbeat_at=now,
+                started_at=now,
+                attempts=candidate['attempts'] + 1,
+            )
+            if claimed:
+                # 合并到该任务的等待中任务随之进入执行中
+                CrawlTask.objects.filter(leader_id=candidate['id'], status='pending').update(status='running', started_at=now)
+            return bool(claimed)
+
+    def heartbeat(self, task):
+        """
+        为任务续租
+
+        返回:
+            bool: 续租是否成功(任务仍由本进程持有)
+        """
+        now = timezone.now()
+        renewed = CrawlTask.objects.filter(id=task.id, worker_id=self.worker_id, status='running').update(
+            heartbeat_at=now,
+            lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+        )
+        return bool(renewed)
+
+    def _heartbeat_loop(self, task, done_event):
+        try:
+            while not done_event.wait(self.heartbeat_interval):
+                if not self.heartbeat(task):
+                    logger.warning(f"任务 {task.id} 续租失败，任务可能已结束或被其他进程接管")
+                    return
+        finally:
+            connections.close_all()
+
+    def run_task(self, task):
+        """执行一个已领取的任务"""
+        from .crawler import crawl_video_danmaku
+
+        logger.info(f"[{self.worker_id}] 开始执行任务 ID: {task.id}, 视频: {task.video.bvid} (第 {task.attempts} 次)")
+        done_event = threading.Event()
+        heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, args=(task, done_event), name=f'crawl-heartbeat-{task.id}', daemon=True
+        )
+        heartbeat_thread.start()
+        try:
+            result = crawl_video_danmaku(
+                task.video.bvid,
+                cookie_str=task.cookie_str or None,
+                user=task.user,
+                existing_task=task,
+                incremental=False if task.full_refresh else None,
+            )
+            if result is None:
+                # 爬虫在创建任务前失败时不会更新任务状态，这里兜底
+                CrawlTask.objects.filter(id=task.id, status='running').update(
+                    status='failed',
+                    error_message='爬取过程中出现错误',
+                    completed_at=timezone.now(),
+                )
+        except Exception as e:
+            logger.exception(f"任务执行异常 - 任务ID: {task.id}, 异常: {str(e)}")
+            CrawlTask.objects.filter(id=task.id).update(
+                status='failed',
+                error_message=str(e),
+                completed_at=timezone.now(),
+            )
+        finally:
+            done_event.set()
+            heartbeat_thread.join()
+            CrawlTask.objects.filter(id=task.id, worker_id=self.worker_id).update(lease_expires_at=None)
+            complete_followers(task)
+
+    def run(self, once=False):
+        """
+        循环领取并执行任务，直到 stop() 被调用
+
+        参数:
+            once: 为True时队列为空即退出
+        """
+        logger.info(f"爬取工作进程启动: {self.worker_id}")
+        while not self.stop_event.is_set():
+            try:
+                task = self.claim_task()
+            except Exception as e:
+                logger.error(f"领取任务失败: {str(e)}")
+                connections.close_all()
+                task = None
+
+            if task is None:
+                if once:
+                    break
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            self.run_task(task)
+        logger.info(f"爬取工作进程退出: {self.worker_id}")
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,645 @@
+"""
+直播间弹幕接入
+通过 websocket 连接B站直播弹幕服务器，解包实时弹幕后沿用视频弹幕的清洗和批量写入流程存入 Danmaku 表，
+同时在内存中维护滚动的每秒弹幕数、关键词和情感窗口，定期把统计快照写入 Django 缓存。
+
+依赖 websockets 库(可选依赖，pip install websockets)；brotli 压缩包需要 brotli 库，默认使用 zlib 压缩协议。
+测试时可以用 manage.py live_replay_server 在本地回放录制的数据帧或生成模拟弹幕。
+"""
+
+import json
+import time
+import zlib
+import struct
+import asyncio
+import hashlib
+import logging
+import collections
+from collections import Counter
+
+import jieba
+from django.core.cache import cache
+
+from . import crawler_config
+from . import ingest
+from . import dedup
+from . import snapshot
+from . import timeline
+from .models import VideoSource
+from .writer import DanmakuWriter
+from .http_client import get_http_client
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 数据包头: 包总长度、头部长度、协议版本、操作码、序号
+HEADER = struct.Struct('>IHHII')
+HEADER_LENGTH = HEADER.size
+
+# 协议版本
+PROTO_JSON = 0
+PROTO_INT = 1
+PROTO_ZLIB = 2
+PROTO_BROTLI = 3
+
+# 操作码
+OP_HEARTBEAT = 2
+OP_HEARTBEAT_REPLY = 3
+OP_MESSAGE = 5
+OP_AUTH = 7
+OP_AUTH_REPLY = 8
+
+# 录制文件中每帧的记录头: 接收时间戳、帧长度
+FRAME_RECORD = struct.Struct('>dI')
+
+# 与 protobuf 弹幕字段同名，可以直接交给 clean_danmaku 和 ingest.build_rows
+LiveDanmaku = collections.namedtuple(
+    'LiveDanmaku', ['dmid', 'text', 'date', 'stime', 'mode', 'size', 'color', 'uhash', 'weight']
+)
+
+
+def require_websockets():
+    if websockets is None:
+        raise RuntimeError("直播弹幕接入需要安装 websockets: pip install websockets")
+
+
+def encode_packet(op, body=b'', protover=PROTO_INT, sequence=1):
+    """打包一个数据包，body 可以是 bytes、str 或可JSON序列化的对象"""
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    return HEADER.pack(HEADER_LENGTH + len(body), HEADER_LENGTH, protover, op, sequence) + body
+
+
+def decode_packets(data):
+    """
+    解包一个 websocket 帧，一帧可能包含多个数据包，压缩包递归解压
+
+    Args:
+        data: 帧数据
+
+    Yields:
+        tuple: (操作码, 正文bytes)
+    """
+    offset = 0
+    while offset + HEADER_LENGTH <= len(data):
+        total, header_length, protover, op, _ = HEADER.unpack_from(data, offset)
+        if total < header_length or offset + total > len(data):
+            logger.warning(f"直播弹幕数据包长度异常: {total}")
+            return
+        body = data[offset + header_length:offset + total]
+        offset += total
+
+        if op == OP_MESSAGE and protover == PROTO_ZLIB:
+            yield from decode_packets(zlib.decompress(body))
+        elif op == OP_MESSAGE and protover == PROTO_BROTLI:
+            if brotli is None:
+                logger.warning("收到 brotli 压缩的弹幕包，但未安装 brotli，已丢弃")
+                continue
+            yield from decode_packets(brotli.decompress(body))
+        else:
+            yield op, body
+
+
+def make_dmid(room_id, timestamp_ms, uhash, text):
+    """由房间号、发送时间、用户和内容生成稳定的弹幕ID，重放同一段录制不会重复入库"""
+    digest = hashlib.blake2b(f"{room_id}:{timestamp_ms}:{uhash}:{text}".encode('utf-8'), digest_size=8).digest()
+    return str(int.from_bytes(digest, 'big') & 0x7fffffffffffffff)
+
+
+def parse_danmu_msg(room_id, message, origin_ms):
+    """
+    解析 DANMU_MSG 消息
+
+    Args:
+        room_id: 房间号
+        message: 消息JSON
+        origin_ms: 直播间弹幕源的起点时间戳(毫秒)，弹幕进度记为相对该时刻的毫秒数，
+            多次启动接入时进度在同一时间轴上连续
+
+    Returns:
+        LiveDanmaku: 弹幕，格式不符时返回None
+    """
+    try:
+        info = message['info']
+        meta, text = info[0], info[1]
+        mode, size, color, timestamp_ms = int(meta[1]), int(meta[2]), int(meta[3]), int(meta[4])
+        uhash = str(meta[7]) if len(meta) > 7 and meta[7] else format(zlib.crc32(str(info[2][0]).encode()), 'x')
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    return LiveDanmaku(
+        dmid=make_dmid(room_id, timestamp_ms, uhash, text),
+        text=text,
+        date=timestamp_ms // 1000,
+        stime=max(timestamp_ms - origin_ms, 0),
+        mode=mode,
+        size=size,
+        color=color,
+        uhash=uhash[:32],
+        weight=10,
+    )
+
+
+class LiveWindow:
+    """直播弹幕的滚动统计窗口，按秒分桶，过期的桶从聚合结果中扣除"""
+
+    def __init__(self, rate_seconds=300, text_seconds=60, top_n=20):
+        """初始化统计窗口
+
+        Args:
+            rate_seconds: 每秒弹幕数保留的秒数
+            text_seconds: 关键词和情感统计的窗口秒数
+            top_n: 快照中返回的关键词数
+        """
+        from danmaku_analysis import analyzer_config
+
+        self.rate_seconds = rate_seconds
+        self.text_seconds = text_seconds
+        self.top_n = top_n
+        self.min_word_length = analyzer_config.KEYWORD_ANALYSIS.get('min_word_length', 2)
+        self.positive_words = analyzer_config.POSITIVE_WORDS
+        self.negative_words = analyzer_config.NEGATIVE_WORDS
+
+        self.total = 0
+        self.rate_buckets = collections.deque()     # [[秒, 弹幕数], ...]
+        self.text_buckets = collections.deque()     # [[秒, 关键词Counter, 情感Counter], ...]
+        self.keywords = Counter()
+        self.sentiment = Counter()
+        self.pending = []                           # 待分词的 [(秒, 内容), ...]
+
+    def _expire(self, now):
+        while self.rate_buckets and self.rate_buckets[0][0] <= now - self.rate_seconds:
+            self.rate_buckets.popleft()
+        while self.text_buckets and self.text_buckets[0][0] <= now - self.text_seconds:
+            _, keywords, sentiment = self.text_buckets.popleft()
+            self.keywords -= keywords
+            self.sentiment -= sentiment
+
+    def classify(self, words):
+        """按情感词典给一条弹幕打分"""
+        score = sum(1 for w in words if w in self.positive_words) - sum(1 for w in words if w in self.negative_words)
+        if score > 0:
+            return 'positive'
+        if score < 0:
+            return 'negative'
+        return 'neutral'
+
+    def add(self, text, second=None):
+        """记录一条弹幕，每秒弹幕数立即更新，文本先放入待分词列表，由 update() 或 segment()/merge() 批量处理
+
+        Args:
+            text: 弹幕内容
+            second: 发送时间(秒)，默认当前时间
+        """
+        second = int(second if second is not None else time.time())
+        self.total += 1
+
+        if not self.rate_buckets or self.rate_buckets[-1][0] < second:
+            self.rate_buckets.append([second, 0])
+        self.rate_buckets[-1][1] += 1
+        self.pending.append((second, text))
+
+        self._expire(second)
+
+    def drain(self):
+        """取出待分词的弹幕 [(秒, 内容), ...]"""
+        pending, self.pending = self.pending, []
+        return pending
+
+    def segment(self, pending):
+        """对一批弹幕分词并判断情感，不修改窗口状态，可以在线程池中执行
+
+        Args:
+            pending: drain() 返回的 [(秒, 内容), ...]
+
+        Returns:
+            list: [(秒, 关键词列表, 情感), ...]
+        """
+        results = []
+        for second, text in pending:
+            words = jieba.lcut(text)
+            label = self.classify(words + [text])
+            results.append((second, [w for w in words if len(w) >= self.min_word_length], label))
+        return results
+
+    def merge(self, results):
+        """把 segment() 的结果计入关键词和情感窗口"""
+        for second, words, label in results:
+            if not self.text_buckets or self.text_buckets[-1][0] < second:
+                self.text_buckets.append([second, Counter(), Counter()])
+            _, keywords, sentiment = self.text_buckets[-1]
+            sentiment[label] += 1
+            self.sentiment[label] += 1
+            keywords.update(words)
+            self.keywords.update(words)
+        if results:
+            self._expire(max(self.rate_buckets[-1][0] if self.rate_buckets else 0, results[-1][0]))
+
+    def update(self):
+        """在当前线程中处理全部待分词的弹幕"""
+        self.merge(self.segment(self.drain()))
+
+    def rate(self, seconds, now):
+        """最近 seconds 秒内的平均每秒弹幕数"""
+        count = sum(c for s, c in self.rate_buckets if s > now - seconds)
+        return round(count / seconds, 2)
+
+    def snapshot(self, now=None):
+        """当前窗口的统计快照"""
+        now = int(now if now is not None else time.time())
+        self._expire(now)
+        positive, negative, neutral = (self.sentiment[k] for k in ('positive', 'negative', 'neutral'))
+        text_total = positive + negative + neutral
+        return {
+            'total': self.total,
+            'rate_1s': self.rate(1, now),
+            'rate_10s': self.rate(10, now),
+            'rate_60s': self.rate(60, now),
+            'per_second': [list(bucket) for bucket in self.rate_buckets],
+            'keywords': self.keywords.most_common(self.top_n),
+            'sentiment': {
+                'positive': positive,
+                'negative': negative,
+                'neutral': neutral,
+                'score': round((positive - negative) / text_total, 4) if text_total else 0.0,
+            },
+            'updated_at': now,
+        }
+
+
+def snapshot_cache_key(room_id):
+    return f"danmaku_crawler:live:{room_id}"
+
+
+def get_live_snapshot(room_id):
+    """读取直播接入进程写入缓存的最新统计快照，没有时返回None"""
+    return cache.get(snapshot_cache_key(room_id))
+
+
+class FrameRecorder:
+    """把收到的原始帧连同接收时间追加写入文件，供 live_replay_server 回放"""
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+
+    def write(self, frame, received_at=None):
+        self.file.write(FRAME_RECORD.pack(received_at or time.time(), len(frame)))
+        self.file.write(frame)
+
+    def close(self):
+        self.file.close()
+
+
+def read_frames(path):
+    """读取录制文件，产出 (接收时间戳, 帧数据)"""
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(FRAME_RECORD.size)
+            if len(head) < FRAME_RECORD.size:
+                return
+            received_at, length = FRAME_RECORD.unpack(head)
+            yield received_at, f.read(length)
+
+
+class LiveRoomClient:
+    """直播间弹幕接入客户端，断线后按指数退避自动重连"""
+
+    def __init__(self, room_id, ws_url=None, record_path=None, config=None):
+        """初始化客户端
+
+        Args:
+            room_id: 直播间号(可以是短号)
+            ws_url: 弹幕服务器地址，默认从 getDanmuInfo 接口获取，失败时使用配置中的地址
+            record_path: 录制原始帧的文件路径
+            config: 直播接入配置，默认读取 crawler_config.LIVE
+        """
+        from .crawler import BilibiliDanmakuCrawler
+
+        require_websockets()
+        self.config = config or crawler_config.LIVE
+        self.room_id = int(room_id)
+        self.ws_url = ws_url
+        self.token = ''
+        self.crawler = BilibiliDanmakuCrawler()
+        self.window = LiveWindow(
+            self.config.get('rate_window', 300), self.config.get('text_window', 60), self.config.get('top_keywords', 20)
+        )
+        self.recorder = FrameRecorder(record_path) if record_path else None
+        self.use_sql_ingest = crawler_config.PIPELINE.get('ingest_method', 'sql') == 'sql'
+        self.source = None
+        self.buffer = []
+        self.tracker = dedup.DuplicateTracker() if crawler_config.DEDUP.get('enabled', True) else None
+        self.origin_ms = None
+        self.stats = {'frames': 0, 'messages': 0, 'danmaku': 0, 'reconnects': 0}
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+
+    def _get_json(self, url, **params):
+        response = get_http_client().get(url, params=params)
+        data = response.json()
+        if data.get('code') != 0:
+            raise ValueError(data.get('message') or data.get('msg'))
+        return data['data']
+
+    def prepare(self):
+        """获取真实房间号、连接地址和令牌，并创建直播间对应的弹幕源(同步调用，需在事件循环之外执行)"""
+        title = f"直播间 {self.room_id}"
+        try:
+            info = self._get_json(self.config['room_info_url'], room_id=self.room_id)
+            self.room_id = int(info.get('room_id') or self.room_id)
+            title = info.get('title') or title
+        except Exception as e:
+            logger.warning(f"获取直播间信息失败，使用原房间号: {str(e)}")
+
+        if not self.ws_url:
+            try:
+                danmu_info = self._get_json(self.config['danmu_info_url'], id=self.room_id, type=0)
+                self.token = danmu_info.get('token', '')
+                hosts = danmu_info.get('host_list') or []
+                if hosts:
+                    self.ws_url = f"wss://{hosts[0]['host']}:{hosts[0]['wss_port']}/sub"
+            except Exception as e:
+                logger.warning(f"获取弹幕服务器信息失败，使用默认地址匿名连接: {str(e)}")
+        self.ws_url = self.ws_url or self.config['ws_url']
+
+        # 直播间弹幕与视频弹幕共用 Danmaku 表，以 live:房间号 作为弹幕源
+        self.source, _ = VideoSource.objects.get_or_create(
+            bvid=f"live:{self.room_id}", defaults={'title': title[:200], 'owner': ''}
+        )
+        # 弹幕进度以弹幕源创建时刻为起点，重启接入进程后仍在同一时间轴上，每秒弹幕数不会与之前的记录错位
+        self.origin_ms = int(self.source.created_at.timestamp() * 1000)
+        # 直播弹幕持续写入，不使用列式快照
+        snapshot.invalidate_snapshot(self.source)
+        timeline.ensure_second_buckets(self.source)
+        return self
+
+    def auth_body(self):
+        return {
+            'uid': 0,
+            'roomid': self.room_id,
+            'protover': PROTO_ZLIB,
+            'platform': 'web',
+            'type': 2,
+            'key': self.token,
+        }
+
+    async def run(self, duration=None):
+        """
+        持续接入直到 stop() 被调用或到达指定时长
+
+        Args:
+            duration: 运行时长(秒)，默认一直运行
+        """
+        if self.source is None:
+            raise RuntimeError("请先调用 prepare()")
+
+        loop = asyncio.get_running_loop()
+        save = self.crawler.save_danmaku_rows if self.use_sql_ingest else self.crawler.save_danmaku_batch
+
+        def write(rows):
+            # 去重统计只计入实际写入的弹幕；计数器在写入线程中更换，见 save_text_stats
+            return save(rows, tracker=self.tracker)
+
+        writer = DanmakuWriter(write, self.config.get('writer_queue_size', 4), name='live-writer').start()
+        deadline = loop.time() + duration if duration else None
+        flusher = asyncio.create_task(self._flush_loop(writer))
+        delay = 1
+        try:
+            while not self._stopping:
+                timeout = deadline - loop.time() if deadline else None
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._session(writer), timeout)
+                    delay = 1
+                except asyncio.TimeoutError:
+                    break
+                except (OSError, websockets.exceptions.WebSocketException) as e:
+                    logger.warning(f"直播间 {self.room_id} 连接断开: {str(e)}，{delay} 秒后重连")
+                if self._stopping:
+                    break
+                self.stats['reconnects'] += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.config.get('reconnect_max_delay', 60))
+        finally:
+            flusher.cancel()
+            try:
+                await self.flush(writer)
+            finally:
+                await loop.run_in_executor(None, self._finish, writer)
+        return self.stats
+
+    def _finish(self, writer):
+        """关闭写入线程和录制文件，写入失败时也更新弹幕数并发布最后的统计快照"""
+        writer_stats = {'rows': 0}
+        try:
+            writer_stats = writer.close()
+        finally:
+            if self.recorder:
+                self.recorder.close()
+            self.crawler.refresh_danmaku_count(self.source)
+            if self.tracker is not None:
+                self.save_text_stats()
+            self.publish()
+            logger.info(f"直播间 {self.room_id} 接入结束: {self.stats}, 写入 {writer_stats['rows']} 条")
+
+    def stop(self):
+        self._stopping = True
+
+    async def _session(self, writer):
+        logger.info(f"连接直播间 {self.room_id} 弹幕服务器: {self.ws_url}")
+        async with websockets.connect(self.ws_url, max_size=None) as ws:
+            await ws.send(encode_packet(OP_AUTH, self.auth_body()))
+            heartbeat = asyncio.create_task(self._heartbeat(ws))
+            try:
+                async for frame in ws:
+                    if isinstance(frame, str):
+                        frame = frame.encode('utf-8')
+                    self.stats['frames'] += 1
+                    if self.recorder:
+                        self.recorder.write(frame)
+                    for op, body in decode_packets(frame):
+                        self.handle(op, body)
+                    if len(self.buffer) >= self.config.get('batch_size', 500):
+                        await self.flush(writer)
+                    if self._stopping:
+                        break
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, ws):
+        while True:
+            await ws.send(encode_packet(OP_HEARTBEAT, '[object Object]'))
+            await asyncio.sleep(self.config.get('heartbeat_interval', 30))
+
+    def handle(self, op, body):
+        """处理一个数据包"""
+        if op == OP_AUTH_REPLY:
+            logger.info(f"直播间 {self.room_id} 认证完成: {body.decode('utf-8', 'ignore')}")
+            return
+        if op != OP_MESSAGE:
+            return
+
+        self.stats['messages'] += 1
+        try:
+            message = json.loads(body)
+        except ValueError:
+            return
+        if not message.get('cmd', '').startswith('DANMU_MSG'):
+            return
+
+        danmaku = parse_danmu_msg(self.room_id, message, self.origin_ms)
+        if danmaku is None:
+            return
+        self.stats['danmaku'] += 1
+        self.buffer.append(danmaku)
+        self.window.add(danmaku.text, danmaku.date)
+
+    async def flush(self, writer):
+        """
+        清洗缓冲区中的弹幕并交给写入线程，写入队列已满时在线程池中等待，不阻塞事件循环；
+        统计窗口中待分词的弹幕也在线程池中批量分词，结果回到事件循环中合并。
+        调用方被取消(到达运行时长、停止接入)时已取出的批次仍会处理完，不会丢失
+        """
+        await asyncio.shield(self._flush(writer))
+
+    async def _flush(self, writer):
+        async with self._flush_lock:
+            loop = asyncio.get_running_loop()
+            pending = self.window.drain()
+            if pending:
+                self.window.merge(await loop.run_in_executor(None, self.window.segment, pending))
+
+            if not self.buffer:
+                return
+            batch, self.buffer = self.buffer, []
+            cleaned = self.crawler.clean_danmaku(batch, 0)
+            if self.use_sql_ingest:
+                rows = ingest.build_rows(cleaned, self.source.id)
+            else:
+                rows = list(self.crawler.build_danmaku_objects(cleaned, self.source))
+            if rows:
+                await loop.run_in_executor(None, writer.submit, rows)
+
+    async def _flush_loop(self, writer):
+        interval = self.config.get('flush_interval', 1.0)
+        text_stats_interval = self.config.get('text_stats_interval', 60)
+        loop = asyncio.get_running_loop()
+        last_text_stats = loop.time()
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush(writer)
+            # 快照在事件循环中生成，避免线程池读取窗口时事件循环同时修改
+            await loop.run_in_executor(None, self.publish, self.window.snapshot())
+            if self.tracker is not None and loop.time() - last_text_stats >= text_stats_interval:
+                last_text_stats = loop.time()
+                # 在写入线程中保存，与弹幕写入和计数串行进行
+                await loop.run_in_executor(None, writer.call, self.save_text_stats)
+
+    def save_text_stats(self):
+        """保存累计的弹幕去重统计，先换上新的计数器；在写入线程中或写入线程结束后调用"""
+        tracker, self.tracker = self.tracker, dedup.DuplicateTracker()
+        if len(tracker):
+            self.crawler.save_text_stats(self.source, tracker)
+
+    def publish(self, snapshot=None):
+        """把统计快照写入 Django 缓存，供其他进程读取，默认使用窗口当前的快照"""
+        self.crawler.cleaner.flush_stats()
+        snapshot = snapshot if snapshot is not None else self.window.snapshot()
+        snapshot['room_id'] = self.room_id
+        try:
+            cache.set(snapshot_cache_key(self.room_id), snapshot, timeout=self.config.get('snapshot_ttl', 60))
+        except Exception as e:
+            logger.warning(f"写入直播统计快照失败: {str(e)}")
+        return snapshot
+
+
+def make_synthetic_frame(room_id, count, protover=PROTO_ZLIB):
+    """生成包含 count 条模拟 DANMU_MSG 的数据帧"""
+    import random
+
+    texts = ['哈哈哈哈', '主播好厉害', '前方高能', '666', '太无聊了', '这波操作真香', '下次一定', 'awsl']
+    now_ms = int(time.time() * 1000)
+    packets = b''.join(
+        encode_packet(OP_MESSAGE, {
+            'cmd': 'DANMU_MSG',
+            'info': [
+                [0, 1, 25, 16777215, now_ms + i, random.getrandbits(31), 0, format(random.getrandbits(32), '08x'), 0],
+                random.choice(texts),
+                [random.randint(1, 10 ** 8), 'user'],
+            ],
+        }, protover=PROTO_JSON)
+        for i in range(count)
+    )
+    if protover == PROTO_ZLIB:
+        return encode_packet(OP_MESSAGE, zlib.compress(packets), protover=PROTO_ZLIB)
+    return packets
+
+
+async def serve_replay(host='127.0.0.1', port=8765, frames_path=None, speed=1.0, synthetic_rate=0, loop_frames=False):
+    """
+    本地替身弹幕服务器：认证后回放录制的数据帧，或按指定速率生成模拟弹幕
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        frames_path: 录制文件路径
+        speed: 回放倍速，0 表示不等待直接发送
+        synthetic_rate: 未指定录制文件时每秒生成的模拟弹幕数
+        loop_frames: 录制文件回放完后是否从头循环
+    """
+    require_websockets()
+
+    async def replay(ws):
+        auth = await ws.recv()
+        # 认证包缺失或不含房间号时模拟弹幕使用房间号 0
+        room_id = 0
+        for op, body in decode_packets(auth if isinstance(auth, bytes) else auth.encode('utf-8')):
+            if op == OP_AUTH:
+                room_id = json.loads(body).get('roomid', 0)
+                await ws.send(encode_packet(OP_AUTH_REPLY, {'code': 0}))
+
+        async def answer_heartbeats():
+            async for message in ws:
+                for op, _ in decode_packets(message if isinstance(message, bytes) else message.encode('utf-8')):
+                    if op == OP_HEARTBEAT:
+                        await ws.send(encode_packet(OP_HEARTBEAT_REPLY, struct.pack('>I', 1)))
+
+        responder = asyncio.create_task(answer_heartbeats())
+        try:
+            if frames_path:
+                while True:
+                    previous = None
+                    for received_at, frame in read_frames(frames_path):
+                        if previous is not None and speed > 0:
+                            await asyncio.sleep(max(received_at - previous, 0) / speed)
+                        previous = received_at
+                        await ws.send(frame)
+                    if not loop_frames:
+                        break
+            else:
+                # 每 0.1 秒发送一帧，合计达到 synthetic_rate 条/秒
+                per_frame = max(1, int(synthetic_rate / 10))
+                while True:
+                    await ws.send(make_synthetic_frame(room_id, per_frame))
+                    await asyncio.sleep(0.1)
+            # 回放结束后保持连接，由客户端决定何时断开
+            await responder
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            responder.cancel()
+
+    async with websockets.serve(replay, host, port, max_size=None):
+        logger.info(f"直播弹幕替身服务器已启动: ws://{host}:{port}")
+        await asyncio.Future()
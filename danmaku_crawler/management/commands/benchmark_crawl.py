@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import resource
+import threading
+import multiprocessing
+import urllib.request
+from django.core.management.base import BaseCommand, CommandError
+
+from danmaku_crawler import crawler_config, mock_api
+from danmaku_crawler.crawler import BilibiliDanmakuCrawler
+from danmaku_crawler.http_client import get_http_client
+from danmaku_crawler.models import VideoSource
+from danmaku_crawler.rate_limiter import TokenBucket
+
+
+class PeakRSSSampler:
+    """后台线程定期采样当前进程的常驻内存，记录爬取期间的峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.baseline = self.current()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def current(self):
+        """当前常驻内存(字节)，无 /proc 时使用进程历史峰值"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, IndexError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+class Command(BaseCommand):
+    help = '启动替身B站接口，端到端压测 crawl_danmaku 在不同弹幕规模下的吞吐、峰值内存和入库耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000], help='每轮爬取的弹幕总数')
+        parser.add_argument('--per-segment', type=int, default=5000, help='每个分段的弹幕数')
+        parser.add_argument('--pages', type=int, default=1, help='每个视频的分P数')
+        parser.add_argument('--latency', type=float, default=0.0, help='替身接口每个请求的延迟(秒)')
+        parser.add_argument('--jitter', type=float, default=0.0, help='叠加的随机延迟上限(秒)')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='替身接口随机返回 412 的比例')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='替身接口随机返回 5xx 的比例')
+        parser.add_argument('--rate', type=float, default=0, help='爬虫请求限速(次/秒)，0 表示不限速')
+        parser.add_argument('--keep', action='store_true', help='压测结束后保留入库的弹幕')
+
+    def start_server(self, videos, options):
+        """在独立进程中启动替身接口，返回 (进程, 接口地址)"""
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        server_options = {
+            'videos': videos,
+            'per_segment': options['per_segment'],
+            'preload': True,
+            'latency': options['latency'],
+            'jitter': options['jitter'],
+            'throttle_rate': options['throttle_rate'],
+            'error_rate': options['error_rate'],
+        }
+        process = context.Process(target=mock_api.run_in_process, args=(server_options, ready), daemon=True)
+        process.start()
+        self.stdout.write("替身接口生成弹幕分段中...")
+        try:
+            url = ready.get(timeout=3600)
+        except Exception:
+            process.terminate()
+            raise CommandError("替身接口启动失败")
+        return process, url
+
+    def server_stats(self, url):
+        with urllib.request.urlopen(f"{url}/__stats", timeout=10) as response:
+            return json.loads(response.read())
+
+    def run_scale(self, bvid, scale, url):
+        crawler = BilibiliDanmakuCrawler()
+
+        # 统计写入线程在数据库上花费的时间
+        db_time = [0.0]
+        save_rows = crawler.save_danmaku_rows
+        save_batch = crawler.save_danmaku_batch
+
+        def timed(save):
+            def wrapper(batch, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return save(batch, *args, **kwargs)
+                finally:
+                    db_time[0] += time.perf_counter() - start
+            return wrapper
+
+        crawler.save_danmaku_rows = timed(save_rows)
+        crawler.save_danmaku_batch = timed(save_batch)
+
+        before = self.server_stats(url)
+        with PeakRSSSampler() as sampler:
+            start = time.perf_counter()
+            task = crawler.crawl_danmaku(bvid, incremental=False)
+            elapsed = time.perf_counter() - start
+        after = self.server_stats(url)
+
+        if task is None:
+            raise CommandError(f"爬取 {bvid} 失败")
+        segments = after['segments'] - before['segments']
+        mb = 1024 * 1024
+        self.stdout.write(
+            f"{scale:>9,} 条: 耗时 {elapsed:.2f}秒, 入库 {task.danmaku_count:,} 条, "
+            f"{segments / elapsed:,.1f} 分段/秒, {task.danmaku_count / elapsed:,.0f} 弹幕/秒, "
+            f"峰值内存 {sampler.peak / mb:,.0f}MB (+{(sampler.peak - sampler.baseline) / mb:,.0f}MB), "
+            f"入库耗时 {db_time[0]:.2f}秒, 412 {after['throttled'] - before['throttled']} 次, "
+            f"5xx {after['errors'] - before['errors']} 次"
+        )
+
+    def handle(self, *args, **options):
+        videos = {
+            mock_api.make_bvid(scale): {'danmaku': scale, 'pages': options['pages']}
+            for scale in options['scales']
+        }
+        process, url = self.start_server(videos, options)
+        self.stdout.write(f"替身B站接口: {url}")
+
+        original_base = crawler_config.HTTP.get('api_base')
+        client = get_http_client()
+        original_limiter = client.rate_limiter
+        crawler_config.HTTP['api_base'] = url
+        client.rate_limiter = TokenBucket(options['rate'])
+        try:
+            for bvid, spec in videos.items():
+                self.run_scale(bvid, spec['danmaku'], url)
+        finally:
+            crawler_config.HTTP['api_base'] = original_base
+            client.rate_limiter = original_limiter
+            process.terminate()
+            process.join()
+            if not options['keep']:
+                # 级联删除弹幕源的弹幕、视频记录和任务
+                VideoSource.objects.filter(bvid__in=list(videos)).delete()
@@ -0,0 +1,83 @@
+import time
+import random
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from danmaku_crawler import danmu_pb2, ingest, mock_api
+from danmaku_crawler.crawler import BilibiliDanmakuCrawler
+from danmaku_crawler.models import VideoSource, Danmaku
+
+
+class Command(BaseCommand):
+    help = '对比 ORM(bulk_create) 与多行 INSERT 两种弹幕入库方式的写入速度(行/秒)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='每种方式写入的弹幕条数')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的弹幕条数')
+
+    def make_danmakus(self, count, dmid_base):
+        """生成测试用的protobuf弹幕"""
+        reply = danmu_pb2.DmSegMobileReply()
+        now = int(time.time())
+        for i in range(count):
+            d = reply.elems.add()
+            d.dmid = str(dmid_base + i)
+            d.stime = random.randint(0, 3600 * 1000)
+            d.mode = 1
+            d.size = 25
+            d.color = random.randint(0, 0xffffff)
+            d.uhash = f"{random.getrandbits(32):08x}"
+            d.text = f"测试弹幕{i}"
+            d.date = now - random.randint(0, 86400 * 30)
+            d.weight = 10
+        return reply.elems
+
+    def make_bvid(self):
+        """生成数据库中尚不存在的临时BV号，压测结束后连同弹幕一起删除"""
+        while True:
+            bvid = mock_api.make_bvid(random.getrandbits(58))
+            if not VideoSource.objects.filter(bvid=bvid).exists():
+                return bvid
+
+    def run_method(self, name, danmakus, source, batch_size):
+        crawler = BilibiliDanmakuCrawler()
+        start = time.perf_counter()
+        build_time = 0.0
+        written = 0
+        for i in range(0, len(danmakus), batch_size):
+            chunk = danmakus[i:i + batch_size]
+            build_start = time.perf_counter()
+            if name == 'orm':
+                batch = list(crawler.build_danmaku_objects(chunk, source, 1, 3600))
+            else:
+                batch = ingest.build_rows(chunk, source.id, 1, 3600)
+            build_time += time.perf_counter() - build_start
+            if name == 'orm':
+                written += crawler.save_danmaku_batch(batch)
+            else:
+                written += ingest.insert_rows(batch, batch_size)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{name:>4}: {written} 条, 总耗时 {elapsed:.2f}秒, 构造 {build_time:.2f}秒, "
+            f"写入 {elapsed - build_time:.2f}秒, {written / elapsed:,.0f} 行/秒"
+        )
+        return elapsed
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        batch_size = options['batch_size']
+        dmid_base = random.randint(10 ** 15, 10 ** 16)
+
+        source = VideoSource.objects.create(
+            bvid=self.make_bvid(), title='入库性能测试', owner='benchmark', duration=3600, last_crawled=timezone.now()
+        )
+        try:
+            results = {}
+            for offset, name in enumerate(['orm', 'sql']):
+                danmakus = self.make_danmakus(rows, dmid_base + offset * rows)
+                results[name] = self.run_method(name, danmakus, source, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"多行 INSERT 相对 ORM 加速 {results['orm'] / results['sql']:.2f} 倍"))
+        finally:
+            Danmaku.objects.filter(source=source).delete()
+            source.delete()
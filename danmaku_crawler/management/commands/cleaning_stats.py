@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from danmaku_crawler.cleaning import get_cleaning_stats, reset_cleaning_stats
+
+
+class Command(BaseCommand):
+    help = '查看各弹幕清洗规则在已入库流量上的过滤条数，用于调整清洗规则'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='输出后清空统计')
+
+    def handle(self, *args, **options):
+        stats = get_cleaning_stats()
+        total = stats['total']
+        self.stdout.write(f"清洗弹幕 {total} 条, 保留 {stats['kept']} 条")
+        for name, count in stats['rules'].items():
+            rate = count / total if total else 0
+            self.stdout.write(f"  {name:<16} 过滤 {count:>10} 条 ({rate:.2%})")
+
+        if options['reset']:
+            reset_cleaning_stats()
+            self.stdout.write(self.style.SUCCESS('已清空清洗统计'))
@@ -0,0 +1,72 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from danmaku_crawler.jobs import submit_crawl_batch, get_batch_progress
+from danmaku_crawler.models import CrawlBatch
+
+
+class Command(BaseCommand):
+    help = '批量提交爬取任务(BV号或视频URL)，或查看批次的执行进度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('videos', nargs='*', help='BV号或视频URL')
+        parser.add_argument('--file', help='从文件读取BV号或URL，每行一个')
+        parser.add_argument('--user', help='以该用户名提交任务')
+        parser.add_argument('--name', default='', help='批次名称')
+        parser.add_argument('--priority', type=int, default=0, help='优先级，数值越大越先执行')
+        parser.add_argument('--full-refresh', action='store_true', help='全量重爬')
+        parser.add_argument('--batch', type=int, help='查看已有批次的进度，不提交新任务')
+        parser.add_argument('--watch', action='store_true', help='持续输出进度直到批次全部结束')
+        parser.add_argument('--interval', type=float, default=5, help='--watch 时的刷新间隔(秒)')
+
+    def handle(self, *args, **options):
+        if options['batch']:
+            try:
+                batch = CrawlBatch.objects.get(id=options['batch'])
+            except CrawlBatch.DoesNotExist:
+                raise CommandError(f"批次不存在: {options['batch']}")
+        else:
+            batch = self.submit(options)
+
+        self.report(batch)
+        if options['watch']:
+            while get_batch_progress(batch)['progress'] < 1:
+                time.sleep(options['interval'])
+                self.report(batch)
+
+    def submit(self, options):
+        videos = list(options['videos'])
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as f:
+                videos.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+        if not videos:
+            raise CommandError('请提供BV号或视频URL，或使用 --file')
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"用户不存在: {options['user']}")
+
+        try:
+            batch, invalid = submit_crawl_batch(
+                videos, user=user, name=options['name'], priority=options['priority'],
+                full_refresh=options['full_refresh']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"已创建批次 {batch.id}"))
+        for item in invalid:
+            self.stdout.write(self.style.WARNING(f"无法提交: {item}"))
+        return batch
+
+    def report(self, batch):
+        p = get_batch_progress(batch)
+        self.stdout.write(
+            f"批次 {batch.id}: {p['completed'] + p['failed']}/{p['total']} ({p['progress']:.0%}) "
+            f"等待 {p['pending']}, 执行中 {p['running']}, 完成 {p['completed']}, 失败 {p['failed']}, "
+            f"新增弹幕 {p['danmaku_count']} 条, {p['videos_per_minute']} 视频/分钟, {p['danmaku_per_second']} 条/秒"
+        )
@@ -0,0 +1,54 @@
+import signal
+import multiprocessing
+from django.core.management.base import BaseCommand
+
+
+def _worker_main(once):
+    """工作进程入口(spawn 方式启动，需要在子进程内重新初始化 Django)"""
+    import django
+    django.setup()
+
+    from danmaku_crawler.jobs import CrawlWorker
+
+    worker = CrawlWorker()
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run(once=once)
+
+
+class Command(BaseCommand):
+    help = '启动爬取任务工作进程，从 CrawlTask 队列中领取并执行爬取任务'
+
+    def add_arguments(self, parser):
+        from danmaku_crawler import crawler_config
+        parser.add_argument(
+            '--processes', type=int, default=crawler_config.JOB_QUEUE.get('processes', 2),
+            help='工作进程数，即同时执行的爬取任务上限'
+        )
+        parser.add_argument('--once', action='store_true', help='队列为空时退出，而不是持续轮询')
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        once = options['once']
+
+        if processes == 1:
+            _worker_main(once)
+            return
+
+        context = multiprocessing.get_context('spawn')
+        workers = [
+            context.Process(target=_worker_main, args=(once,), name=f'crawl-worker-{i}')
+            for i in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        self.stdout.write(f"已启动 {processes} 个爬取工作进程")
+
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            # 子进程收到同一个 SIGINT 后会在当前任务结束时退出
+            self.stdout.write("正在等待工作进程完成当前任务...")
+            for process in workers:
+                process.join()
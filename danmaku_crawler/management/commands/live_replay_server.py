@@ -0,0 +1,28 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+
+from danmaku_crawler.live import serve_replay, websockets
+
+
+class Command(BaseCommand):
+    help = '启动本地替身直播弹幕服务器，回放录制的数据帧或生成模拟弹幕，用于测试 live_worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', help='live_worker --record 录制的帧文件')
+        parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=8765, help='监听端口')
+        parser.add_argument('--speed', type=float, default=1.0, help='回放倍速，0 表示不等待直接发送')
+        parser.add_argument('--loop', action='store_true', help='录制文件回放完后从头循环')
+        parser.add_argument('--synthetic-rate', type=int, default=100, help='未指定 --frames 时每秒生成的模拟弹幕数')
+
+    def handle(self, *args, **options):
+        if websockets is None:
+            raise CommandError("需要安装 websockets: pip install websockets")
+        self.stdout.write(f"替身弹幕服务器: ws://{options['host']}:{options['port']}")
+        try:
+            asyncio.run(serve_replay(
+                options['host'], options['port'], frames_path=options['frames'], speed=options['speed'],
+                synthetic_rate=options['synthetic_rate'], loop_frames=options['loop']
+            ))
+        except KeyboardInterrupt:
+            pass
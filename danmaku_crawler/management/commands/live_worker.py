@@ -0,0 +1,41 @@
+import signal
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+
+from danmaku_crawler.live import LiveRoomClient
+
+
+class Command(BaseCommand):
+    help = '接入直播间实时弹幕，批量写入弹幕表并维护滚动的弹幕数、关键词和情感统计(需安装 websockets)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_id', type=int, help='直播间号')
+        parser.add_argument('--ws-url', help='弹幕服务器地址，如本地替身服务器 ws://127.0.0.1:8765')
+        parser.add_argument('--record', help='把收到的原始帧追加写入该文件，供 live_replay_server 回放')
+        parser.add_argument('--duration', type=float, help='运行时长(秒)，默认一直运行直到 Ctrl+C')
+
+    def handle(self, *args, **options):
+        try:
+            client = LiveRoomClient(options['room_id'], ws_url=options['ws_url'], record_path=options['record'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        client.prepare()
+        self.stdout.write(f"接入直播间 {client.room_id}: {client.ws_url}")
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, client.stop)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            return await client.run(options['duration'])
+
+        stats = asyncio.run(main())
+        snapshot = client.window.snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"接入结束: 收到 {stats['frames']} 帧, {stats['danmaku']} 条弹幕, 重连 {stats['reconnects']} 次, "
+            f"弹幕源共 {client.source.danmaku_count} 条"
+        ))
+        self.stdout.write(f"最近60秒 {snapshot['rate_60s']} 条/秒, 情感得分 {snapshot['sentiment']['score']}")
+        self.stdout.write(f"热门关键词: {', '.join(word for word, _ in snapshot['keywords'][:10])}")
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from danmaku_crawler.mock_api import create_server
+
+
+class Command(BaseCommand):
+    help = '启动本地替身B站接口(view/nav/seg.so)，用生成或归档的弹幕分段测试和压测爬虫'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=8800, help='监听端口')
+        parser.add_argument('--video', action='append', default=[], metavar='BVID:DANMAKU[:PAGES]',
+                            help='生成的视频及其弹幕总数和分P数，可多次指定')
+        parser.add_argument('--default-danmaku', type=int, default=3000, help='未指定视频的弹幕总数')
+        parser.add_argument('--per-segment', type=int, default=3000, help='每个分段的弹幕数')
+        parser.add_argument('--archive', action='store_true', help='从原始分段归档回放，而不是生成弹幕')
+        parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟(秒)')
+        parser.add_argument('--jitter', type=float, default=0.0, help='叠加的随机延迟上限(秒)')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='随机返回 412 的比例')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回 5xx 的比例')
+        parser.add_argument('--max-rps', type=float, default=0, help='每秒最多正常响应的请求数，超出返回 412')
+
+    def parse_videos(self, specs):
+        videos = {}
+        for spec in specs:
+            parts = spec.split(':')
+            try:
+                videos[parts[0]] = {
+                    'danmaku': int(parts[1]),
+                    'pages': int(parts[2]) if len(parts) > 2 else 1,
+                }
+            except (IndexError, ValueError):
+                raise CommandError(f"视频参数格式应为 BVID:DANMAKU[:PAGES]: {spec}")
+        return videos
+
+    def handle(self, *args, **options):
+        archive = None
+        if options['archive']:
+            from danmaku_crawler.archive import get_segment_archive
+            archive = get_segment_archive()
+
+        server = create_server(
+            options['host'], options['port'],
+            videos=self.parse_videos(options['video']),
+            default_danmaku=options['default_danmaku'],
+            per_segment=options['per_segment'],
+            archive=archive,
+            latency=options['latency'],
+            jitter=options['jitter'],
+            throttle_rate=options['throttle_rate'],
+            error_rate=options['error_rate'],
+            max_rps=options['max_rps'],
+        )
+        self.stdout.write(f"替身B站接口: {server.url}")
+        self.stdout.write(f"爬虫进程设置环境变量 BILIBILI_API_BASE={server.url} 后即请求替身接口")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"请求统计: {server.api.stats}")
@@ -0,0 +1,60 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from danmaku_crawler.archive import get_segment_archive
+from danmaku_crawler.crawler import BilibiliDanmakuCrawler
+from danmaku_crawler.models import VideoSource
+
+
+class Command(BaseCommand):
+    help = '从原始分段归档离线重放弹幕解析、清洗和入库，不请求B站接口'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bvids', nargs='*', help='要重放的视频BV号')
+        parser.add_argument('--all', action='store_true', help='重放归档中的全部视频')
+        parser.add_argument(
+            '--full-refresh', action='store_true',
+            help='先删除旧弹幕再重放，使新的清洗规则或表结构对全部弹幕生效；默认只写入尚未入库的弹幕'
+        )
+        parser.add_argument('--before', type=float, help='只使用该时间戳(秒)之前抓取的分段')
+
+    def handle(self, *args, **options):
+        archive = get_segment_archive()
+        bvids = archive.list_videos() if options['all'] else options['bvids']
+        if not bvids:
+            raise CommandError('请指定BV号或使用 --all')
+
+        sources = VideoSource.objects.in_bulk(bvids, field_name='bvid')
+
+        crawler = BilibiliDanmakuCrawler()
+        start = time.perf_counter()
+        total = 0
+        skipped = []
+        for bvid in bvids:
+            source = sources.get(bvid)
+            if source is None:
+                # 数据库中已删除的视频按归档记录重建弹幕源
+                source = crawler.restore_source(bvid, archive)
+                if source is None:
+                    self.stdout.write(self.style.WARNING(f"{bvid}: 数据库和归档中都没有该视频，已跳过"))
+                    skipped.append(bvid)
+                    continue
+                self.stdout.write(f"{bvid}: 按归档记录重建弹幕源")
+            video_start = time.perf_counter()
+            created = crawler.replay_danmaku(
+                source, archive, incremental=not options['full_refresh'], before=options['before']
+            )
+            if created is None:
+                self.stdout.write(self.style.WARNING(f"{source.bvid}: 归档中没有分P信息，已跳过"))
+                skipped.append(source.bvid)
+                continue
+            total += created
+            self.stdout.write(
+                f"{source.bvid}: 写入 {created} 条, "
+                f"共 {source.danmaku_count} 条, 耗时 {time.perf_counter() - video_start:.2f}秒"
+            )
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"重放完成: 共写入 {total} 条弹幕, 耗时 {elapsed:.2f}秒"))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"跳过 {len(skipped)} 个视频: {', '.join(skipped)}"))
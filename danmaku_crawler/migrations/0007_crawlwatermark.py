@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 11:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0006_video_danmaku_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_id', models.IntegerField(default=1, verbose_name='分P编号')),
+                ('cid', models.BigIntegerField(blank=True, null=True, verbose_name='分P cid')),
+                ('max_send_time', models.DateTimeField(blank=True, null=True, verbose_name='最大发送时间')),
+                ('max_dmid', models.BigIntegerField(default=0, verbose_name='最大弹幕ID')),
+                ('danmaku_count', models.IntegerField(default=0, verbose_name='已入库弹幕数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crawl_watermarks', to='danmaku_crawler.video', verbose_name='所属视频')),
+            ],
+            options={
+                'verbose_name': '爬取水位线',
+                'verbose_name_plural': '爬取水位线',
+                'ordering': ['video', 'page_id'],
+                'unique_together': {('video', 'page_id')},
+            },
+        ),
+    ]
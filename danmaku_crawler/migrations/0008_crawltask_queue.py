@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 11:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0007_crawlwatermark'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawltask',
+            name='attempts',
+            field=models.IntegerField(default=0, verbose_name='执行次数'),
+        ),
+        migrations.AddField(
+            model_name='crawltask',
+            name='cookie_str',
+            field=models.TextField(blank=True, default='', verbose_name='爬取Cookie'),
+        ),
+        migrations.AddField(
+            model_name='crawltask',
+            name='full_refresh',
+            field=models.BooleanField(default=False, verbose_name='全量重爬'),
+        ),
+        migrations.AddField(
+            model_name='crawltask',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最近心跳时间'),
+        ),
+        migrations.AddField(
+            model_name='crawltask',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='租约到期时间'),
+        ),
+        migrations.AddField(
+            model_name='crawltask',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='执行进程'),
+        ),
+        migrations.AddIndex(
+            model_name='crawltask',
+            index=models.Index(fields=['status', 'created_at'], name='danmaku_cra_status_0d4019_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 11:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0008_crawltask_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_id', models.IntegerField(verbose_name='分P编号')),
+                ('cid', models.BigIntegerField(blank=True, null=True, verbose_name='分P cid')),
+                ('segment_index', models.IntegerField(verbose_name='分段序号')),
+                ('danmaku_count', models.IntegerField(default=0, verbose_name='入库弹幕数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='记录时间')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='danmaku_crawler.crawltask', verbose_name='所属任务')),
+            ],
+            options={
+                'verbose_name': '爬取检查点',
+                'verbose_name_plural': '爬取检查点',
+                'ordering': ['task', 'page_id', 'segment_index'],
+                'unique_together': {('task', 'page_id', 'segment_index')},
+            },
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.2 on 2026-10-18 11:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_sources(apps, schema_editor):
+    """按BV号合并各用户的视频记录：每个BV号建立一个弹幕源，弹幕和水位线改挂到弹幕源上"""
+    Video = apps.get_model('danmaku_crawler', 'Video')
+    VideoSource = apps.get_model('danmaku_crawler', 'VideoSource')
+    Danmaku = apps.get_model('danmaku_crawler', 'Danmaku')
+    CrawlWatermark = apps.get_model('danmaku_crawler', 'CrawlWatermark')
+
+    bvids = Video.objects.order_by('bvid').values_list('bvid', flat=True).distinct()
+    for bvid in bvids:
+        videos = list(Video.objects.filter(bvid=bvid).order_by('-last_crawled', '-id'))
+        latest = videos[0]
+        video_ids = [video.id for video in videos]
+        source = VideoSource.objects.create(
+            bvid=bvid,
+            aid=latest.aid,
+            title=latest.title,
+            owner=latest.owner,
+            owner_mid=latest.owner_mid,
+            duration=latest.duration,
+            created_at=min(video.created_at for video in videos),
+            last_crawled=latest.last_crawled,
+        )
+        Video.objects.filter(id__in=video_ids).update(source=source)
+        # dmid 全局唯一，同一BV号的弹幕原本只会保存在最先爬取的用户名下
+        Danmaku.objects.filter(video_id__in=video_ids).update(source=source)
+
+        # 每个分P保留最大弹幕ID最大的水位线
+        kept_pages = set()
+        for watermark in CrawlWatermark.objects.filter(video_id__in=video_ids).order_by('page_id', '-max_dmid'):
+            if watermark.page_id in kept_pages:
+                watermark.delete()
+                continue
+            kept_pages.add(watermark.page_id)
+            watermark.source = source
+            watermark.save(update_fields=['source'])
+
+        source.danmaku_count = Danmaku.objects.filter(source=source).count()
+        source.save(update_fields=['danmaku_count'])
+        Video.objects.filter(id__in=video_ids).update(danmaku_count=source.danmaku_count)
+
+
+def restore_videos(apps, schema_editor):
+    """回滚时把弹幕和水位线挂回各BV号最先创建的视频记录"""
+    Video = apps.get_model('danmaku_crawler', 'Video')
+    VideoSource = apps.get_model('danmaku_crawler', 'VideoSource')
+    Danmaku = apps.get_model('danmaku_crawler', 'Danmaku')
+    CrawlWatermark = apps.get_model('danmaku_crawler', 'CrawlWatermark')
+
+    for source in VideoSource.objects.all():
+        video = Video.objects.filter(source=source).order_by('created_at', 'id').first()
+        if video is None:
+            Danmaku.objects.filter(source=source).delete()
+            CrawlWatermark.objects.filter(source=source).delete()
+            continue
+        Danmaku.objects.filter(source=source).update(video=video)
+        CrawlWatermark.objects.filter(source=source).update(video=video)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0009_crawlcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bvid', models.CharField(max_length=20, unique=True, verbose_name='BV号')),
+                ('aid', models.BigIntegerField(blank=True, null=True, verbose_name='AV号')),
+                ('title', models.CharField(max_length=200, verbose_name='视频标题')),
+                ('owner', models.CharField(max_length=100, verbose_name='UP主')),
+                ('owner_mid', models.BigIntegerField(blank=True, null=True, verbose_name='UP主ID')),
+                ('duration', models.IntegerField(default=0, verbose_name='视频时长(秒)')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='创建时间')),
+                ('last_crawled', models.DateTimeField(blank=True, null=True, verbose_name='上次爬取时间')),
+                ('danmaku_count', models.IntegerField(default=0, verbose_name='弹幕数')),
+            ],
+            options={
+                'verbose_name': '视频弹幕源',
+                'verbose_name_plural': '视频弹幕源',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='crawlwatermark',
+            name='source',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='crawl_watermarks', to='danmaku_crawler.videosource', verbose_name='弹幕源'),
+        ),
+        migrations.AddField(
+            model_name='danmaku',
+            name='source',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='danmakus', to='danmaku_crawler.videosource', verbose_name='弹幕源'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='source',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='videos', to='danmaku_crawler.videosource', verbose_name='弹幕源'),
+        ),
+        migrations.RunPython(create_sources, restore_videos),
+    ]
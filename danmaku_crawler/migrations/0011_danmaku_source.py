@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-18 11:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0010_videosource'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='crawlwatermark',
+            options={'ordering': ['source', 'page_id'], 'verbose_name': '爬取水位线', 'verbose_name_plural': '爬取水位线'},
+        ),
+        migrations.RemoveIndex(
+            model_name='danmaku',
+            name='danmaku_cra_video_i_ae1814_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='crawlwatermark',
+            unique_together={('source', 'page_id')},
+        ),
+        migrations.RemoveField(
+            model_name='danmaku',
+            name='video',
+        ),
+        migrations.AlterField(
+            model_name='crawlwatermark',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crawl_watermarks', to='danmaku_crawler.videosource', verbose_name='弹幕源'),
+        ),
+        migrations.AlterField(
+            model_name='danmaku',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='danmakus', to='danmaku_crawler.videosource', verbose_name='弹幕源'),
+        ),
+        migrations.AddIndex(
+            model_name='danmaku',
+            index=models.Index(fields=['source', 'progress'], name='danmaku_cra_source__1e182f_idx'),
+        ),
+        migrations.RemoveField(
+            model_name='crawlwatermark',
+            name='video',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 11:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0011_danmaku_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawltask',
+            name='leader',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='followers', to='danmaku_crawler.crawltask', verbose_name='合并到的任务'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 11:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0012_crawltask_leader'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawltask',
+            name='priority',
+            field=models.IntegerField(default=0, verbose_name='优先级'),
+        ),
+        migrations.CreateModel(
+            name='CrawlBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, default='', max_length=200, verbose_name='批次名称')),
+                ('priority', models.IntegerField(default=0, verbose_name='优先级')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='crawl_batches', to=settings.AUTH_USER_MODEL, verbose_name='提交用户')),
+            ],
+            options={
+                'verbose_name': '批量爬取',
+                'verbose_name_plural': '批量爬取',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='crawltask',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tasks', to='danmaku_crawler.crawlbatch', verbose_name='所属批次'),
+        ),
+        migrations.AddIndex(
+            model_name='crawltask',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='danmaku_cra_status_5eeb36_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0013_crawlbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videosource',
+            name='text_cluster_count',
+            field=models.IntegerField(default=0, verbose_name='近似重复簇数'),
+        ),
+        migrations.AddField(
+            model_name='videosource',
+            name='unique_text_count',
+            field=models.IntegerField(default=0, verbose_name='规范化后不同文本数'),
+        ),
+        migrations.CreateModel(
+            name='DanmakuText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.BigIntegerField(verbose_name='规范化文本哈希')),
+                ('canonical', models.CharField(max_length=255, verbose_name='规范化文本')),
+                ('text', models.CharField(max_length=255, verbose_name='代表文本')),
+                ('count', models.IntegerField(default=0, verbose_name='出现次数')),
+                ('cluster_hash', models.BigIntegerField(default=0, verbose_name='近似重复簇')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='texts', to='danmaku_crawler.videosource', verbose_name='弹幕源')),
+            ],
+            options={
+                'verbose_name': '弹幕文本统计',
+                'verbose_name_plural': '弹幕文本统计',
+                'ordering': ['-count'],
+                'indexes': [models.Index(fields=['source', 'cluster_hash'], name='danmaku_cra_source__168cf5_idx')],
+                'unique_together': {('source', 'text_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0014_danmakutext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videosource',
+            name='second_buckets_ready',
+            field=models.BooleanField(default=False, verbose_name='每秒弹幕数已建立'),
+        ),
+        migrations.CreateModel(
+            name='DanmakuSecondBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_id', models.IntegerField(verbose_name='分P编号')),
+                ('second', models.IntegerField(verbose_name='分P内秒数')),
+                ('count', models.IntegerField(default=0, verbose_name='弹幕数')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='second_buckets', to='danmaku_crawler.videosource', verbose_name='弹幕源')),
+            ],
+            options={
+                'verbose_name': '每秒弹幕数',
+                'verbose_name_plural': '每秒弹幕数',
+                'ordering': ['page_id', 'second'],
+                'unique_together': {('source', 'page_id', 'second')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0015_danmakusecondbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videosource',
+            name='text_bands_ready',
+            field=models.BooleanField(default=False, verbose_name='文本分桶键已建立'),
+        ),
+        # 已有的弹幕源需要整体聚类一次，之后新建的弹幕源从空开始增量聚类
+        migrations.AlterField(
+            model_name='videosource',
+            name='text_bands_ready',
+            field=models.BooleanField(default=True, verbose_name='文本分桶键已建立'),
+        ),
+        migrations.CreateModel(
+            name='DanmakuTextBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.IntegerField(verbose_name='分带')),
+                ('key', models.BigIntegerField(verbose_name='分桶键')),
+                ('text_hash', models.BigIntegerField(verbose_name='规范化文本哈希')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='text_bands', to='danmaku_crawler.videosource', verbose_name='弹幕源')),
+            ],
+            options={
+                'verbose_name': '文本分桶键',
+                'verbose_name_plural': '文本分桶键',
+                'indexes': [models.Index(fields=['source', 'band', 'key'], name='danmaku_cra_source__8ea11e_idx')],
+                'unique_together': {('source', 'band', 'text_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('danmaku_crawler', '0016_danmakutextband'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleaningRuleStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='规则名')),
+                ('count', models.BigIntegerField(default=0, verbose_name='条数')),
+            ],
+            options={
+                'verbose_name': '清洗统计',
+                'verbose_name_plural': '清洗统计',
+                'ordering': ['name'],
+            },
+        ),
+    ]
@@ -0,0 +1,354 @@
+"""
+B站接口替身服务器
+在本地提供 /x/web-interface/view、/x/web-interface/nav 和 /x/v2/dm/web/seg.so 三个接口，
+弹幕分段按参数生成 protobuf 数据，或从原始分段归档回放真实抓取到的分段；
+可以配置响应延迟、限流(412)和错误注入(5xx)，不访问B站即可测试和压测爬虫。
+
+爬虫通过 crawler_config.HTTP['api_base'](环境变量 BILIBILI_API_BASE)指向替身服务器，
+manage.py mock_bilibili_api 单独启动服务器，manage.py benchmark_crawl 在此基础上做端到端压测。
+"""
+
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import danmu_pb2
+from .crawler_config import SEGMENT_DURATION
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# nav 接口返回的 WBI 密钥，替身服务器不校验签名
+WBI_IMG_URL = 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png'
+WBI_SUB_URL = 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png'
+
+SAMPLE_TEXTS = [
+    '哈哈哈哈哈', '前方高能', '666', '泪目', '这也太好看了吧', 'awsl', '下次一定', '名场面',
+    '打卡', '233333', '好家伙', '爷青回', '这个BGM是什么', '来了来了', '？？？', '太真实了',
+]
+
+BV_ALPHABET = 'FcwAPNKTMug3GV5Lj7EJnHpWsx4tb8haYeviqBz6rkCy12mUSDQX9RdoZf'
+
+
+def make_bvid(number):
+    """由整数生成格式合法的BV号(不对应真实视频)"""
+    chars = []
+    for _ in range(10):
+        number, index = divmod(number, len(BV_ALPHABET))
+        chars.append(BV_ALPHABET[index])
+    return 'BV' + ''.join(chars)
+
+
+class GeneratedFixtures:
+    """按参数生成的视频信息和弹幕分段"""
+
+    def __init__(self, videos=None, default_danmaku=3000, default_pages=1, per_segment=3000, seed=0):
+        """初始化
+
+        Args:
+            videos: {bvid: {'danmaku': 弹幕总数, 'pages': 分P数}}，未列出的BV号按默认参数生成
+            default_danmaku: 未列出的视频的弹幕总数
+            default_pages: 未列出的视频的分P数
+            per_segment: 每个6分钟分段的弹幕数，决定分P时长
+            seed: 随机种子
+        """
+        self.videos = dict(videos or {})
+        self.default_danmaku = default_danmaku
+        self.default_pages = default_pages
+        self.per_segment = per_segment
+        self.seed = seed
+        self._infos = {}
+        self._cids = {}
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def video_info(self, bvid):
+        """view 接口的 data 字段"""
+        with self._lock:
+            info = self._infos.get(bvid)
+            if info is not None:
+                return info
+
+            spec = self.videos.get(bvid, {})
+            total = spec.get('danmaku', self.default_danmaku)
+            page_count = max(1, spec.get('pages', self.default_pages))
+            # aid 由BV号确定，dmid 以 aid 为前缀，不同视频的弹幕ID不会冲突(且不超出 int64)
+            aid = int(hashlib.md5(f"{self.seed}:{bvid}".encode()).hexdigest()[:6], 16) + 1
+            pages = []
+            remaining = total
+            for p in range(page_count):
+                page_total = remaining // (page_count - p)
+                remaining -= page_total
+                segment_count = max(1, math.ceil(page_total / self.per_segment))
+                cid = aid * 1000 + p + 1
+                pages.append({'cid': cid, 'page': p + 1, 'part': f"P{p + 1}", 'duration': segment_count * SEGMENT_DURATION})
+                self._cids[cid] = (aid, p, page_total, segment_count)
+            info = {
+                'bvid': bvid,
+                'aid': aid,
+                'title': f"替身视频 {bvid}",
+                'owner': {'name': 'mock', 'mid': 1},
+                'duration': sum(page['duration'] for page in pages),
+                'pages': pages,
+            }
+            self._infos[bvid] = info
+            return info
+
+    def segment(self, cid, segment_index):
+        """seg.so 响应内容，分段不存在时返回空响应"""
+        key = (cid, segment_index)
+        with self._lock:
+            payload = self._segments.get(key)
+            spec = self._cids.get(cid)
+        if payload is not None:
+            return payload
+        if spec is None:
+            return b''
+
+        aid, page, page_total, segment_count = spec
+        if segment_index < 1 or segment_index > segment_count:
+            return b''
+        start = (segment_index - 1) * page_total // segment_count
+        end = segment_index * page_total // segment_count
+        payload = self.generate(aid, page, segment_index, start, end)
+        with self._lock:
+            self._segments[key] = payload
+        return payload
+
+    def generate(self, aid, page, segment_index, start, end):
+        rng = random.Random(f"{self.seed}:{aid}:{page}:{segment_index}")
+        reply = danmu_pb2.DmSegMobileReply()
+        base_stime = (segment_index - 1) * SEGMENT_DURATION * 1000
+        base_dmid = (aid * 1000 + page) * 10 ** 8
+        base_date = 1700000000 + aid % 10 ** 6
+        for i in range(start, end):
+            reply.elems.add(
+                stime=base_stime + rng.randrange(SEGMENT_DURATION * 1000),
+                mode=1,
+                size=25,
+                color=16777215 if rng.random() < 0.8 else rng.getrandbits(24),
+                uhash=format(rng.getrandbits(32), '08x'),
+                text=rng.choice(SAMPLE_TEXTS),
+                date=base_date + i,
+                weight=rng.randint(1, 11),
+                dmid=str(base_dmid + i),
+            )
+        return reply.SerializeToString()
+
+    def preload(self, bvids):
+        """预先生成视频的全部分段，压测时生成开销不计入响应时间"""
+        for bvid in bvids:
+            for page in self.video_info(bvid)['pages']:
+                _, _, _, segment_count = self._cids[page['cid']]
+                for segment_index in range(1, segment_count + 1):
+                    self.segment(page['cid'], segment_index)
+
+
+class ArchiveFixtures:
+    """从原始分段归档回放真实抓取到的视频信息和分段"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def video_info(self, bvid):
+        parts = self.archive.load_parts(bvid)
+        if not parts:
+            return None
+        pages = [
+            {'cid': part['cid'], 'page': i, 'part': f"P{i}", 'duration': part.get('duration') or 0}
+            for i, part in enumerate(parts, start=1)
+        ]
+        return {
+            'bvid': bvid,
+            'aid': 0,
+            'title': f"归档视频 {bvid}",
+            'owner': {'name': 'archive', 'mid': 0},
+            'duration': sum(page['duration'] for page in pages),
+            'pages': pages,
+        }
+
+    def segment(self, cid, segment_index):
+        with self._lock:
+            entries = self._entries.get(cid)
+            if entries is None:
+                entries = {entry['segment']: entry for entry in self.archive.latest_entries(cid)}
+                self._entries[cid] = entries
+        entry = entries.get(segment_index)
+        return self.archive.read_segment(entry) if entry else b''
+
+
+class MockBilibiliAPI:
+    """替身接口的请求处理，与 HTTP 服务器解耦，便于直接调用"""
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, throttle_rate=0.0, error_rate=0.0, max_rps=0, seed=0):
+        """初始化
+
+        Args:
+            fixtures: GeneratedFixtures 或 ArchiveFixtures
+            latency: 每个请求的固定延迟(秒)
+            jitter: 在固定延迟上叠加的随机延迟上限(秒)
+            throttle_rate: 随机返回 412 的比例
+            error_rate: 随机返回 500/503 的比例
+            max_rps: 每秒最多正常响应的请求数，超出时返回 412，0 表示不限制
+            seed: 错误注入的随机种子
+        """
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.limiter = TokenBucket(max_rps) if max_rps > 0 else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'segments': 0, 'danmaku_bytes': 0, 'throttled': 0, 'errors': 0, 'not_found': 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _json(self, data, status=200):
+        return status, 'application/json', json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def handle(self, path, params):
+        """
+        处理一个 GET 请求
+
+        Args:
+            path: 请求路径
+            params: 查询参数 {名称: 值}
+
+        Returns:
+            tuple: (状态码, Content-Type, 响应内容)
+        """
+        if path == '/__stats':
+            with self._lock:
+                return self._json(dict(self.stats))
+
+        self._count('requests')
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate or (self.limiter and not self.limiter.acquire(timeout=0)):
+            self._count('throttled')
+            return self._json({'code': -412, 'message': '请求被拦截'}, 412)
+        if roll < self.throttle_rate + self.error_rate:
+            self._count('errors')
+            return 503 if roll < self.throttle_rate + self.error_rate / 2 else 500, 'text/plain', b'error'
+
+        if path == '/x/web-interface/nav':
+            return self._json({'code': 0, 'data': {'wbi_img': {'img_url': WBI_IMG_URL, 'sub_url': WBI_SUB_URL}}})
+
+        if path == '/x/web-interface/view':
+            info = self.fixtures.video_info(params.get('bvid', ''))
+            if info is None:
+                self._count('not_found')
+                return self._json({'code': -404, 'message': '啥都木有'})
+            return self._json({'code': 0, 'message': '0', 'data': info})
+
+        if path == '/x/v2/dm/web/seg.so':
+            try:
+                cid, segment_index = int(params['oid']), int(params['segment_index'])
+            except (KeyError, ValueError):
+                return self._json({'code': -400, 'message': '请求错误'}, 400)
+            payload = self.fixtures.segment(cid, segment_index)
+            self._count('segments')
+            self._count('danmaku_bytes', len(payload))
+            return 200, 'application/octet-stream', payload
+
+        self._count('not_found')
+        return self._json({'code': -404, 'message': '啥都木有'}, 404)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        status, content_type, body = self.server.api.handle(parsed.path, params)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class MockBilibiliServer(ThreadingHTTPServer):
+    """替身接口的 HTTP 服务器，每个连接一个线程，支持 keep-alive"""
+
+    daemon_threads = True
+
+    def __init__(self, api, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.api = api
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中运行，返回服务器自身"""
+        thread = threading.Thread(target=self.serve_forever, name='mock-bilibili-api', daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def create_server(host='127.0.0.1', port=0, videos=None, default_danmaku=3000, default_pages=1,
+                  per_segment=3000, archive=None, preload=False, **api_options):
+    """
+    按参数创建替身服务器(未启动)
+
+    Args:
+        host: 监听地址
+        port: 监听端口，0 表示随机端口
+        videos: {bvid: {'danmaku': 弹幕总数, 'pages': 分P数}}
+        default_danmaku: 未列出的视频的弹幕总数
+        default_pages: 未列出的视频的分P数
+        per_segment: 每个分段的弹幕数
+        archive: SegmentArchive，指定时从归档回放，忽略生成参数
+        preload: 启动前预先生成 videos 中全部视频的分段
+        **api_options: MockBilibiliAPI 的延迟、限流和错误注入参数
+
+    Returns:
+        MockBilibiliServer: 替身服务器
+    """
+    if archive is not None:
+        fixtures = ArchiveFixtures(archive)
+    else:
+        fixtures = GeneratedFixtures(videos, default_danmaku, default_pages, per_segment)
+        if preload and videos:
+            fixtures.preload(videos)
+    return MockBilibiliServer(MockBilibiliAPI(fixtures, **api_options), host, port)
+
+
+def run_in_process(options, ready):
+    """
+    子进程入口：创建并运行替身服务器，监听地址放入 ready 队列
+
+    压测时服务器运行在独立进程中，生成和发送数据的开销不计入爬虫进程的 CPU 和内存。
+    """
+    server = create_server(**options)
+    ready.put(server.url)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
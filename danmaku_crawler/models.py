@@ -2,6 +2,33 @@ from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+class VideoSource(models.Model):
+    """视频弹幕的共享存储，每个BV号一条记录；弹幕和爬取水位线只保存一份，各用户的 Video 记录引用同一份数据"""
+    bvid = models.CharField(max_length=20, unique=True, verbose_name="BV号")
+    aid = models.BigIntegerField(null=True, blank=True, verbose_name="AV号")
+    title = models.CharField(max_length=200, verbose_name="视频标题")
+    owner = models.CharField(max_length=100, verbose_name="UP主")
+    owner_mid = models.BigIntegerField(null=True, blank=True, verbose_name="UP主ID")
+    duration = models.IntegerField(default=0, verbose_name="视频时长(秒)")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="创建时间")
+    last_crawled = models.DateTimeField(null=True, blank=True, verbose_name="上次爬取时间")
+    danmaku_count = models.IntegerField(default=0, verbose_name="弹幕数")
+    unique_text_count = models.IntegerField(default=0, verbose_name="规范化后不同文本数")
+    text_cluster_count = models.IntegerField(default=0, verbose_name="近似重复簇数")
+    # 为True时 DanmakuSecondBucket 与弹幕表一致，入库时增量维护；旧数据首次入库或分析时按弹幕表重建
+    second_buckets_ready = models.BooleanField(default=False, verbose_name="每秒弹幕数已建立")
+    # 为True时 DanmakuTextBand 保存了参与聚类文本的 LSH 分桶键，入库时只对新文本聚类；
+    # 功能上线前已有的弹幕源为False，下次入库时整体重新聚类一次
+    text_bands_ready = models.BooleanField(default=True, verbose_name="文本分桶键已建立")
+    
+    class Meta:
+        verbose_name = "视频弹幕源"
+        verbose_name_plural = "视频弹幕源"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.title} ({self.bvid})"
+
 class Video(models.Model):
     """视频信息模型"""
     bvid = models.CharField(max_length=20, verbose_name="BV号")
@@ -14,6 +41,7 @@ class Video(models.Model):
     last_crawled = models.DateTimeField(null=True, blank=True, verbose_name="上次爬取时间")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='videos', null=True, blank=True, verbose_name="爬取用户")
     danmaku_count = models.IntegerField(default=0, verbose_name="爬取弹幕数")
+    source = models.ForeignKey(VideoSource, on_delete=models.SET_NULL, related_name='videos', null=True, blank=True, verbose_name="弹幕源")
     
     class Meta:
         verbose_name = "视频信息"
@@ -24,10 +52,15 @@ class Video(models.Model):
     
     def __str__(self):
         return f"{self.title} ({self.bvid})"
+    
+    @property
+    def danmakus(self):
+        """视频的弹幕，保存在共享的弹幕源上"""
+        return Danmaku.objects.filter(source_id=self.source_id)
 
 class Danmaku(models.Model):
     """弹幕数据模型"""
-    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='danmakus', verbose_name="所属视频")
+    source = models.ForeignKey(VideoSource, on_delete=models.CASCADE, related_name='danmakus', verbose_name="弹幕源")
     page_id = models.IntegerField(default=1, verbose_name="分P编号")
     page_duration = models.IntegerField(default=0, verbose_name="分P时长(秒)")
     dmid = models.BigIntegerField(unique=True, verbose_name="弹幕ID")
@@ -46,7 +79,7 @@ class Danmaku(models.Model):
         verbose_name_plural = "弹幕数据"
         ordering = ['progress']
         indexes = [
-            models.Index(fields=['video', 'progress']),
+            models.Index(fields=['source', 'progress']),
             models.Index(fields=['send_time']),
             models.Index(fields=['page_id']),
         ]
@@ -54,6 +87,90 @@ class Danmaku(models.Model):
     def __str__(self):
         return f"{self.content[:20]}... ({self.progress}s)"
 
+class DanmakuText(models.Model):
+    """弹幕源中规范化后相同的弹幕文本及其出现次数，入库时累计，分析时可按去重文本加权计算"""
+    source = models.ForeignKey(VideoSource, on_delete=models.CASCADE, related_name='texts', verbose_name="弹幕源")
+    text_hash = models.BigIntegerField(verbose_name="规范化文本哈希")
+    canonical = models.CharField(max_length=255, verbose_name="规范化文本")
+    text = models.CharField(max_length=255, verbose_name="代表文本")
+    count = models.IntegerField(default=0, verbose_name="出现次数")
+    # 近似重复簇中出现次数最多的文本的 text_hash
+    cluster_hash = models.BigIntegerField(default=0, verbose_name="近似重复簇")
+    
+    class Meta:
+        verbose_name = "弹幕文本统计"
+        verbose_name_plural = "弹幕文本统计"
+        ordering = ['-count']
+        unique_together = ('source', 'text_hash')
+        indexes = [
+            models.Index(fields=['source', 'cluster_hash']),
+        ]
+    
+    def __str__(self):
+        return f"{self.text[:20]} x{self.count}"
+
+class DanmakuTextBand(models.Model):
+    """参与近似重复聚类的文本在每个 LSH 分带中的分桶键，新文本按分桶键查找可能相似的已有文本"""
+    source = models.ForeignKey(VideoSource, on_delete=models.CASCADE, related_name='text_bands', verbose_name="弹幕源")
+    band = models.IntegerField(verbose_name="分带")
+    key = models.BigIntegerField(verbose_name="分桶键")
+    text_hash = models.BigIntegerField(verbose_name="规范化文本哈希")
+    
+    class Meta:
+        verbose_name = "文本分桶键"
+        verbose_name_plural = "文本分桶键"
+        unique_together = ('source', 'band', 'text_hash')
+        indexes = [
+            models.Index(fields=['source', 'band', 'key']),
+        ]
+    
+    def __str__(self):
+        return f"{self.source_id} band{self.band} {self.key}"
+
+class DanmakuSecondBucket(models.Model):
+    """弹幕源每个分P每秒的弹幕数，与弹幕在同一事务中增量维护，时间线直接读取"""
+    source = models.ForeignKey(VideoSource, on_delete=models.CASCADE, related_name='second_buckets', verbose_name="弹幕源")
+    page_id = models.IntegerField(verbose_name="分P编号")
+    second = models.IntegerField(verbose_name="分P内秒数")
+    count = models.IntegerField(default=0, verbose_name="弹幕数")
+    
+    class Meta:
+        verbose_name = "每秒弹幕数"
+        verbose_name_plural = "每秒弹幕数"
+        ordering = ['page_id', 'second']
+        unique_together = ('source', 'page_id', 'second')
+    
+    def __str__(self):
+        return f"{self.source_id} P{self.page_id} {self.second}s x{self.count}"
+
+class CleaningRuleStat(models.Model):
+    """各清洗规则在已入库流量上的累计过滤条数，各进程入库结束时原子累加；total、kept 为清洗总数和保留数"""
+    name = models.CharField(max_length=100, unique=True, verbose_name="规则名")
+    count = models.BigIntegerField(default=0, verbose_name="条数")
+    
+    class Meta:
+        verbose_name = "清洗统计"
+        verbose_name_plural = "清洗统计"
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} x{self.count}"
+
+class CrawlBatch(models.Model):
+    """批量爬取任务，一次提交的多个视频作为一个批次跟踪进度"""
+    name = models.CharField(max_length=200, blank=True, default='', verbose_name="批次名称")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='crawl_batches', null=True, blank=True, verbose_name="提交用户")
+    priority = models.IntegerField(default=0, verbose_name="优先级")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    
+    class Meta:
+        verbose_name = "批量爬取"
+        verbose_name_plural = "批量爬取"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"批次 {self.id} {self.name}"
+
 class CrawlTask(models.Model):
     """爬取任务模型"""
     STATUS_CHOICES = (
@@ -71,11 +188,63 @@ class CrawlTask(models.Model):
     danmaku_count = models.IntegerField(default=0, verbose_name="爬取弹幕数")
     error_message = models.TextField(blank=True, verbose_name="错误信息")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='crawl_tasks', null=True, blank=True, verbose_name="执行用户")
+    # 任务队列字段：任务由 crawl_worker 进程领取执行，领取后需定期心跳续租
+    cookie_str = models.TextField(blank=True, default='', verbose_name="爬取Cookie")
+    full_refresh = models.BooleanField(default=False, verbose_name="全量重爬")
+    worker_id = models.CharField(max_length=100, blank=True, default='', verbose_name="执行进程")
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name="租约到期时间")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="最近心跳时间")
+    attempts = models.IntegerField(default=0, verbose_name="执行次数")
+    # 同一视频已有任务在执行时，新任务合并到该任务上等待其结果，不重复爬取
+    leader = models.ForeignKey('self', on_delete=models.SET_NULL, related_name='followers', null=True, blank=True, verbose_name="合并到的任务")
+    batch = models.ForeignKey(CrawlBatch, on_delete=models.SET_NULL, related_name='tasks', null=True, blank=True, verbose_name="所属批次")
+    priority = models.IntegerField(default=0, verbose_name="优先级")
     
     class Meta:
         verbose_name = "爬取任务"
         verbose_name_plural = "爬取任务"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'priority', 'created_at']),
+        ]
     
     def __str__(self):
         return f"任务 {self.id} - {self.video.title} ({self.status})"
+
+class CrawlWatermark(models.Model):
+    """分P爬取水位线模型，记录已入库弹幕的最大发送时间和最大弹幕ID，用于增量爬取"""
+    source = models.ForeignKey(VideoSource, on_delete=models.CASCADE, related_name='crawl_watermarks', verbose_name="弹幕源")
+    page_id = models.IntegerField(default=1, verbose_name="分P编号")
+    cid = models.BigIntegerField(null=True, blank=True, verbose_name="分P cid")
+    max_send_time = models.DateTimeField(null=True, blank=True, verbose_name="最大发送时间")
+    max_dmid = models.BigIntegerField(default=0, verbose_name="最大弹幕ID")
+    danmaku_count = models.IntegerField(default=0, verbose_name="已入库弹幕数")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    
+    class Meta:
+        verbose_name = "爬取水位线"
+        verbose_name_plural = "爬取水位线"
+        ordering = ['source', 'page_id']
+        unique_together = ('source', 'page_id')
+    
+    def __str__(self):
+        return f"{self.source.title} P{self.page_id} (dmid <= {self.max_dmid})"
+
+class CrawlCheckpoint(models.Model):
+    """分段爬取检查点，记录任务中已入库的分段，任务重试或恢复时跳过这些分段"""
+    task = models.ForeignKey(CrawlTask, on_delete=models.CASCADE, related_name='checkpoints', verbose_name="所属任务")
+    page_id = models.IntegerField(verbose_name="分P编号")
+    cid = models.BigIntegerField(null=True, blank=True, verbose_name="分P cid")
+    segment_index = models.IntegerField(verbose_name="分段序号")
+    danmaku_count = models.IntegerField(default=0, verbose_name="入库弹幕数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="记录时间")
+    
+    class Meta:
+        verbose_name = "爬取检查点"
+        verbose_name_plural = "爬取检查点"
+        ordering = ['task', 'page_id', 'segment_index']
+        unique_together = ('task', 'page_id', 'segment_index')
+    
+    def __str__(self):
+        return f"任务 {self.task_id} P{self.page_id} 第{self.segment_index}段"
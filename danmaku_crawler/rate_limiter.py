@@ -0,0 +1,65 @@
+"""
+令牌桶限速器
+用于控制爬虫对B站接口的整体请求速率
+"""
+
+import time
+import threading
+
+
+class TokenBucket:
+    """线程安全的令牌桶限速器
+
+    以 rate 个/秒 的速度补充令牌，桶内最多保存 capacity 个令牌。
+    每次请求前调用 acquire() 取走令牌，令牌不足时阻塞等待。
+    """
+
+    def __init__(self, rate, capacity=None):
+        """初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数，<=0 表示不限速
+            capacity: 桶容量(允许的突发请求数)，默认与 rate 相同
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """按流逝的时间补充令牌"""
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last_refill = now
+
+    def acquire(self, tokens=1, timeout=None):
+        """获取令牌
+
+        Args:
+            tokens: 需要的令牌数
+            timeout: 最长等待时间(秒)，None 表示一直等待
+
+        Returns:
+            bool: 是否成功获取令牌
+        """
+        if self.rate <= 0:
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait_time = (tokens - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            time.sleep(wait_time)
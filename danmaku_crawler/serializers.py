@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Video, Danmaku, CrawlTask
+from .models import Video, Danmaku, CrawlTask, CrawlBatch
+from .jobs import get_batch_progress
 
 class VideoSerializer(serializers.ModelSerializer):
     """视频信息序列化器"""
@@ -23,7 +24,18 @@ class CrawlTaskSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CrawlTask
-        fields = ['id', 'video', 'video_title', 'video_detail', 'status', 'created_at', 'started_at', 'completed_at', 'danmaku_count', 'error_message']
+        fields = ['id', 'video', 'video_title', 'video_detail', 'status', 'created_at', 'started_at', 'completed_at', 'danmaku_count', 'error_message', 'leader', 'batch', 'priority']
     
     def get_video_title(self, obj):
         return obj.video.title 
+
+class CrawlBatchSerializer(serializers.ModelSerializer):
+    """批量爬取序列化器"""
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = CrawlBatch
+        fields = ['id', 'name', 'priority', 'created_at', 'progress']
+    
+    def get_progress(self, obj):
+        return get_batch_progress(obj)
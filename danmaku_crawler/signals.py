@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# 某个分P的弹幕入库完成后发送
+# 参数: source(VideoSource弹幕源), page_id(分P编号), created_count(本次新增弹幕数), watermark(CrawlWatermark对象)
+danmaku_ingested = Signal()
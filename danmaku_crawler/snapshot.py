@@ -0,0 +1,403 @@
+"""
+按弹幕源保存的列式弹幕快照
+爬取完成后把弹幕源的全部弹幕按列写成一组 .npy 文件(进度、分P、发送时间、用户编号、模式、颜色、
+文本字节和偏移)，分析时以内存映射方式打开，同一视频的重复分析不必再全表扫描和构造 ORM 对象。
+
+快照目录中的 meta.json 记录写入时弹幕源的弹幕数和爬取时间，二者与数据库不一致时视为失效；
+爬虫开始写入新弹幕前会直接删除旧快照。
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+import itertools
+import collections
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import crawler_config
+from .models import Danmaku
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# 快照保存的数据库字段，也是 build_snapshot 默认接收的行元组顺序
+SNAPSHOT_FIELDS = ('dmid', 'page_id', 'page_duration', 'progress', 'content', 'send_time', 'user_hash', 'mode', 'color')
+
+# 数值列及其类型
+NUMERIC_COLUMNS = {
+    'dmid': np.int64,
+    'page_id': np.int32,
+    'page_duration': np.int32,
+    'progress': np.float64,
+    'send_time': 'datetime64[s]',
+    'user_id': np.int32,
+    'mode': np.int8,
+    'color': np.uint32,
+}
+
+DEFAULT_COLOR = 16777215
+
+# 逐条遍历快照时每次构造的记录数
+RECORD_BATCH_SIZE = 10000
+
+# 逐条访问时产出的记录，字段与 Danmaku 模型同名，分析代码可以原样读取属性
+SnapshotDanmaku = collections.namedtuple(
+    'SnapshotDanmaku', ['dmid', 'page_id', 'progress', 'content', 'send_time', 'user_hash', 'mode', 'color']
+)
+
+
+def parse_colors(colors):
+    """将数据库中的颜色字符串('#rrggbb' 或十进制整数)批量转换为整数，无法解析时记为白色"""
+    values, inverse = np.unique(np.asarray(colors, dtype=object).astype(str), return_inverse=True)
+    parsed = []
+    for value in values.tolist():
+        try:
+            parsed.append(int(value[1:], 16) if value.startswith('#') else int(value))
+        except ValueError:
+            parsed.append(DEFAULT_COLOR)
+    return np.asarray(parsed, dtype=np.uint32)[inverse.ravel()]
+
+
+class DanmakuSnapshot:
+    """
+    一个弹幕源的列式弹幕，数值列为(可能是内存映射的) NumPy 数组
+
+    文本以 UTF-8 字节加偏移存放，用户哈希去重后以编号引用，颜色为整数；
+    分析代码可以直接按列计算，也可以按下标或遍历取得逐条记录。
+    """
+
+    def __init__(self, columns, text_data, text_offsets, users, meta, count=None):
+        """初始化
+
+        Args:
+            columns: {列名: 数组}，列见 NUMERIC_COLUMNS，未读取的列为 None
+            text_data: 全部弹幕文本的 UTF-8 字节(uint8 数组)
+            text_offsets: 每条弹幕文本在 text_data 中的起止偏移，长度为弹幕数+1
+            users: 用户哈希表(字节串数组)，user_id 列是其下标
+            meta: 快照元数据
+            count: 弹幕数，默认取 meta['count']
+        """
+        for name in NUMERIC_COLUMNS:
+            setattr(self, name, columns.get(name))
+        self.text_data = text_data
+        self.text_offsets = text_offsets
+        self.users = users
+        self.meta = meta
+        self.count = meta.get('count', 0) if count is None else count
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def page_info(self):
+        """分P信息 [{'page_id': 分P编号, 'duration': 时长}]，与分析器原来的聚合查询结果格式相同"""
+        return [dict(page) for page in self.meta.get('pages', [])]
+
+    def __getitem__(self, index):
+        """按下标读取一条弹幕记录"""
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("弹幕下标超出范围")
+        text = None
+        if self.text_data is not None:
+            start, end = self.text_offsets[index:index + 2].tolist()
+            text = self.text_data[start:end].tobytes().decode('utf-8', 'replace')
+        color = self.color[index].item() if self.color is not None else None
+        return SnapshotDanmaku(
+            self.dmid[index].item() if self.dmid is not None else None,
+            self.page_id[index].item() if self.page_id is not None else None,
+            self.progress[index].item() if self.progress is not None else None,
+            text,
+            self.send_time[index].item() if self.send_time is not None else None,
+            self.users[self.user_id[index]].decode('utf-8', 'replace') if self.users is not None else None,
+            self.mode[index].item() if self.mode is not None else None,
+            f"#{color:06x}" if color is not None else None,
+        )
+
+    def __iter__(self):
+        """逐条产出弹幕记录，每次只构造一批，不在内存中保留全部记录"""
+        for start in range(0, self.count, RECORD_BATCH_SIZE):
+            yield from self.records(start, start + RECORD_BATCH_SIZE)
+
+    def texts(self, start=0, stop=None):
+        """解码 [start, stop) 范围内的弹幕文本"""
+        offsets = self.text_offsets[start:(self.count if stop is None else stop) + 1].tolist()
+        if not offsets:
+            return []
+        data = self.text_data[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        return [data[a - base:b - base].decode('utf-8', 'replace') for a, b in zip(offsets, offsets[1:])]
+
+    def user_table(self):
+        """解码后的用户哈希表，下标即 user_id"""
+        return [user.decode('utf-8', 'replace') for user in self.users.tolist()]
+
+    def user_hashes(self, start=0, stop=None):
+        """[start, stop) 范围内每条弹幕的用户哈希"""
+        users = self.users[self.user_id[start:stop]].tolist()
+        return [user.decode('utf-8', 'replace') for user in users]
+
+    def records(self, start=0, stop=None):
+        """
+        转换为逐条记录列表，供按属性读取弹幕的代码使用，未读取的字段为 None
+
+        Args:
+            start: 起始下标
+            stop: 结束下标(不含)，默认到末尾
+
+        Returns:
+            list: SnapshotDanmaku 列表
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        size = max(stop - start, 0)
+
+        def column(values, convert):
+            return convert() if values is not None else itertools.repeat(None, size)
+
+        return list(map(SnapshotDanmaku._make, zip(
+            column(self.dmid, lambda: self.dmid[start:stop].tolist()),
+            column(self.page_id, lambda: self.page_id[start:stop].tolist()),
+            column(self.progress, lambda: self.progress[start:stop].tolist()),
+            column(self.text_data, lambda: self.texts(start, stop)),
+            column(self.send_time, lambda: self.send_time[start:stop].astype(object).tolist()),
+            column(self.users, lambda: self.user_hashes(start, stop)),
+            column(self.mode, lambda: self.mode[start:stop].tolist()),
+            column(self.color, lambda: (f"#{color:06x}" for color in self.color[start:stop].tolist())),
+        )))
+
+
+def get_snapshot_root():
+    return crawler_config.SNAPSHOT.get('root') or os.path.join(settings.BASE_DIR, 'danmaku_snapshots')
+
+
+def snapshot_path(source_id):
+    return os.path.join(get_snapshot_root(), str(source_id))
+
+
+def snapshot_meta(source):
+    """快照有效性依据：弹幕源当前的弹幕数和最近爬取时间"""
+    return {
+        'danmaku_count': source.danmaku_count,
+        'last_crawled': source.last_crawled.isoformat() if source.last_crawled else None,
+    }
+
+
+def iter_snapshot_rows(source, fields=SNAPSHOT_FIELDS, chunk_size=None):
+    """按进度顺序流式读取弹幕源的弹幕，产出 fields 顺序的行元组"""
+    chunk_size = chunk_size or crawler_config.SNAPSHOT.get('chunk_size', 20000)
+    return (
+        Danmaku.objects.filter(source_id=source.id).order_by('progress', 'id')
+        .values_list(*fields).iterator(chunk_size=chunk_size)
+    )
+
+
+def _convert_send_time(values):
+    if values and values[0].tzinfo is not None:
+        # USE_TZ=True 时数据库返回 UTC 时间，按 UTC 存为 naive 时间
+        values = [t.replace(tzinfo=None) for t in values]
+    return np.asarray(values, dtype='datetime64[s]')
+
+
+# 可直接按类型转换的数值列
+_SIMPLE_COLUMNS = ('dmid', 'page_id', 'page_duration', 'progress', 'mode')
+
+
+def build_snapshot(rows, fields=SNAPSHOT_FIELDS, chunk_size=20000, meta=None):
+    """
+    把行元组流转换为内存中的列式弹幕，每 chunk_size 行转换一次，不保留全部行元组
+
+    Args:
+        rows: fields 顺序的行元组可迭代对象
+        fields: 行元组包含的字段，须为 SNAPSHOT_FIELDS 的子集；未包含的列为 None
+        chunk_size: 每次转换的行数
+        meta: 快照元数据，分P信息由本次读取的数据计算后写入
+
+    Returns:
+        DanmakuSnapshot: 列式弹幕
+    """
+    unknown = set(fields) - set(SNAPSHOT_FIELDS)
+    if unknown:
+        raise ValueError(f"快照不支持的字段: {sorted(unknown)}")
+    positions = {name: i for i, name in enumerate(fields)}
+    column_names = [name for name in NUMERIC_COLUMNS if name in positions
+                    or (name == 'user_id' and 'user_hash' in positions)]
+    chunks = {name: [] for name in column_names}
+    text_chunks = []
+    lengths = []
+    user_ids = {}
+    page_durations = {}
+    count = 0
+
+    def convert(batch):
+        values = dict(zip(fields, zip(*batch)))
+        for name in _SIMPLE_COLUMNS:
+            if name in values:
+                chunks[name].append(np.asarray(values[name], dtype=NUMERIC_COLUMNS[name]))
+        if 'send_time' in values:
+            chunks['send_time'].append(_convert_send_time(values['send_time']))
+        if 'color' in values:
+            chunks['color'].append(parse_colors(values['color']))
+        if 'user_hash' in values:
+            chunks['user_id'].append(np.fromiter(
+                (user_ids.setdefault(u, len(user_ids)) for u in values['user_hash']), dtype=np.int32, count=len(batch)
+            ))
+        if 'content' in values:
+            encoded = [text.encode('utf-8') for text in values['content']]
+            text_chunks.append(b''.join(encoded))
+            lengths.append(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+        if 'page_id' in values and 'page_duration' in values:
+            for page, duration in zip(values['page_id'], values['page_duration']):
+                if duration > page_durations.get(page, -1):
+                    page_durations[page] = duration
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            convert(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        convert(batch)
+        count += len(batch)
+
+    columns = {
+        name: (np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=dtype)) if name in chunks else None
+        for name, dtype in NUMERIC_COLUMNS.items()
+    }
+    text_data = text_offsets = users = None
+    if 'content' in positions:
+        text_data = np.frombuffer(b''.join(text_chunks), dtype=np.uint8)
+        text_offsets = np.zeros(count + 1, dtype=np.int64)
+        if lengths:
+            np.cumsum(np.concatenate(lengths), out=text_offsets[1:])
+    if 'user_hash' in positions:
+        users = np.array([user.encode('utf-8') for user in user_ids], dtype=bytes)
+    meta = dict(meta or {}, count=count)
+    meta['pages'] = [{'page_id': page, 'duration': page_durations[page]} for page in sorted(page_durations)]
+    return DanmakuSnapshot(columns, text_data, text_offsets, users, meta, count)
+
+
+def save_snapshot(source, danmaku_snapshot):
+    """
+    把内存中的全字段列式弹幕保存为弹幕源的快照，先写临时目录再替换，读取方不会看到写了一半的快照
+
+    Args:
+        source: 视频弹幕源
+        danmaku_snapshot: build_snapshot 以 SNAPSHOT_FIELDS 全部字段构造的列式弹幕
+
+    Returns:
+        int: 快照中的弹幕数
+    """
+    path = snapshot_path(source.id)
+    if not len(danmaku_snapshot):
+        invalidate_snapshot(source)
+        return 0
+
+    arrays = {name: getattr(danmaku_snapshot, name) for name in NUMERIC_COLUMNS}
+    arrays.update(text_data=danmaku_snapshot.text_data, text_offsets=danmaku_snapshot.text_offsets,
+                  users=danmaku_snapshot.users)
+    missing = [name for name, array in arrays.items() if array is None]
+    if missing:
+        raise ValueError(f"列式弹幕缺少快照所需的列: {missing}")
+
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array, allow_pickle=False)
+        meta = dict(snapshot_meta(source), version=SNAPSHOT_VERSION, count=len(danmaku_snapshot),
+                    pages=danmaku_snapshot.meta['pages'], created_at=timezone.now().isoformat())
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        # 目录不能原子覆盖，先把旧快照移开再换上新快照
+        old_path = f"{tmp_path}.old"
+        if os.path.isdir(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    logger.info(f"弹幕源 {source.bvid} 的列式快照已写入: {meta['count']} 条弹幕")
+    return meta['count']
+
+
+def write_snapshot(source, rows=None):
+    """
+    从数据库(或给定的行元组)读取弹幕源的全部弹幕并写入快照
+
+    Args:
+        source: 视频弹幕源
+        rows: SNAPSHOT_FIELDS 顺序的行元组，默认从数据库流式读取
+
+    Returns:
+        int: 快照中的弹幕数
+    """
+    if rows is None:
+        rows = iter_snapshot_rows(source)
+    danmaku_snapshot = build_snapshot(rows, chunk_size=crawler_config.SNAPSHOT.get('chunk_size', 20000))
+    return save_snapshot(source, danmaku_snapshot)
+
+
+def _load_array(path, mmap):
+    if mmap:
+        try:
+            return np.load(path, mmap_mode='r', allow_pickle=False)
+        except ValueError:
+            # 空数组无法内存映射(如全部弹幕文本为空)
+            pass
+    return np.load(path, allow_pickle=False)
+
+
+def load_snapshot(source, mmap=True):
+    """
+    读取弹幕源的列式快照
+
+    Args:
+        source: 视频弹幕源
+        mmap: 是否以内存映射方式打开数组
+
+    Returns:
+        DanmakuSnapshot: 快照，不存在、版本不符或已失效时返回None
+    """
+    path = snapshot_path(source.id)
+    try:
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    expected = snapshot_meta(source)
+    if meta.get('version') != SNAPSHOT_VERSION or any(meta.get(k) != v for k, v in expected.items()):
+        logger.info(f"弹幕源 {source.bvid} 的列式快照已失效")
+        return None
+
+    try:
+        arrays = {
+            name: _load_array(os.path.join(path, f"{name}.npy"), mmap)
+            for name in list(NUMERIC_COLUMNS) + ['text_data', 'text_offsets', 'users']
+        }
+    except (OSError, ValueError) as e:
+        # 读取过程中快照被替换或删除
+        logger.warning(f"读取弹幕源 {source.bvid} 的列式快照失败: {str(e)}")
+        return None
+    text_data = arrays.pop('text_data')
+    text_offsets = arrays.pop('text_offsets')
+    users = arrays.pop('users')
+    return DanmakuSnapshot(arrays, text_data, text_offsets, users, meta)
+
+
+def invalidate_snapshot(source):
+    """删除弹幕源的快照，弹幕即将变化时调用"""
+    path = snapshot_path(source.id)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
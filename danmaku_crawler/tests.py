@@ -1,3 +1,1418 @@
-from django.test import TestCase
+"""
+弹幕爬虫的行为测试，爬取测试使用本地替身接口(mock_api)，不访问B站
 
-# Create your tests here.
+运行: python manage.py test danmaku_crawler --settings=danmaku_system.test_settings
+"""
+
+import os
+import json
+import math
+import socket
+import asyncio
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from io import StringIO
+from datetime import timedelta
+from unittest import mock, skipIf
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import F, Min, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from . import columnar, crawler_config, danmu_pb2, dedup, http_client, ingest, live, mock_api, rate_limiter, snapshot, timeline, wbisign
+from .archive import SegmentArchive, zstandard
+from .cleaning import CleaningEngine, get_cleaning_stats, reset_cleaning_stats
+from .crawler import BilibiliDanmakuCrawler, SegmentFetchError, get_segment_pool
+from .http_client import BilibiliHttpClient, CircuitBreaker, get_http_client
+from .jobs import (
+    CrawlWorker, enqueue_crawl_task, can_full_refresh, complete_followers, resume_crawl_task,
+    submit_crawl_batch, get_batch_progress,
+)
+from .models import VideoSource, Video, Danmaku, DanmakuSecondBucket, DanmakuText, CrawlTask, CrawlWatermark
+from .rate_limiter import TokenBucket
+
+
+def make_segment(elems):
+    """按字段字典列表构造 seg.so 响应"""
+    reply = danmu_pb2.DmSegMobileReply()
+    for fields in elems:
+        reply.elems.add(**fields)
+    return reply.SerializeToString()
+
+
+def make_columns(count, start_dmid=1, texts=None, page_seconds=600):
+    """构造 count 条列式弹幕，dmid 连续，进度均匀分布在分P内"""
+    texts = texts or ['前方高能', '哈哈哈哈', 'awsl', '这是什么神仙操作', '666']
+    elems = [
+        {
+            'dmid': str(start_dmid + i),
+            'text': texts[i % len(texts)],
+            'stime': i * 997 % (page_seconds * 1000),
+            'date': 1700000000 + i,
+            'uhash': f"u{i % 13}",
+            'mode': 1,
+            'size': 25,
+            'color': 16777215,
+        }
+        for i in range(count)
+    ]
+    return columnar.decode_segment(make_segment(elems))
+
+
+class FakeClock:
+    """代替 time 模块的时钟，sleep 只推进时间不阻塞"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def bucket_counts(source):
+    """DanmakuSecondBucket 中的 {(分P, 秒): 弹幕数}"""
+    return {
+        (page_id, second): count
+        for page_id, second, count in DanmakuSecondBucket.objects.filter(source=source)
+        .values_list('page_id', 'second', 'count')
+    }
+
+
+def row_counts(source):
+    """按弹幕表统计的 {(分P, 秒): 弹幕数}"""
+    counts = defaultdict(int)
+    for page_id, progress in Danmaku.objects.filter(source=source).values_list('page_id', 'progress'):
+        counts[(page_id, progress // 1000)] += 1
+    return dict(counts)
+
+
+class MockAPITestMixin:
+    """启动替身接口并把爬虫指向它；重试和退避缩短，关闭归档、快照和共享弹幕复用，测试结束后恢复"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = mock_api.create_server(default_danmaku=2400, default_pages=2, per_segment=400).start()
+        cls.addClassCleanup(cls.server.stop)
+        client = get_http_client()
+        for patcher in (
+            mock.patch.dict(crawler_config.HTTP, api_base=cls.server.url),
+            mock.patch.dict(crawler_config.ARCHIVE, enabled=False),
+            mock.patch.dict(crawler_config.SNAPSHOT, enabled=False),
+            mock.patch.dict(crawler_config.SHARED_STORAGE, fresh_seconds=0),
+            mock.patch.object(client, 'max_retries', 1),
+            mock.patch.object(client, 'backoff_base', 0.01),
+            mock.patch.object(client, 'rate_limiter', TokenBucket(0)),
+        ):
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.handle = self.server.api.handle
+        self.addCleanup(setattr, self.server.api, 'handle', self.handle)
+        self.crawler = BilibiliDanmakuCrawler()
+
+    def fail_segments(self, indexes):
+        """让指定编号的分段一直返回 503，返回可修改的编号集合"""
+        failing = set(indexes)
+
+        def handle(path, params):
+            if path.endswith('seg.so') and int(params.get('segment_index', 0)) in failing:
+                return 503, 'text/plain', b'error'
+            return self.handle(path, params)
+
+        self.server.api.handle = handle
+        return failing
+
+    def count_segment_requests(self):
+        """统计之后发出的 seg.so 请求，返回 {分段编号: 请求次数}"""
+        counts = defaultdict(int)
+        handle = self.server.api.handle
+
+        def counting(path, params):
+            if path.endswith('seg.so'):
+                counts[int(params.get('segment_index', 0))] += 1
+            return handle(path, params)
+
+        self.server.api.handle = counting
+        return counts
+
+    def video_info(self, bvid):
+        return self.server.api.fixtures.video_info(bvid)
+
+
+class TokenBucketTestCase(SimpleTestCase):
+    """令牌桶：突发容量、按速率补充和等待超时"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limiter, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited_never_waits(self):
+        bucket = TokenBucket(0)
+        self.assertTrue(all(bucket.acquire() for _ in range(1000)))
+        self.assertEqual(self.clock.now, 0)
+
+    def test_burst_then_refill_rate(self):
+        bucket = TokenBucket(2, capacity=3)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.now, 0)
+
+        # 突发容量用完后每个令牌等待 1/rate 秒
+        for _ in range(4):
+            bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 2.0)
+
+    def test_acquire_times_out(self):
+        bucket = TokenBucket(1)
+        bucket.acquire()
+        self.assertFalse(bucket.acquire(timeout=0.2))
+        self.assertAlmostEqual(self.clock.now, 0.2)
+
+
+class SegmentPoolTestCase(MockAPITestMixin, TestCase):
+    """分段请求使用进程内共享的线程池并发执行"""
+
+    def test_crawlers_share_one_pool(self):
+        self.assertIs(self.crawler.segment_pool, get_segment_pool())
+        self.assertIs(BilibiliDanmakuCrawler().segment_pool, self.crawler.segment_pool)
+
+    def test_segments_are_fetched_concurrently_in_page_order(self):
+        info = self.video_info(mock_api.make_bvid(1))
+        page = info['pages'][0]
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def handle(path, params):
+            if path.endswith('seg.so'):
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active)
+                time.sleep(0.05)
+                with lock:
+                    active[0] -= 1
+            return self.handle(path, params)
+
+        self.server.api.handle = handle
+        danmakus = self.crawler.get_all_danmaku(page['cid'], info['aid'], duration=page['duration'])
+
+        self.assertGreater(active[1], 1)
+        expected = columnar.DanmakuColumns.concat(
+            self.crawler.get_danmaku_pb(page['cid'], info['aid'], page=p) for p in (1, 2, 3)
+        )
+        self.assertEqual(len(danmakus), 1200)
+        self.assertEqual(list(danmakus.dmid), list(expected.dmid))
+
+
+class SegmentFetchTestCase(MockAPITestMixin, TestCase):
+    """按时长规划分段，区分请求失败与空分段，重试只在HTTP客户端中进行"""
+
+    def setUp(self):
+        super().setUp()
+        info = self.video_info(mock_api.make_bvid(201))
+        self.aid = info['aid']
+        self.page = info['pages'][0]
+        self.cid = self.page['cid']
+
+    def test_plan_segments_from_duration(self):
+        self.assertEqual(self.crawler.plan_segments(0), 0)
+        self.assertEqual(self.crawler.plan_segments(None), 0)
+        self.assertEqual(self.crawler.plan_segments(1), 1)
+        self.assertEqual(self.crawler.plan_segments(crawler_config.SEGMENT_DURATION), 1)
+        self.assertEqual(self.crawler.plan_segments(crawler_config.SEGMENT_DURATION + 1), 2)
+
+    def test_known_duration_is_not_probed_past_last_segment(self):
+        requests = self.count_segment_requests()
+        danmakus = self.crawler.get_all_danmaku(self.cid, self.aid, duration=self.page['duration'])
+
+        self.assertEqual(len(danmakus), 1200)
+        self.assertEqual(dict(requests), {1: 1, 2: 1, 3: 1})
+
+    def test_unknown_duration_probes_until_empty_segment(self):
+        requests = self.count_segment_requests()
+        danmakus = self.crawler.get_all_danmaku(self.cid, self.aid)
+
+        self.assertEqual(len(danmakus), 1200)
+        self.assertEqual(dict(requests), {1: 1, 2: 1, 3: 1, 4: 1})
+
+    def test_empty_segment_returns_no_rows(self):
+        danmakus = self.crawler.get_danmaku_pb(self.cid, self.aid, page=99)
+        self.assertEqual(len(danmakus), 0)
+
+    def test_failed_segment_raises_after_client_retries_only(self):
+        self.fail_segments({1})
+        requests = self.count_segment_requests()
+        with self.assertRaises(SegmentFetchError) as context:
+            self.crawler.get_danmaku_pb(self.cid, self.aid, page=1)
+
+        self.assertIn('HTTP 503', str(context.exception))
+        self.assertEqual(context.exception.page, 1)
+        # 只有HTTP客户端按 max_retries 重试，爬虫不再叠加一层重试
+        self.assertEqual(requests[1], get_http_client().max_retries + 1)
+
+    def test_rejected_signature_is_retried_once_with_fresh_keys(self):
+        rejected = []
+
+        def handle(path, params):
+            if path.endswith('seg.so') and not rejected:
+                rejected.append(params)
+                return 200, 'application/json', b'{"code": -352}'
+            return self.handle(path, params)
+
+        self.server.api.handle = handle
+        with mock.patch.object(wbisign.wbi_key_manager, 'invalidate', wraps=wbisign.wbi_key_manager.invalidate) as invalidate:
+            danmakus = self.crawler.get_danmaku_pb(self.cid, self.aid, page=1)
+
+        self.assertEqual(len(danmakus), 400)
+        invalidate.assert_called_once_with()
+
+
+class CrawlTestCase(MockAPITestMixin, TransactionTestCase):
+    """完整爬取流程：增量爬取、全量重爬和水位线"""
+
+    def crawl(self, bvid, **kwargs):
+        task = self.crawler.crawl_danmaku(bvid, **kwargs)
+        task.refresh_from_db()
+        return task
+
+    def dmids(self, source):
+        return set(Danmaku.objects.filter(source=source).values_list('dmid', flat=True))
+
+    def test_crawl_writes_rows_and_second_buckets(self):
+        bvid = mock_api.make_bvid(101)
+        task = self.crawl(bvid)
+
+        self.assertEqual(task.status, 'completed')
+        source = VideoSource.objects.get(bvid=bvid)
+        count = Danmaku.objects.filter(source=source).count()
+        self.assertGreater(count, 0)
+        self.assertEqual(task.danmaku_count, count)
+        # 每秒弹幕数与弹幕表逐秒一致，合计等于弹幕数
+        self.assertEqual(bucket_counts(source), row_counts(source))
+        self.assertEqual(DanmakuSecondBucket.objects.filter(source=source).aggregate(total=Sum('count'))['total'], count)
+
+    def test_incremental_recrawl_adds_no_rows(self):
+        bvid = mock_api.make_bvid(102)
+        self.crawl(bvid)
+        source = VideoSource.objects.get(bvid=bvid)
+        before = self.dmids(source)
+        requests = self.count_segment_requests()
+
+        task = self.crawl(bvid, incremental=True)
+
+        self.assertEqual(task.status, 'completed')
+        self.assertEqual(sum(requests.values()), 6)
+        self.assertEqual(task.danmaku_count, 0)
+        self.assertEqual(self.dmids(source), before)
+        watermarks = CrawlWatermark.objects.filter(source=source)
+        self.assertEqual(sum(w.danmaku_count for w in watermarks), len(before))
+        self.assertEqual({w.page_id for w in watermarks}, {1, 2})
+
+    def test_incremental_recrawl_adds_only_new_danmaku(self):
+        bvid = mock_api.make_bvid(103)
+
+        def handle(path, params):
+            # 第一次爬取时最后一个分段还没有弹幕
+            if path.endswith('seg.so') and params.get('segment_index') == '3':
+                return 200, 'application/octet-stream', b''
+            return self.handle(path, params)
+
+        self.server.api.handle = handle
+        self.crawl(bvid)
+        source = VideoSource.objects.get(bvid=bvid)
+        first = self.dmids(source)
+
+        self.server.api.handle = self.handle
+        task = self.crawl(bvid, incremental=True)
+
+        added = self.dmids(source)
+        self.assertGreater(task.danmaku_count, 0)
+        self.assertEqual(len(added), len(first) + task.danmaku_count)
+        source.refresh_from_db()
+        self.assertEqual(source.danmaku_count, len(added))
+        # 与一次完整的全量重爬结果相同
+        self.crawl(bvid, incremental=False)
+        self.assertEqual(self.dmids(source), added)
+
+    def test_full_refresh_reloads_all_rows(self):
+        bvid = mock_api.make_bvid(104)
+        self.crawl(bvid)
+        source = VideoSource.objects.get(bvid=bvid)
+        before = self.dmids(source)
+
+        task = self.crawl(bvid, incremental=False)
+
+        source.refresh_from_db()
+        self.assertEqual(task.danmaku_count, len(before))
+        self.assertEqual(source.danmaku_count, len(before))
+        self.assertEqual(self.dmids(source), before)
+
+    def test_failed_segment_fails_task_and_resume_completes(self):
+        bvid = mock_api.make_bvid(107)
+        failing = self.fail_segments({2})
+        source = self.crawler.get_or_create_source(bvid)
+        video = self.crawler.get_or_create_video(source)
+        task = enqueue_crawl_task(video, full_refresh=True)
+        worker = CrawlWorker(worker_id='test-worker')
+        worker.run_task(worker.claim_task())
+        task.refresh_from_db()
+
+        self.assertEqual(task.status, 'failed')
+        self.assertIn('第 2 页', task.error_message)
+        # 只有成功获取的分段记录检查点，失败的分段没有被当作空分段
+        checkpoints = set(task.checkpoints.values_list('page_id', 'segment_index'))
+        self.assertTrue(checkpoints)
+        self.assertFalse({(page_id, 2) for page_id in (1, 2)} & checkpoints)
+        segment_ms = crawler_config.SEGMENT_DURATION * 1000
+        for page_id, segment_index, count in task.checkpoints.values_list('page_id', 'segment_index', 'danmaku_count'):
+            written = Danmaku.objects.filter(source=source, page_id=page_id, progress__gte=(segment_index - 1) * segment_ms,
+                                             progress__lt=segment_index * segment_ms).count()
+            self.assertEqual(written, count)
+
+        failing.clear()
+        requests = self.count_segment_requests()
+        task = self.crawl(bvid, existing_task=task, incremental=False)
+        self.assertEqual(task.status, 'completed')
+        # 恢复时只重新抓取没有检查点的分段
+        self.assertEqual(sum(requests.values()), 6 - len(checkpoints))
+        self.assertFalse(task.checkpoints.exists())
+        resumed = self.dmids(source)
+        self.assertEqual(task.danmaku_count, len(resumed))
+
+        # 恢复后的弹幕与一次完整的全量重爬相同
+        self.crawl(bvid, incremental=False)
+        self.assertEqual(self.dmids(source), resumed)
+
+    def test_reingested_duplicates_are_counted_once(self):
+        for offset, method in enumerate(('sql', 'orm')):
+            with self.subTest(ingest_method=method), mock.patch.dict(crawler_config.PIPELINE, ingest_method=method):
+                source = VideoSource.objects.create(bvid=mock_api.make_bvid(110 + offset), title='t', owner='o')
+                # 第二次入库的弹幕一半已入库
+                for start in (1, 251):
+                    danmakus = make_columns(500, start_dmid=offset * 10000 + start)
+                    self.crawler.ingest_segments(source, [(1, {'cid': 10 + offset, 'duration': 600}, None, danmakus, True)],
+                                                 incremental=False)
+
+                count = Danmaku.objects.filter(source=source).count()
+                self.assertGreater(count, 0)
+                texts = DanmakuText.objects.filter(source=source).aggregate(total=Sum('count'))['total']
+                self.assertEqual(texts, count)
+
+    def test_orm_and_sql_ingest_write_the_same_rows(self):
+        bvid = mock_api.make_bvid(106)
+        with mock.patch.dict(crawler_config.PIPELINE, ingest_method='orm'):
+            self.crawl(bvid)
+        source = VideoSource.objects.get(bvid=bvid)
+        fields = ('dmid', 'page_id', 'content', 'send_time', 'progress', 'color', 'user_hash', 'weight')
+        orm_rows = set(Danmaku.objects.filter(source=source).values_list(*fields))
+
+        with mock.patch.dict(crawler_config.PIPELINE, ingest_method='sql'):
+            self.crawl(bvid, incremental=False)
+
+        self.assertTrue(orm_rows)
+        self.assertEqual(set(Danmaku.objects.filter(source=source).values_list(*fields)), orm_rows)
+
+    def test_users_share_one_source_and_reuse_a_fresh_crawl(self):
+        bvid = mock_api.make_bvid(109)
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        self.crawler.crawl_danmaku(bvid, user=alice)
+        requests = self.count_segment_requests()
+
+        with mock.patch.dict(crawler_config.SHARED_STORAGE, fresh_seconds=600):
+            task = self.crawler.crawl_danmaku(bvid, user=bob)
+
+        self.assertEqual(task.status, 'completed')
+        self.assertEqual(sum(requests.values()), 0)
+        source = VideoSource.objects.get(bvid=bvid)
+        self.assertEqual(set(Video.objects.filter(bvid=bvid).values_list('user__username', 'source_id')),
+                         {('alice', source.id), ('bob', source.id)})
+
+    def test_full_refresh_of_shared_source_is_restricted(self):
+        source = VideoSource.objects.create(bvid=mock_api.make_bvid(105), title='t', owner='o')
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        staff = User.objects.create(username='staff', is_staff=True)
+        video = Video.objects.create(bvid=source.bvid, title='t', owner='o', source=source, user=alice)
+
+        self.assertTrue(can_full_refresh(video, alice))
+        Video.objects.create(bvid=source.bvid, title='t', owner='o', source=source, user=bob)
+        self.assertFalse(can_full_refresh(video, alice))
+        self.assertTrue(can_full_refresh(video, staff))
+
+
+class SegmentArchiveTestCase(SimpleTestCase):
+    """原始分段归档：按内容去重保存，按抓取时间选择分段，解压后与原始响应一致"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+
+    def object_count(self):
+        return sum(len(files) for _, _, files in os.walk(os.path.join(self.root, 'objects')))
+
+    def check_round_trip(self, compression):
+        archive = SegmentArchive(self.root, compression)
+        first = make_segment([{'dmid': '1', 'text': '第一次'}])
+        second = make_segment([{'dmid': '1', 'text': '第一次'}, {'dmid': '2', 'text': '第二次'}])
+        archive.put_segment(100, 1, first, fetched_at=1000)
+        archive.put_segment(100, 1, second, fetched_at=2000)
+        archive.put_segment(100, 2, first, fetched_at=2000)
+
+        # 内容相同的分段只保存一份
+        self.assertEqual(self.object_count(), 2)
+        latest = archive.latest_entries(100)
+        self.assertEqual([e['segment'] for e in latest], [1, 2])
+        self.assertEqual(archive.read_segment(latest[0]), second)
+        self.assertEqual(archive.read_segment(archive.latest_entries(100, before=1500)[0]), first)
+
+    def test_gzip_round_trip(self):
+        self.check_round_trip('gzip')
+
+    @skipIf(zstandard is None, '未安装 zstandard')
+    def test_zstd_round_trip(self):
+        self.check_round_trip('zstd')
+
+    def test_iter_segments_replays_parts_in_order(self):
+        archive = SegmentArchive(self.root, 'gzip')
+        archive.save_parts('BV1', 1, [{'cid': 10, 'duration': 700}, {'cid': 20, 'duration': 100}])
+        for page in (2, 1):
+            archive.put_segment(10, page, make_segment([{'dmid': str(page), 'text': 'x'}]))
+
+        parts = list(enumerate(archive.load_parts('BV1'), start=1))
+        replayed = [(index, page, len(danmakus), done) for index, _, page, danmakus, done in archive.iter_segments(parts)]
+        self.assertEqual(replayed, [(1, 1, 1, False), (1, 2, 1, True), (2, None, 0, True)])
+
+
+class ArchiveReplayTestCase(MockAPITestMixin, TransactionTestCase):
+    """爬取时归档原始分段，之后不请求接口即可从归档重放入库"""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.archive = SegmentArchive(tmp.name, 'gzip')
+        self.crawler.archive = self.archive
+        self.bvid = mock_api.make_bvid(108)
+        self.crawler.crawl_danmaku(self.bvid)
+        self.source = VideoSource.objects.get(bvid=self.bvid)
+        self.crawled = set(Danmaku.objects.filter(source=self.source).values_list('dmid', 'content', 'progress'))
+        # 重放期间接口不可用
+        self.server.api.handle = lambda path, params: (503, 'text/plain', b'error')
+
+    def rows(self, source):
+        return set(Danmaku.objects.filter(source=source).values_list('dmid', 'content', 'progress'))
+
+    def test_full_refresh_replay_rebuilds_rows(self):
+        created = self.crawler.replay_danmaku(self.source, self.archive, incremental=False)
+
+        self.assertEqual(created, len(self.crawled))
+        self.assertEqual(self.rows(self.source), self.crawled)
+
+    def test_replay_command_restores_deleted_source(self):
+        info = self.video_info(self.bvid)
+        self.source.delete()
+
+        with mock.patch('danmaku_crawler.management.commands.replay_segments.get_segment_archive',
+                        return_value=self.archive):
+            call_command('replay_segments', self.bvid, stdout=StringIO())
+
+        source = VideoSource.objects.get(bvid=self.bvid)
+        self.assertEqual((source.title, source.aid, source.duration), (info['title'], info['aid'], info['duration']))
+        self.assertEqual(self.rows(source), self.crawled)
+
+
+class LiveWindowTestCase(SimpleTestCase):
+    """直播统计窗口：每秒弹幕数立即更新，分词批量进行，过期的秒从窗口中扣除"""
+
+    def test_segmentation_is_deferred_to_batch(self):
+        window = live.LiveWindow(rate_seconds=300, text_seconds=60)
+        for text in ['主播好厉害', '主播好厉害', '太无聊了']:
+            window.add(text, 1000)
+
+        # 分词前只有弹幕数
+        snapshot = window.snapshot(1000)
+        self.assertEqual((snapshot['total'], snapshot['rate_1s'], snapshot['keywords']), (3, 3.0, []))
+
+        pending = window.drain()
+        results = window.segment(pending)
+        self.assertEqual(window.keywords, {})
+        window.merge(results)
+
+        snapshot = window.snapshot(1000)
+        self.assertEqual(dict(snapshot['keywords'])['主播'], 2)
+        self.assertEqual(sum(snapshot['sentiment'][k] for k in ('positive', 'negative', 'neutral')), 3)
+        self.assertEqual(window.pending, [])
+
+    def test_text_window_expires(self):
+        window = live.LiveWindow(rate_seconds=300, text_seconds=60)
+        window.add('前方高能', 1000)
+        window.update()
+        window.add('哈哈哈哈', 1070)
+        window.update()
+
+        snapshot = window.snapshot(1070)
+        self.assertNotIn('前方', dict(snapshot['keywords']))
+        self.assertEqual(snapshot['total'], 2)
+        self.assertEqual(snapshot['per_second'], [[1000, 1], [1070, 1]])
+
+    def test_stime_is_relative_to_origin(self):
+        origin_ms = 1700000000000
+        message = {'cmd': 'DANMU_MSG', 'info': [[0, 1, 25, 16777215, origin_ms + 86400000, 0, 0, 'abc'], '弹幕', [1, 'u']]}
+
+        danmaku = live.parse_danmu_msg(1, message, origin_ms)
+        self.assertEqual((danmaku.stime, danmaku.date, danmaku.uhash), (86400000, origin_ms // 1000 + 86400, 'abc'))
+        self.assertEqual(danmaku.dmid, live.parse_danmu_msg(1, message, origin_ms).dmid)
+
+
+@skipIf(live.websockets is None, '未安装 websockets')
+class LiveRoomTestCase(TransactionTestCase):
+    """直播间接入：从本地替身服务器接收弹幕入库，重启后沿用弹幕源的时间起点，写入失败时仍完成收尾"""
+
+    room_id = 1001
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(live.LiveRoomClient, '_get_json', side_effect=ValueError('不访问B站'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.frames_path = os.path.join(tmp.name, 'frames.bin')
+        self.record_path = os.path.join(tmp.name, 'record.bin')
+
+        recorder = live.FrameRecorder(self.frames_path)
+        for _ in range(4):
+            recorder.write(live.make_synthetic_frame(self.room_id, 50))
+        recorder.close()
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+    def run_client(self, client, duration=1.5):
+        """启动回放录制帧的替身服务器，接入 duration 秒"""
+        async def main():
+            server = asyncio.create_task(live.serve_replay('127.0.0.1', self.port, self.frames_path, speed=0))
+            await asyncio.sleep(0.2)
+            try:
+                return await client.run(duration)
+            finally:
+                server.cancel()
+
+        return asyncio.run(main())
+
+    def make_client(self, record_path=None):
+        config = dict(crawler_config.LIVE, flush_interval=0.1)
+        client = live.LiveRoomClient(
+            self.room_id, ws_url=f"ws://127.0.0.1:{self.port}", record_path=record_path, config=config
+        )
+        return client.prepare()
+
+    def test_replayed_frames_are_ingested(self):
+        client = self.make_client(self.record_path)
+        stats = self.run_client(client)
+
+        self.assertEqual(stats['danmaku'], 200)
+        source = VideoSource.objects.get(bvid=f"live:{self.room_id}")
+        self.assertGreater(source.danmaku_count, 0)
+        self.assertEqual(source.danmaku_count, Danmaku.objects.filter(source=source).count())
+
+        snapshot = live.get_live_snapshot(self.room_id)
+        self.assertEqual(snapshot['total'], 200)
+        self.assertTrue(snapshot['keywords'])
+        self.assertEqual(client.window.pending, [])
+        # 录制文件包含收到的全部帧(含认证和心跳回复)
+        self.assertEqual(len(list(live.read_frames(self.record_path))), stats['frames'])
+
+    def test_restart_keeps_stime_origin(self):
+        first = self.make_client()
+        source = VideoSource.objects.get(bvid=f"live:{self.room_id}")
+        VideoSource.objects.filter(pk=source.pk).update(created_at=source.created_at - timedelta(days=1))
+
+        second = self.make_client()
+        self.assertEqual(second.origin_ms, first.origin_ms - 86400000)
+
+        self.run_client(second, duration=1)
+        # 录制帧的发送时间约为弹幕源创建时刻，进度相对弹幕源创建时刻而不是本次启动时刻
+        progress = Danmaku.objects.filter(source=source).aggregate(Min('progress'))['progress__min']
+        self.assertAlmostEqual(progress, 86400000, delta=60000)
+
+    def test_writer_failure_still_finishes(self):
+        client = self.make_client(self.record_path)
+        with mock.patch.object(client.crawler, 'save_danmaku_rows', side_effect=RuntimeError('写入失败')), \
+                mock.patch.object(client.crawler, 'save_danmaku_batch', side_effect=RuntimeError('写入失败')):
+            with self.assertRaises(RuntimeError):
+                self.run_client(client)
+
+        self.assertTrue(client.recorder.file.closed)
+        self.assertEqual(live.get_live_snapshot(self.room_id)['total'], client.window.total)
+
+
+class SnapshotTestCase(MockAPITestMixin, TransactionTestCase):
+    """爬取完成后写入列式快照，弹幕变化或全量重爬开始后旧快照不再被读取"""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.dict(crawler_config.SNAPSHOT, enabled=True, root=tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bvid = mock_api.make_bvid(901)
+        self.crawler.crawl_danmaku(self.bvid)
+        self.source = VideoSource.objects.get(bvid=self.bvid)
+
+    def test_snapshot_matches_rows(self):
+        danmaku_snapshot = snapshot.load_snapshot(self.source)
+
+        self.assertIsNotNone(danmaku_snapshot)
+        rows = list(Danmaku.objects.filter(source=self.source).order_by('progress', 'id')
+                    .values_list('dmid', 'page_id', 'progress', 'content', 'user_hash', 'color'))
+        self.assertEqual(len(danmaku_snapshot), len(rows))
+        self.assertEqual([(d.dmid, d.page_id, d.progress, d.content, d.user_hash, d.color) for d in danmaku_snapshot],
+                         rows)
+        self.assertEqual([page['page_id'] for page in danmaku_snapshot.page_info], [1, 2])
+
+    def test_changed_source_invalidates_snapshot(self):
+        VideoSource.objects.filter(pk=self.source.pk).update(danmaku_count=self.source.danmaku_count + 1)
+        self.source.refresh_from_db()
+
+        self.assertIsNone(snapshot.load_snapshot(self.source))
+
+    def test_failed_full_refresh_leaves_no_stale_snapshot(self):
+        with mock.patch.object(self.crawler, 'get_all_cids', return_value=[]):
+            self.assertIsNone(self.crawler.crawl_danmaku(self.bvid, incremental=False))
+
+        self.assertEqual(CrawlTask.objects.latest('id').status, 'failed')
+        self.source.refresh_from_db()
+        self.assertEqual((self.source.danmaku_count, self.source.last_crawled), (0, None))
+        self.assertFalse(os.path.exists(snapshot.snapshot_path(self.source.id)))
+        self.assertFalse(DanmakuText.objects.filter(source=self.source).exists())
+
+    def test_recrawl_rewrites_snapshot(self):
+        self.crawler.crawl_danmaku(self.bvid, incremental=False)
+        self.source.refresh_from_db()
+
+        danmaku_snapshot = snapshot.load_snapshot(self.source)
+        self.assertIsNotNone(danmaku_snapshot)
+        self.assertEqual(len(danmaku_snapshot), Danmaku.objects.filter(source=self.source).count())
+
+    def test_empty_snapshot_is_removed(self):
+        snapshot.save_snapshot(self.source, snapshot.build_snapshot([]))
+
+        self.assertFalse(os.path.exists(snapshot.snapshot_path(self.source.id)))
+
+
+class SchedulingTestCase(TestCase):
+    """多用户公平调度、优先级、全局并发上限和批次进度"""
+
+    def setUp(self):
+        self.users = [User.objects.create(username=name) for name in ('alice', 'bob', 'carol')]
+        self.next_bvid = 1000
+
+    def enqueue(self, user, count=1, priority=0):
+        tasks = []
+        for _ in range(count):
+            self.next_bvid += 1
+            video = Video.objects.create(bvid=mock_api.make_bvid(self.next_bvid), title='t', owner='o', user=user)
+            tasks.append(enqueue_crawl_task(video, user, priority=priority))
+        return tasks
+
+    def claim_users(self, worker, count):
+        return [worker.claim_task().user.username for _ in range(count)]
+
+    def test_users_are_interleaved(self):
+        alice, bob, _ = self.users
+        self.enqueue(alice, 4)
+        self.enqueue(bob, 2)
+
+        claimed = self.claim_users(CrawlWorker(worker_id='w'), 6)
+        self.assertEqual(claimed, ['alice', 'bob', 'alice', 'bob', 'alice', 'alice'])
+
+    def test_idle_user_enters_a_full_candidate_window(self):
+        alice, bob, carol = self.users
+        for user in (alice, bob):
+            started = self.enqueue(user)[0]
+            CrawlTask.objects.filter(id=started.id).update(status='completed', started_at=timezone.now())
+            self.enqueue(user, 3)
+        self.enqueue(carol)
+
+        worker = CrawlWorker(worker_id='w', config=dict(crawler_config.JOB_QUEUE, claim_candidates=2))
+        self.assertEqual(worker.claim_task().user, carol)
+
+    def test_higher_priority_first(self):
+        alice, bob, _ = self.users
+        self.enqueue(alice, 2)
+        urgent = self.enqueue(bob, 1, priority=5)[0]
+
+        self.assertEqual(CrawlWorker(worker_id='w').claim_task().id, urgent.id)
+
+    def test_max_running_limits_claims(self):
+        self.enqueue(self.users[0], 3)
+        worker = CrawlWorker(worker_id='w', config=dict(crawler_config.JOB_QUEUE, max_running=2))
+
+        self.assertIsNotNone(worker.claim_task())
+        self.assertIsNotNone(worker.claim_task())
+        self.assertIsNone(worker.claim_task())
+
+    def test_submit_batch_and_progress(self):
+        alice = self.users[0]
+        bvids = [mock_api.make_bvid(n) for n in (2001, 2002, 2003)]
+        batch, invalid = submit_crawl_batch(
+            bvids + [f"https://www.bilibili.com/video/{bvids[0]}", 'not-a-video'], user=alice, priority=3
+        )
+
+        self.assertEqual(invalid, ['not-a-video'])
+        tasks = list(CrawlTask.objects.filter(batch=batch).order_by('id'))
+        self.assertEqual([t.video.bvid for t in tasks], bvids)
+        self.assertTrue(all(t.priority == 3 and t.status == 'pending' for t in tasks))
+
+        start = timezone.now() - timedelta(seconds=60)
+        CrawlTask.objects.filter(id=tasks[0].id).update(status='completed', danmaku_count=600, started_at=start,
+                                                        completed_at=start + timedelta(seconds=30))
+        CrawlTask.objects.filter(id=tasks[1].id).update(status='failed', started_at=start,
+                                                        completed_at=start + timedelta(seconds=60))
+        progress = get_batch_progress(batch)
+
+        self.assertEqual((progress['total'], progress['pending'], progress['completed'], progress['failed']), (3, 1, 1, 1))
+        self.assertEqual(progress['progress'], round(2 / 3, 4))
+        self.assertEqual(progress['danmaku_count'], 600)
+        self.assertAlmostEqual(progress['elapsed_seconds'], 60, delta=2)
+
+        CrawlTask.objects.filter(id=tasks[2].id).update(status='completed', danmaku_count=600, started_at=start,
+                                                        completed_at=start + timedelta(seconds=120))
+        progress = get_batch_progress(batch)
+        self.assertEqual((progress['progress'], progress['elapsed_seconds']), (1.0, 120.0))
+        self.assertEqual(progress['videos_per_minute'], 1.5)
+        self.assertEqual(progress['danmaku_per_second'], 10.0)
+
+
+class IngestTestCase(TestCase):
+    """多行 INSERT 和 ORM 两种入库方式：忽略重复弹幕，跳过没有数字 dmid 的弹幕"""
+
+    def setUp(self):
+        self.source = VideoSource.objects.create(bvid=mock_api.make_bvid(401), title='t', owner='o')
+
+    def test_duplicate_rows_are_ignored(self):
+        first = ingest.build_rows(make_columns(500), self.source.id, page_num=1, page_duration=600)
+        self.assertEqual(ingest.insert_rows(first, batch_size=100), 500)
+
+        # 一半与已入库弹幕重复
+        second = ingest.build_rows(make_columns(500, start_dmid=251), self.source.id, page_num=1, page_duration=600)
+        self.assertEqual(ingest.insert_rows(second, batch_size=100), 250)
+
+        self.assertEqual(Danmaku.objects.filter(source=self.source).count(), 750)
+        self.assertEqual(bucket_counts(self.source), row_counts(self.source))
+
+    def test_recount_overwrites_existing_buckets(self):
+        rows = ingest.build_rows(make_columns(300), self.source.id, page_num=1, page_duration=600)
+        ingest.insert_rows(rows)
+        expected = row_counts(self.source)
+        # 计数偏离弹幕表，另有一秒已没有弹幕
+        DanmakuSecondBucket.objects.filter(source=self.source).update(count=F('count') + 5)
+        DanmakuSecondBucket.objects.create(source=self.source, page_id=2, second=0, count=3)
+        keys = [(self.source.id, page_id, second) for page_id, second in bucket_counts(self.source)]
+
+        timeline.recount_seconds(keys)
+
+        self.assertEqual(bucket_counts(self.source), expected)
+
+    def test_rows_without_numeric_dmid_are_skipped(self):
+        danmakus = columnar.decode_segment(make_segment([
+            {'dmid': '12', 'text': 'ok', 'stime': 1000},
+            {'dmid': 'abc', 'text': 'bad', 'stime': 2000},
+            {'dmid': '', 'text': 'empty', 'stime': 3000},
+        ]))
+
+        rows = ingest.build_rows(danmakus, self.source.id)
+        self.assertEqual([row[ingest.COLUMNS.index('dmid')] for row in rows], [12])
+
+        objects = list(BilibiliDanmakuCrawler().build_danmaku_objects(danmakus, self.source))
+        self.assertEqual([d.dmid for d in objects], [12])
+        BilibiliDanmakuCrawler().save_danmaku_batch(objects)
+        self.assertEqual(list(Danmaku.objects.filter(source=self.source).values_list('dmid', flat=True)), [12])
+
+    def test_benchmark_cleans_up_its_source(self):
+        call_command('benchmark_ingest', rows=200, batch_size=50, stdout=StringIO())
+
+        self.assertEqual(list(VideoSource.objects.values_list('id', flat=True)), [self.source.id])
+        self.assertFalse(Danmaku.objects.exists())
+
+
+class CleaningEngineTestCase(TestCase):
+    """清洗规则按声明顺序命中，每条弹幕只计入第一条命中的规则；各进程的统计原子累加到数据库"""
+
+    def make_danmakus(self):
+        texts = ['前方高能', '', 'a', '666', '？？？', '...', '正常的弹幕', '超出时长']
+        return columnar.decode_segment(make_segment([
+            {'dmid': str(i + 1), 'text': text, 'stime': 700000 if text == '超出时长' else 1000}
+            for i, text in enumerate(texts)
+        ]))
+
+    def test_default_rules(self):
+        engine = CleaningEngine(crawler_config.CLEANING['rules'])
+
+        cleaned, dropped = engine.clean(self.make_danmakus(), page_duration=600)
+
+        self.assertEqual(cleaned.text, ['前方高能', '666', '？？？', '正常的弹幕'])
+        self.assertEqual(dict(dropped), {'out_of_range': 1, 'empty': 1, 'too_short': 1, 'meaningless': 1})
+
+    def test_duplicate_rule_names_are_rejected(self):
+        rules = [{'name': 'x', 'type': 'length', 'max': 0}, {'name': 'x', 'type': 'regex', 'pattern': 'a'}]
+        with self.assertRaises(ValueError):
+            CleaningEngine(rules)
+
+    def test_stats_from_several_engines_are_summed(self):
+        engines = [CleaningEngine(crawler_config.CLEANING['rules']) for _ in range(2)]
+        for engine in engines + engines[:1]:
+            engine.clean(self.make_danmakus(), page_duration=600)
+            engine.flush_stats()
+        # 没有新统计时不写入
+        engines[1].flush_stats()
+
+        stats = get_cleaning_stats()
+        self.assertEqual((stats['total'], stats['kept']), (24, 12))
+        self.assertEqual(stats['rules']['empty'], 3)
+        self.assertEqual(stats['rules']['out_of_range'], 3)
+
+        reset_cleaning_stats()
+        self.assertEqual(get_cleaning_stats()['total'], 0)
+
+    def test_failed_flush_keeps_pending_counts(self):
+        engine = CleaningEngine(crawler_config.CLEANING['rules'])
+        engine.clean(self.make_danmakus(), page_duration=600)
+
+        with mock.patch('danmaku_crawler.cleaning.transaction.atomic', side_effect=RuntimeError('数据库不可用')):
+            engine.flush_stats()
+        self.assertEqual(get_cleaning_stats()['total'], 0)
+
+        engine.flush_stats()
+        self.assertEqual(get_cleaning_stats()['total'], 8)
+
+
+class DedupTestCase(TestCase):
+    """文本规范化、精确计数和增量近似重复聚类"""
+
+    VARIANTS = ['前方高能', '前方高能！！！', '前方高能啊', 'ＡＷＳＬ', 'awsl', 'awslawsl', '哈哈哈哈哈',
+                '这是什么神仙操作', '这是什么神仙操作啊', '爷青回', '爷青回了']
+
+    def setUp(self):
+        self.source = VideoSource.objects.create(bvid=mock_api.make_bvid(601), title='t', owner='o')
+
+    def clusters(self):
+        groups = defaultdict(set)
+        for text_hash, cluster_hash in DanmakuText.objects.filter(source=self.source).values_list(
+                'text_hash', 'cluster_hash'):
+            groups[cluster_hash].add(text_hash)
+        return {frozenset(group) for group in groups.values()}
+
+    def save(self, texts):
+        tracker = dedup.DuplicateTracker()
+        tracker.add(texts)
+        return dedup.save_text_stats(self.source, tracker)
+
+    def test_canonicalize(self):
+        self.assertEqual(dedup.canonicalize('前方高能！！！'), '前方高能')
+        self.assertEqual(dedup.canonicalize('ＡＷＳＬ'), 'awsl')
+        self.assertEqual(dedup.canonicalize('awslawslawsl'), 'awsl')
+        self.assertEqual(dedup.canonicalize('哈哈哈哈'), '哈')
+        self.assertEqual(dedup.canonicalize('???'), '?')
+
+    def test_exact_counts(self):
+        stats = self.save(['前方高能'] * 5 + ['前方高能！！'] * 3 + ['awsl'] * 2)
+
+        self.assertEqual(stats['total'], 10)
+        self.assertEqual(stats['unique_texts'], 2)
+        top = stats['top_clusters'][0]
+        self.assertEqual((top['text'], top['count'], top['variants']), ('前方高能', 8, 1))
+
+    def test_incremental_clusters_match_full_rebuild(self):
+        for start in range(0, len(self.VARIANTS), 3):
+            self.save([text + suffix for text in self.VARIANTS[start:start + 3] for suffix in ('', '草', '2333')])
+        self.source.refresh_from_db()
+        incremental = self.clusters()
+
+        self.assertEqual(self.source.text_cluster_count, len(incremental))
+        self.assertEqual(self.source.unique_text_count, DanmakuText.objects.filter(source=self.source).count())
+
+        dedup.update_clusters(self.source)
+        self.assertEqual(self.clusters(), incremental)
+
+    def test_existing_texts_only_update_counts(self):
+        self.save(self.VARIANTS)
+        self.source.refresh_from_db()
+        clusters = self.clusters()
+        bands = self.source.text_bands.count()
+
+        stats = self.save(self.VARIANTS[:3])
+
+        self.assertEqual(stats['total'], len(self.VARIANTS) + 3)
+        self.assertEqual(self.clusters(), clusters)
+        self.assertEqual(self.source.text_bands.count(), bands)
+
+    def test_tracker_counts_only_inserted_rows(self):
+        crawler = BilibiliDanmakuCrawler()
+        tracker = dedup.DuplicateTracker()
+        first = ingest.build_rows(make_columns(100, start_dmid=6001), self.source.id)
+        crawler.save_danmaku_rows(first, tracker=tracker)
+        # 与已入库弹幕重复以及本批内 dmid 重复的行都不计数
+        second = ingest.build_rows(make_columns(100, start_dmid=6051), self.source.id)
+        self.assertEqual(crawler.save_danmaku_rows(second + second[-10:], tracker=tracker), 50)
+
+        self.assertEqual(len(tracker), 150)
+        self.assertEqual(Danmaku.objects.filter(source=self.source).count(), 150)
+
+
+class ColumnarTestCase(SimpleTestCase):
+    """按线格式直接解码与 protobuf 解析结果一致"""
+
+    def assertSameColumns(self, payload):
+        reply = danmu_pb2.DmSegMobileReply()
+        reply.ParseFromString(payload)
+        expected = columnar.DanmakuColumns.from_elems(reply.elems)
+        actual = columnar.decode_segment(payload)
+        for name in columnar.COLUMNS:
+            with self.subTest(column=name):
+                if name in columnar.TEXT_COLUMNS:
+                    self.assertEqual(list(getattr(actual, name)), list(getattr(expected, name)))
+                else:
+                    np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+                    self.assertEqual(getattr(actual, name).dtype, getattr(expected, name).dtype)
+
+    def test_edge_cases_match_protobuf(self):
+        self.assertSameColumns(make_segment([
+            {'dmid': '1234567890123456789', 'text': '普通弹幕', 'stime': 12345, 'date': 1700000000,
+             'uhash': 'abcd1234', 'color': 2 ** 32 - 1, 'mode': 1, 'size': 25, 'weight': 10},
+            {'dmid': '99999999999999999999', 'text': 'a\x00b', 'stime': -5, 'date': -1, 'mode': -1},
+            {'dmid': 'not-a-number', 'text': '😀' * 60, 'weight': -3, 'action': 'x', 'oid': 2 ** 62},
+            {'dmid': '007', 'text': '', 'uhash': ''},
+            {},
+        ]))
+
+    def test_generated_segment_matches_protobuf(self):
+        fixtures = mock_api.GeneratedFixtures(default_danmaku=2000, per_segment=2000)
+        cid = fixtures.video_info(mock_api.make_bvid(501))['pages'][0]['cid']
+        self.assertSameColumns(fixtures.segment(cid, 1))
+
+    def test_empty_payload(self):
+        self.assertEqual(len(columnar.decode_segment(b'')), 0)
+
+
+class MockAPITestCase(SimpleTestCase):
+    """替身接口：生成的数据稳定可复现，限流和错误注入按比例生效，统计接口不计入请求数"""
+
+    def test_make_bvid(self):
+        bvids = [mock_api.make_bvid(n) for n in range(1000)]
+        self.assertEqual(len(set(bvids)), 1000)
+        self.assertTrue(all(bvid.startswith('BV') and len(bvid) == 12 for bvid in bvids))
+        self.assertEqual(mock_api.make_bvid(42), mock_api.make_bvid(42))
+
+    def test_generated_fixtures_are_reproducible(self):
+        bvid = mock_api.make_bvid(801)
+        fixtures = mock_api.GeneratedFixtures({bvid: {'danmaku': 1000, 'pages': 2}}, per_segment=200)
+        info = fixtures.video_info(bvid)
+        self.assertEqual(len(info['pages']), 2)
+
+        dmids = set()
+        for page in info['pages']:
+            segment_count = math.ceil(500 / 200)
+            for segment_index in range(1, segment_count + 1):
+                danmakus = columnar.decode_segment(fixtures.segment(page['cid'], segment_index))
+                self.assertTrue(np.all(danmakus.stime // (crawler_config.SEGMENT_DURATION * 1000) == segment_index - 1))
+                dmids.update(danmakus.dmid.tolist())
+            self.assertEqual(fixtures.segment(page['cid'], segment_count + 1), b'')
+        self.assertEqual(len(dmids), 1000)
+
+        # 另一个实例生成相同的数据
+        other = mock_api.GeneratedFixtures({bvid: {'danmaku': 1000, 'pages': 2}}, per_segment=200)
+        cid = other.video_info(bvid)['pages'][0]['cid']
+        self.assertEqual(other.segment(cid, 1), fixtures.segment(cid, 1))
+
+    def test_throttle_and_error_injection(self):
+        fixtures = mock_api.GeneratedFixtures(default_danmaku=100)
+        cases = [({'throttle_rate': 1.0}, {412}, 'throttled'), ({'error_rate': 1.0}, {500, 503}, 'errors')]
+        for options, statuses, counter in cases:
+            with self.subTest(**options):
+                api = mock_api.MockBilibiliAPI(fixtures, seed=1, **options)
+                responses = [api.handle('/x/web-interface/nav', {})[0] for _ in range(50)]
+                self.assertLessEqual(set(responses), statuses)
+                self.assertEqual((api.stats['requests'], api.stats[counter]), (50, 50))
+
+        api = mock_api.MockBilibiliAPI(fixtures, throttle_rate=0.3, error_rate=0.2, seed=1)
+        responses = [api.handle('/x/web-interface/nav', {})[0] for _ in range(1000)]
+        self.assertAlmostEqual(responses.count(412) / 1000, 0.3, delta=0.05)
+        self.assertAlmostEqual(sum(status >= 500 for status in responses) / 1000, 0.2, delta=0.05)
+        self.assertEqual(json.loads(api.handle('/__stats', {})[2])['requests'], 1000)
+
+    def test_max_rps_throttles_excess_requests(self):
+        api = mock_api.MockBilibiliAPI(mock_api.GeneratedFixtures(default_danmaku=100), max_rps=5)
+        statuses = [api.handle('/x/web-interface/view', {'bvid': mock_api.make_bvid(802)})[0] for _ in range(20)]
+        self.assertEqual(statuses.count(200), 5)
+        self.assertEqual(api.stats['throttled'], 15)
+
+    def test_archive_fixtures_replay_archived_segments(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        archive = SegmentArchive(tmp.name, 'gzip')
+        bvid = mock_api.make_bvid(803)
+        payload = make_segment([{'dmid': '1', 'text': '归档弹幕'}])
+        archive.save_parts(bvid, 1, [{'cid': 30, 'duration': 100}])
+        archive.put_segment(30, 1, payload)
+
+        api = mock_api.MockBilibiliAPI(mock_api.ArchiveFixtures(archive))
+        status, _, body = api.handle('/x/web-interface/view', {'bvid': bvid})
+        self.assertEqual((status, json.loads(body)['data']['pages'][0]['cid']), (200, 30))
+        self.assertEqual(api.handle('/x/v2/dm/web/seg.so', {'oid': '30', 'segment_index': '1'})[2], payload)
+        self.assertEqual(json.loads(api.handle('/x/web-interface/view', {'bvid': 'BVmissing'})[2])['code'], -404)
+
+
+class BenchmarkCrawlTestCase(TransactionTestCase):
+    """benchmark_crawl 在子进程中启动替身接口完成一轮爬取，结束后清理弹幕源"""
+
+    def test_benchmark_reports_and_cleans_up(self):
+        out = StringIO()
+        with mock.patch.dict(crawler_config.ARCHIVE, enabled=False), \
+                mock.patch.dict(crawler_config.SNAPSHOT, enabled=False):
+            call_command('benchmark_crawl', scales=[3000], per_segment=1000, stdout=out)
+
+        self.assertRegex(out.getvalue(), r'3,000 条: 耗时 [\d.]+秒, 入库 [1-9][\d,]* 条')
+        self.assertFalse(VideoSource.objects.exists())
+        self.assertFalse(Danmaku.objects.exists())
+
+
+class VideoInfoCacheTestCase(MockAPITestMixin, SimpleTestCase):
+    """view 接口的视频信息按BV号缓存，失败结果不缓存"""
+
+    def setUp(self):
+        super().setUp()
+        self.bvid = mock_api.make_bvid(701)
+        self.requests = []
+
+        def handle(path, params):
+            if path.endswith('/view'):
+                self.requests.append(params['bvid'])
+            return self.handle(path, params)
+
+        self.server.api.handle = handle
+
+    def test_info_is_cached(self):
+        info = self.crawler.get_video_info(self.bvid)
+
+        self.assertEqual(BilibiliDanmakuCrawler().get_video_info(self.bvid), info)
+        self.assertEqual(self.requests, [self.bvid])
+
+    def test_refresh_bypasses_cache(self):
+        self.crawler.get_video_info(self.bvid)
+        self.crawler.get_video_info(self.bvid, refresh=True)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_zero_ttl_disables_cache(self):
+        with mock.patch.dict(crawler_config.VIDEO_INFO_CACHE, ttl=0):
+            self.crawler.get_video_info(self.bvid)
+            self.crawler.get_video_info(self.bvid)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_failures_are_not_cached(self):
+        handle = self.server.api.handle
+        self.server.api.handle = lambda path, params: (200, 'application/json', b'{"code": -404, "message": "x"}')
+        self.assertIsNone(self.crawler.get_video_info(self.bvid))
+
+        self.server.api.handle = handle
+        self.assertIsNotNone(self.crawler.get_video_info(self.bvid))
+        self.assertEqual(self.requests, [self.bvid])
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    """熔断器：限流时暂停请求，连续触发时冷却时间指数增长，成功后恢复"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(http_client, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(cooldown=10, max_cooldown=25)
+
+    def test_trip_opens_until_cooldown_ends(self):
+        self.breaker.trip()
+        self.assertTrue(self.breaker.is_open)
+
+        self.breaker.wait()
+        self.assertEqual(self.clock.now, 10)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_repeated_trips_back_off_exponentially(self):
+        self.breaker.trip()
+        # 冷却期内其他线程再次触发不延长冷却
+        self.breaker.trip()
+        self.breaker.wait()
+        self.assertEqual(self.clock.now, 10)
+
+        self.breaker.trip()
+        self.breaker.wait()
+        self.assertEqual(self.clock.now, 30)
+
+        self.breaker.trip()
+        self.breaker.wait()
+        self.assertEqual(self.clock.now, 55)
+
+    def test_success_resets_cooldown(self):
+        self.breaker.trip()
+        self.breaker.wait()
+        self.breaker.record_success()
+
+        self.breaker.trip()
+        self.breaker.wait()
+        self.assertEqual(self.clock.now, 20)
+
+
+class HttpClientTestCase(MockAPITestMixin, SimpleTestCase):
+    """共享HTTP客户端：可重试状态码退避重试，限流触发熔断，重试用尽返回最后一次响应"""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch.object(http_client, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = BilibiliHttpClient(dict(crawler_config.HTTP, max_retries=3, backoff_base=1, backoff_max=4,
+                                              breaker_cooldown=30))
+        self.client.rate_limiter = TokenBucket(0)
+        self.url = http_client.api_url('/x/web-interface/nav')
+
+    def respond(self, statuses):
+        """依次返回给定的状态码，用完后正常响应，返回请求计数"""
+        statuses = list(statuses)
+        requests = []
+
+        def handle(path, params):
+            requests.append(path)
+            if statuses:
+                return statuses.pop(0), 'text/plain', b'error'
+            return self.handle(path, params)
+
+        self.server.api.handle = handle
+        return requests
+
+    def test_backoff_is_bounded(self):
+        for attempt in range(6):
+            delays = [self.client.backoff(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= d <= min(4, 2 ** attempt) for d in delays))
+
+    def test_retryable_statuses_are_retried(self):
+        requests = self.respond([503, 500])
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(requests), 3)
+        self.assertFalse(self.client.breaker.is_open)
+
+    def test_throttling_trips_breaker(self):
+        requests = self.respond([412])
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(requests), 2)
+        # 第二次请求在熔断冷却结束后才发出
+        self.assertGreaterEqual(self.clock.now, 30)
+        self.assertEqual(self.client.breaker._trips, 0)
+
+    def test_exhausted_retries_return_last_response(self):
+        requests = self.respond([503] * 10)
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(requests), 4)
+
+    def test_other_errors_are_not_retried(self):
+        requests = self.respond([404])
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(len(requests), 1)
+
+
+class WbiKeyManagerTestCase(SimpleTestCase):
+    """WBI 密钥在有效期内复用，通过 Django 缓存在进程间共享，被拒绝后重新获取"""
+
+    IMG_KEY = '7cd084941338484aae1ad9425b84077c'
+    SUB_KEY = '4932caff0ff746eab6f01bf08b70ac45'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(wbisign, 'getWbiKeys', return_value=(self.IMG_KEY, self.SUB_KEY))
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = wbisign.WbiKeyManager(ttl=60)
+
+    def test_sign_matches_reference_example(self):
+        with mock.patch.object(wbisign.time, 'time', return_value=1702204169):
+            params = wbisign.encWbi({'foo': '114', 'bar': '514', 'zab': 1919810}, self.IMG_KEY, self.SUB_KEY)
+        self.assertEqual(params['w_rid'], '8f6f2b5b3d485fe1886cec6a0be8c5d4')
+
+    def test_keys_are_reused_within_ttl(self):
+        keys = self.manager.get_keys()
+        self.assertEqual(keys['mixin_key'], 'ea1db124af3c7062474693fa704f4ff8')
+        self.assertIs(self.manager.get_keys(), keys)
+        self.fetch.assert_called_once_with()
+
+    def test_keys_are_shared_through_cache(self):
+        self.manager.get_keys()
+        other = wbisign.WbiKeyManager(ttl=60)
+        self.assertEqual(other.get_mixin_key(), self.manager.get_mixin_key())
+        self.fetch.assert_called_once_with()
+
+    def test_expired_keys_are_refetched(self):
+        keys = self.manager.get_keys()
+        expired = dict(keys, expires_at=0)
+        self.manager._keys = expired
+        cache.set(wbisign.WbiKeyManager.CACHE_KEY, expired)
+
+        self.assertGreater(self.manager.get_keys()['expires_at'], 0)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_invalidate_drops_local_and_shared_keys(self):
+        self.manager.get_keys()
+        self.manager.invalidate()
+
+        self.assertIsNone(cache.get(wbisign.WbiKeyManager.CACHE_KEY))
+        self.manager.get_keys()
+        self.assertEqual(self.fetch.call_count, 2)
+
+
+class CrawlQueueTestCase(TestCase):
+    """任务队列：合并、领取租约、心跳续租和失联接管"""
+
+    def setUp(self):
+        self.video = Video.objects.create(bvid=mock_api.make_bvid(301), title='t', owner='o')
+        self.worker = CrawlWorker(worker_id='worker-a')
+
+    def test_claim_sets_lease(self):
+        task = enqueue_crawl_task(self.video)
+
+        claimed = self.worker.claim_task()
+
+        self.assertEqual(claimed.id, task.id)
+        self.assertEqual(claimed.status, 'running')
+        self.assertEqual(claimed.worker_id, 'worker-a')
+        self.assertEqual(claimed.attempts, 1)
+        self.assertGreater(claimed.lease_expires_at, timezone.now())
+        self.assertIsNone(CrawlWorker(worker_id='worker-b').claim_task())
+
+    def test_tasks_for_same_video_are_coalesced(self):
+        leader = enqueue_crawl_task(self.video)
+        follower = enqueue_crawl_task(self.video)
+        refresh = enqueue_crawl_task(self.video, full_refresh=True)
+
+        self.assertIsNone(leader.leader)
+        self.assertEqual(follower.leader, leader)
+        # 全量重爬不合并到增量任务上
+        self.assertIsNone(refresh.leader)
+        self.assertEqual(enqueue_crawl_task(self.video, full_refresh=True).leader, refresh)
+
+    def test_claim_starts_followers(self):
+        leader = enqueue_crawl_task(self.video)
+        follower = enqueue_crawl_task(self.video)
+
+        self.assertEqual(self.worker.claim_task().id, leader.id)
+        follower.refresh_from_db()
+        self.assertEqual(follower.status, 'running')
+        # 合并的任务不会被单独领取
+        self.assertIsNone(CrawlWorker(worker_id='worker-b').claim_task())
+
+    def test_one_running_task_per_video(self):
+        other_user = User.objects.create(username='other')
+        other_video = Video.objects.create(bvid=self.video.bvid, title='t', owner='o', user=other_user)
+        incremental = enqueue_crawl_task(self.video)
+        refresh = enqueue_crawl_task(other_video, other_user, full_refresh=True)
+
+        self.assertEqual(self.worker.claim_task().id, incremental.id)
+        # 同一BV号的全量重爬等增量爬取结束后才能领取，不会在写入弹幕时清空弹幕源
+        self.assertIsNone(CrawlWorker(worker_id='worker-b').claim_task())
+
+        CrawlTask.objects.filter(id=incremental.id).update(status='completed', lease_expires_at=None)
+        self.assertEqual(CrawlWorker(worker_id='worker-b').claim_task().id, refresh.id)
+
+    def test_followers_receive_leader_result(self):
+        leader = enqueue_crawl_task(self.video)
+        follower = enqueue_crawl_task(self.video)
+        CrawlTask.objects.filter(id=leader.id).update(status='completed', danmaku_count=42, completed_at=timezone.now())
+
+        self.assertEqual(complete_followers(leader), 1)
+        follower.refresh_from_db()
+        self.assertEqual((follower.status, follower.danmaku_count), ('completed', 42))
+        # 领头任务已结束时提交的任务单独排队
+        late = enqueue_crawl_task(self.video)
+        self.assertIsNone(late.leader)
+        self.assertEqual(late.status, 'pending')
+
+    def test_resume_attaches_to_inflight_task(self):
+        failed = enqueue_crawl_task(self.video)
+        CrawlTask.objects.filter(id=failed.id).update(status='failed', completed_at=timezone.now())
+        leader = enqueue_crawl_task(self.video)
+        self.worker.claim_task()
+
+        resumed = resume_crawl_task(CrawlTask.objects.get(id=failed.id))
+
+        self.assertEqual(resumed.leader_id, leader.id)
+        self.assertEqual(resumed.status, 'running')
+        self.assertIsNone(CrawlWorker(worker_id='worker-b').claim_task())
+
+    def test_resume_without_inflight_task_requeues(self):
+        task = enqueue_crawl_task(self.video)
+        CrawlTask.objects.filter(id=task.id).update(status='failed', attempts=3, error_message='x',
+                                                    completed_at=timezone.now())
+
+        resumed = resume_crawl_task(CrawlTask.objects.get(id=task.id))
+
+        self.assertIsNone(resumed.leader)
+        self.assertEqual((resumed.status, resumed.attempts, resumed.error_message), ('pending', 0, ''))
+        self.assertEqual(self.worker.claim_task().id, task.id)
+
+    def test_heartbeat_extends_only_own_lease(self):
+        enqueue_crawl_task(self.video)
+        task = self.worker.claim_task()
+        CrawlTask.objects.filter(id=task.id).update(lease_expires_at=timezone.now() + timedelta(seconds=1))
+
+        self.assertTrue(self.worker.heartbeat(task))
+        task.refresh_from_db()
+        self.assertGreater(task.lease_expires_at, timezone.now() + timedelta(seconds=60))
+        self.assertFalse(CrawlWorker(worker_id='worker-b').heartbeat(task))
+
+    def test_expired_lease_is_taken_over(self):
+        enqueue_crawl_task(self.video)
+        task = self.worker.claim_task()
+        CrawlTask.objects.filter(id=task.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        other = CrawlWorker(worker_id='worker-b')
+        claimed = other.claim_task()
+
+        self.assertEqual(claimed.id, task.id)
+        self.assertEqual(claimed.worker_id, 'worker-b')
+        self.assertEqual(claimed.attempts, 2)
+        self.assertFalse(self.worker.heartbeat(task))
+
+    def test_exhausted_task_is_failed(self):
+        enqueue_crawl_task(self.video)
+        task = self.worker.claim_task()
+        CrawlTask.objects.filter(id=task.id).update(
+            attempts=self.worker.max_attempts, lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertIsNone(self.worker.claim_task())
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'failed')
@@ -0,0 +1,229 @@
+"""
+每秒弹幕数的入库时维护
+DanmakuSecondBucket 按 (弹幕源, 分P, 秒) 保存弹幕数，入库时与弹幕在同一事务中增量更新，
+时间线分析、峰值检测和时间线接口直接读取这张表，不再扫描弹幕表。
+
+多行 INSERT 忽略了部分重复 dmid 时无法知道跳过的是哪些弹幕，这批弹幕涉及的秒按弹幕表重新计数，
+重新计数的结果同样以 upsert 写入(覆盖而不是累加)，与其他进程并发的累加不会因唯一键冲突而失败；
+ORM 入库方式同样按弹幕表重新计数。功能上线前已入库的弹幕源(second_buckets_ready=False)
+在下一次入库或读取时间线时按弹幕表整体重建。
+"""
+
+import logging
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Floor
+
+from .models import Danmaku, DanmakuSecondBucket, VideoSource
+
+logger = logging.getLogger(__name__)
+
+BUCKET_COLUMNS = ('source_id', 'page_id', 'second', 'count')
+
+# 各数据库按唯一键累加计数的 INSERT 语法
+UPSERT_TEMPLATES = {
+    'mysql': ('INSERT INTO {table} ({columns}) VALUES {values} '
+              'ON DUPLICATE KEY UPDATE {count} = {count} + VALUES({count})'),
+    'sqlite': ('INSERT INTO {table} ({columns}) VALUES {values} '
+               'ON CONFLICT ({keys}) DO UPDATE SET {count} = {table}.{count} + excluded.{count}'),
+    'postgresql': ('INSERT INTO {table} ({columns}) VALUES {values} '
+                   'ON CONFLICT ({keys}) DO UPDATE SET {count} = {table}.{count} + excluded.{count}'),
+}
+
+# 各数据库按唯一键覆盖计数的 INSERT 语法，用于重新计数
+REPLACE_TEMPLATES = {
+    'mysql': ('INSERT INTO {table} ({columns}) VALUES {values} '
+              'ON DUPLICATE KEY UPDATE {count} = VALUES({count})'),
+    'sqlite': ('INSERT INTO {table} ({columns}) VALUES {values} '
+               'ON CONFLICT ({keys}) DO UPDATE SET {count} = excluded.{count}'),
+    'postgresql': ('INSERT INTO {table} ({columns}) VALUES {values} '
+                   'ON CONFLICT ({keys}) DO UPDATE SET {count} = excluded.{count}'),
+}
+
+# 重新计数时每次查询的秒数
+RECOUNT_CHUNK = 500
+
+
+def count_seconds(keys):
+    """
+    按秒统计一批弹幕
+
+    Args:
+        keys: (弹幕源ID, 分P编号, 进度毫秒) 序列
+
+    Returns:
+        Counter: {(弹幕源ID, 分P编号, 秒): 弹幕数}
+    """
+    return Counter((source_id, page_id, int(progress // 1000)) for source_id, page_id, progress in keys)
+
+
+def _upsert_seconds(templates, counts, cursor=None):
+    """
+    按唯一键 (弹幕源, 分P, 秒) 写入一批计数
+
+    Args:
+        templates: UPSERT_TEMPLATES 或 REPLACE_TEMPLATES
+        counts: {(弹幕源ID, 分P编号, 秒): 弹幕数}
+        cursor: 写入弹幕使用的游标，不传时新建
+
+    Returns:
+        bool: 当前数据库不支持 upsert 时返回False，未写入
+    """
+    template = templates.get(connection.vendor)
+    if template is None:
+        return False
+
+    quote = connection.ops.quote_name
+    table = quote(DanmakuSecondBucket._meta.db_table)
+    columns = ', '.join(quote(c) for c in BUCKET_COLUMNS)
+    keys = ', '.join(quote(c) for c in BUCKET_COLUMNS[:3])
+    placeholder = '(' + ', '.join(['%s'] * len(BUCKET_COLUMNS)) + ')'
+    max_params = connection.features.max_query_params
+    batch_size = max(1, min(1000, max_params // len(BUCKET_COLUMNS))) if max_params else 1000
+
+    items = [key + (count,) for key, count in counts.items()]
+    with nullcontext(cursor) if cursor is not None else connection.cursor() as cursor:
+        for i in range(0, len(items), batch_size):
+            chunk = items[i:i + batch_size]
+            sql = template.format(table=table, columns=columns, keys=keys, count=quote('count'),
+                                  values=', '.join([placeholder] * len(chunk)))
+            cursor.execute(sql, [value for item in chunk for value in item])
+    return True
+
+
+def add_seconds(counts, cursor=None):
+    """
+    把一批已写入弹幕的每秒计数累加到 DanmakuSecondBucket，需要在写入弹幕的事务中调用
+
+    Args:
+        counts: count_seconds 的结果
+        cursor: 写入弹幕使用的游标，不传时新建
+    """
+    if counts and not _upsert_seconds(UPSERT_TEMPLATES, counts, cursor):
+        # 不支持的数据库按弹幕表重新计数
+        recount_seconds(counts)
+
+
+def _count_queryset(queryset):
+    """按 (分P, FLOOR(progress/1000)) 分组计数"""
+    return (
+        queryset.annotate(second=Floor(F('progress') / 1000))
+        .values('page_id', 'second').annotate(count=Count('id')).order_by()
+        .values_list('page_id', 'second', 'count')
+    )
+
+
+def recount_seconds(keys):
+    """
+    按弹幕表重新计数指定的秒，用于无法确定实际写入了哪些弹幕的情况，需要在写入弹幕的事务中调用
+
+    计数以 upsert 覆盖写入，已没有弹幕的秒只删除计数仍为0的记录，
+    同一秒被其他事务并发累加时不会出现唯一键冲突，也不会删掉对方刚累加的计数。
+
+    Args:
+        keys: (弹幕源ID, 分P编号, 秒) 序列
+    """
+    pages = defaultdict(set)
+    for source_id, page_id, second in keys:
+        pages[(source_id, page_id)].add(second)
+
+    for (source_id, page_id), seconds in pages.items():
+        seconds = sorted(seconds)
+        for i in range(0, len(seconds), RECOUNT_CHUNK):
+            part = seconds[i:i + RECOUNT_CHUNK]
+            counts = dict.fromkeys(((source_id, page_id, int(second)) for second in part), 0)
+            danmakus = Danmaku.objects.filter(
+                source_id=source_id, page_id=page_id,
+                progress__gte=part[0] * 1000, progress__lt=(part[-1] + 1) * 1000,
+            )
+            for _, second, count in _count_queryset(danmakus):
+                key = (source_id, page_id, int(second))
+                if key in counts:
+                    counts[key] = count
+            buckets = DanmakuSecondBucket.objects.filter(source_id=source_id, page_id=page_id, second__in=part)
+            if _upsert_seconds(REPLACE_TEMPLATES, counts):
+                buckets.filter(count=0).delete()
+                continue
+
+            # 不支持 upsert 的数据库先锁住弹幕源，与同一弹幕源的其他重新计数串行执行
+            list(VideoSource.objects.select_for_update().filter(id=source_id).values_list('id'))
+            buckets.delete()
+            DanmakuSecondBucket.objects.bulk_create([
+                DanmakuSecondBucket(source_id=source_id, page_id=page_id, second=second, count=count)
+                for (_, _, second), count in counts.items() if count
+            ], batch_size=1000)
+
+
+def rebuild_second_buckets(source):
+    """
+    按弹幕表重建弹幕源的每秒弹幕数，并标记为已建立
+
+    Args:
+        source: 视频弹幕源
+
+    Returns:
+        int: 有弹幕的秒数
+    """
+    with transaction.atomic():
+        DanmakuSecondBucket.objects.filter(source=source).delete()
+        buckets = [
+            DanmakuSecondBucket(source=source, page_id=page_id, second=int(second), count=count)
+            for page_id, second, count in _count_queryset(Danmaku.objects.filter(source=source))
+            if second is not None
+        ]
+        DanmakuSecondBucket.objects.bulk_create(buckets, batch_size=1000)
+        VideoSource.objects.filter(id=source.id).update(second_buckets_ready=True)
+    source.second_buckets_ready = True
+    logger.info(f"重建弹幕源 {source.bvid} 的每秒弹幕数: {len(buckets)} 秒")
+    return len(buckets)
+
+
+def ensure_second_buckets(source):
+    """弹幕源的每秒弹幕数尚未建立时按弹幕表重建"""
+    if not source.second_buckets_ready:
+        rebuild_second_buckets(source)
+
+
+def clear_second_buckets(source):
+    """删除弹幕源的每秒弹幕数，与清空弹幕一起调用，清空后两者仍然一致"""
+    DanmakuSecondBucket.objects.filter(source=source).delete()
+
+
+def get_second_buckets(source, page_id=None):
+    """
+    读取弹幕源的每秒弹幕数，尚未建立时先重建
+
+    Args:
+        source: 视频弹幕源
+        page_id: 只读取指定分P，默认全部分P
+
+    Returns:
+        list: [(分P编号, 秒, 弹幕数)]，按分P和秒排序
+    """
+    ensure_second_buckets(source)
+    buckets = DanmakuSecondBucket.objects.filter(source=source)
+    if page_id is not None:
+        buckets = buckets.filter(page_id=page_id)
+    return list(buckets.order_by('page_id', 'second').values_list('page_id', 'second', 'count'))
+
+
+def get_timeline(source, page_id=None, bin_size=1):
+    """
+    弹幕源各分P的弹幕时间线
+
+    Args:
+        source: 视频弹幕源
+        page_id: 只返回指定分P，默认全部分P
+        bin_size: 合并的秒数
+
+    Returns:
+        list: [{'page_id': 分P编号, 'second': 区间开始秒数, 'count': 弹幕数}]，按分P和秒排序
+    """
+    bin_size = max(1, int(bin_size))
+    counts = Counter()
+    for page, second, count in get_second_buckets(source, page_id):
+        counts[(page, second // bin_size * bin_size)] += count
+    return [{'page_id': page, 'second': second, 'count': count} for (page, second), count in sorted(counts.items())]
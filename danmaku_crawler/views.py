@@ -1,17 +1,25 @@
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, status, permissions, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 import logging
 from django.utils import timezone
-from threading import Thread
 
-from .models import Video, Danmaku, CrawlTask
-from .serializers import VideoSerializer, DanmakuSerializer, CrawlTaskSerializer
-from .crawler import crawl_video_danmaku, BilibiliDanmakuCrawler
+from .models import VideoSource, Video, Danmaku, CrawlTask, CrawlBatch
+from .serializers import VideoSerializer, DanmakuSerializer, CrawlTaskSerializer, CrawlBatchSerializer
+from .crawler import BilibiliDanmakuCrawler
+from .jobs import enqueue_crawl_task, resume_crawl_task, submit_crawl_batch, can_full_refresh
+from .dedup import get_duplicate_stats
+from .timeline import get_timeline
 
 logger = logging.getLogger(__name__)
 
+def parse_bool(value, default=False):
+    """按 DRF BooleanField 的规则解析布尔参数，表单和查询参数中的 'false'、'0' 解析为False，无法识别时抛出 ValidationError"""
+    if value is None:
+        return default
+    return serializers.BooleanField().to_internal_value(value)
+
 class VideoViewSet(viewsets.ModelViewSet):
     """视频信息视图集"""
     queryset = Video.objects.all().order_by('-created_at')
@@ -54,7 +62,7 @@ class VideoViewSet(viewsets.ModelViewSet):
     def danmakus(self, request, pk=None):
         """获取视频的所有弹幕"""
         video = self.get_object()
-        danmakus = Danmaku.objects.filter(video=video).order_by('progress')
+        danmakus = video.danmakus.order_by('progress')
         
         page = self.paginate_queryset(danmakus)
         if page is not None:
@@ -64,6 +72,38 @@ class VideoViewSet(viewsets.ModelViewSet):
         serializer = DanmakuSerializer(danmakus, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def duplicates(self, request, pk=None):
+        """获取视频弹幕的去重统计：不同文本数、近似重复簇数和刷屏最多的弹幕"""
+        video = self.get_object()
+        if video.source is None:
+            return Response({'error': '视频还没有弹幕数据'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            top_n = min(int(request.query_params.get('top', 20)), 200)
+        except ValueError:
+            top_n = 20
+        return Response(get_duplicate_stats(video.source, top_n))
+    
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """获取视频各分P每秒(或每 bin 秒)的弹幕数，直接读取入库时维护的每秒弹幕数"""
+        video = self.get_object()
+        if video.source is None:
+            return Response({'error': '视频还没有弹幕数据'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            page_id = int(request.query_params['page']) if 'page' in request.query_params else None
+            bin_size = min(max(int(request.query_params.get('bin', 1)), 1), 3600)
+        except ValueError:
+            return Response({'error': 'page 和 bin 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        points = get_timeline(video.source, page_id, bin_size)
+        return Response({
+            'bin': bin_size,
+            'total': sum(point['count'] for point in points),
+            'timeline': points,
+        })
+    
     @action(detail=True, methods=['get'])
     def tasks(self, request, pk=None):
         """获取视频的所有爬取任务"""
@@ -95,8 +135,8 @@ class DanmakuViewSet(viewsets.ReadOnlyModelViewSet):
         # 按视频BV号筛选
         bvid = self.request.query_params.get('bvid', None)
         if bvid:
-            video = get_object_or_404(Video, bvid=bvid)
-            queryset = queryset.filter(video=video)
+            source = get_object_or_404(VideoSource, bvid=bvid)
+            queryset = queryset.filter(source=source)
             
         # 用户过滤逻辑
         user_param = self.request.query_params.get('user', None)
@@ -104,8 +144,8 @@ class DanmakuViewSet(viewsets.ReadOnlyModelViewSet):
             # 管理员请求'all'时返回所有弹幕
             pass
         else:
-            # 其他情况只返回用户自己视频的弹幕
-            queryset = queryset.filter(video__user=self.request.user)
+            # 其他情况只返回用户自己视频的弹幕(弹幕源被用户的视频记录引用)
+            queryset = queryset.filter(source__videos__user=self.request.user)
         
         # 按进度范围筛选
         start = self.request.query_params.get('start', None)
@@ -153,6 +193,14 @@ class CrawlTaskViewSet(viewsets.ReadOnlyModelViewSet):
                 'message': '您需要登录才能创建爬取任务'
             }, status=status.HTTP_401_UNAUTHORIZED)
             
+        # full_refresh=True 时删除旧弹幕后全量重爬，默认增量爬取
+        try:
+            full_refresh = parse_bool(request.data.get('full_refresh'))
+        except serializers.ValidationError:
+            return Response({
+                'message': 'full_refresh 必须是布尔值'
+            }, status=status.HTTP_400_BAD_REQUEST)
+            
         try:
             video_url = request.data.get('video_url', None)
             cookie_str = request.data.get('cookie_str', None)
@@ -171,76 +219,39 @@ class CrawlTaskViewSet(viewsets.ReadOnlyModelViewSet):
                     'message': '无法解析BV号，请检查URL格式'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # 获取视频信息
-            video_info = crawler.get_video_info(bvid)
-            if not video_info:
+            # 获取弹幕源(同一BV号的弹幕所有用户共享)，不存在时请求视频信息创建
+            source = crawler.get_or_create_source(bvid)
+            if not source:
                 return Response({
                     'message': '获取视频信息失败，请检查URL或Cookie是否正确'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # 获取或创建视频记录
-            try:
-                video_obj = Video.objects.get(bvid=bvid, user=request.user)
-                logger.info(f"视频已存在: {bvid}, 用户: {request.user.username}")
-            except Video.DoesNotExist:
-                # 创建新视频记录
-                video_obj = Video.objects.create(
-                    bvid=video_info['bvid'],
-                    aid=video_info['aid'],
-                    title=video_info['title'],
-                    owner=video_info['owner']['name'],
-                    owner_mid=video_info['owner']['mid'],
-                    duration=video_info['duration'],
-                    last_crawled=timezone.now(),
-                    user=request.user
-                )
-                logger.info(f"创建新视频记录: {video_obj.title}, BV: {bvid}")
+            # 获取或创建当前用户的视频记录
+            video_obj = crawler.get_or_create_video(source, request.user)
             
-            # 创建爬取任务
-            task = CrawlTask.objects.create(
-                video=video_obj,
-                status='pending',
-                started_at=timezone.now(),
-                user=request.user
-            )
+            # 全量重爬会删除所有用户共享的弹幕
+            if full_refresh and not can_full_refresh(video_obj, request.user):
+                return Response({
+                    'message': '该视频的弹幕由多个用户共享，只有管理员可以全量重爬'
+                }, status=status.HTTP_403_FORBIDDEN)
             
-            # 启动后台爬取任务
-            def run_crawler_task():
-                try:
-                    logger.info(f"开始后台爬取任务 ID: {task.id}, 视频: {video_obj.title}")
-                    task.status = 'running'
-                    task.save()
-                    
-                    result = crawl_video_danmaku(bvid, cookie_str=cookie_str, user=request.user, existing_task=task)
-                    
-                    # 更新任务状态
-                    task.refresh_from_db()
-                    if task.status == 'running':
-                        if result:
-                            task.status = 'completed'
-                            task.danmaku_count = result.danmaku_count
-                        else:
-                            task.status = 'failed'
-                            task.error_message = '爬取过程中出现错误'
-                        task.completed_at = timezone.now()
-                        task.save()
-                        video_obj.save()
-                except Exception as e:
-                    logger.exception(f"后台爬取任务异常 - 任务ID: {task.id}, 异常: {str(e)}")
-                    try:
-                        task.refresh_from_db()
-                        task.status = 'failed'
-                        task.error_message = str(e)
-                        task.completed_at = timezone.now()
-                        task.save()
-                    except Exception as inner_e:
-                        logger.error(f"更新任务状态失败: {str(inner_e)}")
+            # 提交到爬取任务队列，由 crawl_worker 工作进程领取执行
+            task = enqueue_crawl_task(
+                video_obj,
+                user=request.user,
+                cookie_str=cookie_str,
+                full_refresh=full_refresh
+            )
+            logger.info(f"已提交爬取任务 ID: {task.id}, 视频: {video_obj.title}")
             
-            # 启动爬取线程
-            crawler_thread = Thread(target=run_crawler_task)
-            crawler_thread.daemon = True
-            crawler_thread.start()
-
+            if task.leader_id:
+                # 同一视频已有任务在进行，本任务等待其结果
+                return Response({
+                    'message': f'该视频正在爬取中，已合并到进行中的任务 - {video_obj.title}',
+                    'task_id': task.id,
+                    'leader_task_id': task.leader_id,
+                    'status': task.status
+                })
             
             return Response({
                 'message': f'已提交爬取任务 - {video_obj.title}',
@@ -272,3 +283,123 @@ class CrawlTaskViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
+    
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """重新排队失败的爬取任务，工作进程会跳过已记录检查点的分段继续抓取"""
+        if not request.user.is_authenticated:
+            return Response({
+                'message': '您需要登录才能恢复任务'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        task = self.get_object()
+        if task.status != 'failed':
+            return Response({
+                'message': f'只有失败的任务可以恢复，当前状态: {task.status}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        task = resume_crawl_task(task)
+        logger.info(f"恢复爬取任务 ID: {task.id}, 已完成分段: {task.checkpoints.count()}")
+
+        if task.leader_id:
+            return Response({
+                'message': f'该视频正在爬取中，已合并到进行中的任务 - {task.video.title}',
+                'task_id': task.id,
+                'leader_task_id': task.leader_id,
+                'status': task.status
+            })
+
+        return Response({
+            'message': f'已重新提交爬取任务 - {task.video.title}',
+            'task_id': task.id,
+            'status': task.status
+        })
+
+
+class CrawlBatchViewSet(viewsets.ReadOnlyModelViewSet):
+    """批量爬取视图集"""
+    queryset = CrawlBatch.objects.all().order_by('-created_at')
+    serializer_class = CrawlBatchSerializer
+    permission_classes = [permissions.AllowAny]
+    
+    def get_queryset(self):
+        """普通用户只能查看自己的批次"""
+        queryset = super().get_queryset()
+        
+        if not self.request.user.is_authenticated:
+            return CrawlBatch.objects.none()
+        
+        user_param = self.request.query_params.get('user', None)
+        if user_param == 'all' and self.request.user.is_staff:
+            return queryset
+        return queryset.filter(user=self.request.user)
+    
+    @action(detail=False, methods=['post'])
+    def create_batch(self, request):
+        """批量提交爬取任务，videos 为BV号或视频URL列表"""
+        if not request.user.is_authenticated:
+            return Response({
+                'message': '您需要登录才能创建爬取任务'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        videos = request.data.get('videos', None)
+        if not videos or not isinstance(videos, list):
+            return Response({
+                'message': '请提供视频BV号或URL列表'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            priority = int(request.data.get('priority', 0))
+        except (TypeError, ValueError):
+            return Response({
+                'message': '优先级必须是整数'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            full_refresh = parse_bool(request.data.get('full_refresh'))
+        except serializers.ValidationError:
+            return Response({
+                'message': 'full_refresh 必须是布尔值'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # 批量全量重爬会删除大量共享弹幕源的弹幕
+        if full_refresh and not request.user.is_staff:
+            return Response({
+                'message': '只有管理员可以批量全量重爬'
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            batch, invalid = submit_crawl_batch(
+                [str(v) for v in videos],
+                user=request.user,
+                name=request.data.get('name', ''),
+                priority=priority,
+                cookie_str=request.data.get('cookie_str', None),
+                full_refresh=full_refresh
+            )
+        except ValueError as e:
+            return Response({
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception(f"批量爬取任务创建异常 - 用户: {request.user.username}, 异常: {str(e)}")
+            return Response({
+                'message': f'批量爬取任务创建失败: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        data = self.get_serializer(batch).data
+        data['invalid'] = invalid
+        data['message'] = f"已提交 {data['progress']['total']} 个爬取任务"
+        return Response(data)
+    
+    @action(detail=True, methods=['get'])
+    def tasks(self, request, pk=None):
+        """获取批次内的爬取任务"""
+        batch = self.get_object()
+        tasks = batch.tasks.select_related('video').order_by('-priority', 'created_at')
+        page = self.paginate_queryset(tasks)
+        if page is not None:
+            serializer = CrawlTaskSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = CrawlTaskSerializer(tasks, many=True)
+        return Response(serializer.data)
@@ -4,7 +4,14 @@ from functools import reduce
 from hashlib import md5
 import urllib.parse
 import time
-import requests
+import logging
+import threading
+from django.core.cache import cache
+
+from . import crawler_config
+from .http_client import get_http_client, api_url
+
+logger = logging.getLogger(__name__)
 
 mixinKeyEncTab = [
     46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
@@ -19,7 +26,10 @@ def getMixinKey(orig: str):
 
 def encWbi(params: dict, img_key: str, sub_key: str):
     '为请求参数进行 wbi 签名'
-    mixin_key = getMixinKey(img_key + sub_key)
+    return encWbiWithMixinKey(params, getMixinKey(img_key + sub_key))
+
+def encWbiWithMixinKey(params: dict, mixin_key: str):
+    '使用已计算好的 mixin_key 为请求参数进行 wbi 签名'
     curr_time = round(time.time())
     params['wts'] = curr_time                                  # 添加 wts 字段
     params = dict(sorted(params.items()))                      # 按照 key 重排参数
@@ -36,11 +46,7 @@ def encWbi(params: dict, img_key: str, sub_key: str):
 
 def getWbiKeys() -> tuple[str, str]:
     '获取最新的 img_key 和 sub_key'
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0',
-        'Referer': 'https://www.bilibili.com/',
-    }
-    resp = requests.get('https://api.bilibili.com/x/web-interface/nav', headers=headers)
+    resp = get_http_client().get(api_url('/x/web-interface/nav'))
     resp.raise_for_status()
     json_content = resp.json()
     img_url: str = json_content['data']['wbi_img']['img_url']
@@ -49,6 +55,86 @@ def getWbiKeys() -> tuple[str, str]:
     sub_key = sub_url.rsplit('/', 1)[1].split('.')[0]
     return img_key, sub_key
 
+class WbiKeyManager:
+    """
+    WBI 签名密钥管理器
+    
+    缓存 img_key、sub_key 及由其计算出的 mixin_key，在有效期内不再请求 nav 接口。
+    密钥同时写入 Django 缓存，多个工作进程共享同一份密钥；
+    仅在过期或签名请求被拒绝(调用 invalidate)时重新获取。
+    """
+    
+    CACHE_KEY = 'danmaku_crawler:wbi_keys'
+    
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else crawler_config.WBI_KEYS.get('ttl', 3600)
+        self._keys = None
+        self._lock = threading.Lock()
+    
+    def _is_valid(self, keys):
+        return bool(keys) and keys.get('expires_at', 0) > time.time()
+    
+    def _load_shared(self):
+        """从 Django 缓存读取其他进程获取的密钥"""
+        try:
+            return cache.get(self.CACHE_KEY)
+        except Exception as e:
+            logger.warning(f"读取WBI密钥缓存失败: {str(e)}")
+            return None
+    
+    def _store_shared(self, keys):
+        try:
+            cache.set(self.CACHE_KEY, keys, timeout=self.ttl)
+        except Exception as e:
+            logger.warning(f"写入WBI密钥缓存失败: {str(e)}")
+    
+    def get_keys(self):
+        """
+        获取当前有效的密钥
+        
+        返回:
+            dict: 包含 img_key、sub_key、mixin_key、expires_at
+        """
+        keys = self._keys
+        if self._is_valid(keys):
+            return keys
+        
+        with self._lock:
+            # 等待锁期间可能已被其他线程刷新
+            if self._is_valid(self._keys):
+                return self._keys
+            
+            keys = self._load_shared()
+            if not self._is_valid(keys):
+                img_key, sub_key = getWbiKeys()
+                keys = {
+                    'img_key': img_key,
+                    'sub_key': sub_key,
+                    'mixin_key': getMixinKey(img_key + sub_key),
+                    'expires_at': time.time() + self.ttl,
+                }
+                self._store_shared(keys)
+                logger.info("已刷新WBI签名密钥")
+            
+            self._keys = keys
+            return keys
+    
+    def get_mixin_key(self):
+        return self.get_keys()['mixin_key']
+    
+    def invalidate(self):
+        """作废当前密钥(签名被拒绝时调用)，下次签名时重新获取"""
+        with self._lock:
+            self._keys = None
+            try:
+                cache.delete(self.CACHE_KEY)
+            except Exception as e:
+                logger.warning(f"删除WBI密钥缓存失败: {str(e)}")
+
+
+# 全局密钥管理器
+wbi_key_manager = WbiKeyManager()
+
 def get_danmu_wbi_sign(cid, pid, page):
     """
     生成弹幕请求的签名查询字符串
@@ -61,7 +147,6 @@ def get_danmu_wbi_sign(cid, pid, page):
     返回:
         str: 包含签名的查询字符串
     """
-    img_key, sub_key = getWbiKeys()
     base_params = {
         'type': 1,
         'oid': cid,
@@ -78,10 +163,9 @@ def get_danmu_wbi_sign(cid, pid, page):
             'pe': 120000
         })
         
-    signed_params = encWbi(
+    signed_params = encWbiWithMixinKey(
         params=base_params,
-        img_key=img_key,
-        sub_key=sub_key
+        mixin_key=wbi_key_manager.get_mixin_key()
     )
     
     query = urllib.parse.urlencode(signed_params)
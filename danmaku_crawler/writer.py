@@ -0,0 +1,137 @@
+"""
+后台弹幕写入线程
+抓取线程把解析好的弹幕批次放入有界队列，由独立线程写入数据库，
+使网络抓取和数据库写入并行进行；数据库写入跟不上时队列写满，抓取端被阻塞(背压)。
+"""
+
+import time
+import queue
+import logging
+import threading
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_STOP = object()
+
+
+class DanmakuWriter:
+    """带有界队列的后台弹幕写入器"""
+
+    def __init__(self, write_func, max_queue_size=4, name='danmaku-writer'):
+        """初始化写入器
+
+        Args:
+            write_func: 写入一批弹幕的函数，接收弹幕列表，返回写入条数
+            max_queue_size: 队列中最多等待写入的批次数
+            name: 写入线程名
+        """
+        self.write_func = write_func
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._error = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'batches': 0,               # 已写入批次数
+            'rows': 0,                  # 已写入弹幕数
+            'write_time': 0.0,          # 累计写入耗时(秒)
+            'max_write_time': 0.0,      # 单批最大写入耗时(秒)
+            'max_queue_depth': 0,       # 观察到的最大队列深度
+            'backpressure_waits': 0,    # 因队列已满而阻塞的次数
+            'backpressure_time': 0.0,   # 抓取端累计阻塞时长(秒)
+        }
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _put(self, item):
+        """放入队列，队列已满时阻塞等待写入线程消费"""
+        if self._error:
+            raise self._error
+
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            wait_start = time.monotonic()
+            self.queue.put(item)
+            with self._lock:
+                self.stats['backpressure_waits'] += 1
+                self.stats['backpressure_time'] += time.monotonic() - wait_start
+
+        with self._lock:
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue.qsize())
+
+    def submit(self, danmaku_list):
+        """提交一批待写入的弹幕"""
+        if danmaku_list:
+            self._put(('write', danmaku_list))
+
+    def call(self, func):
+        """提交一个回调，在之前提交的批次全部写入后于写入线程中执行"""
+        self._put(('call', func))
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                try:
+                    if item is _STOP:
+                        return
+                    if self._error:
+                        # 写入已失败，丢弃剩余任务，避免提交端永久阻塞
+                        continue
+
+                    kind, payload = item
+                    try:
+                        if kind == 'write':
+                            self._write(payload)
+                        else:
+                            payload()
+                    except Exception as e:
+                        logger.error(f"后台写入弹幕异常: {str(e)}")
+                        self._error = e
+                finally:
+                    self.queue.task_done()
+        finally:
+            # 关闭本线程使用的数据库连接
+            connections.close_all()
+
+    def _write(self, danmaku_list):
+        write_start = time.monotonic()
+        count = self.write_func(danmaku_list)
+        elapsed = time.monotonic() - write_start
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['rows'] += count
+            self.stats['write_time'] += elapsed
+            self.stats['max_write_time'] = max(self.stats['max_write_time'], elapsed)
+        logger.debug(f"写入弹幕 {count} 条，耗时 {elapsed * 1000:.1f}ms，队列深度 {self.queue.qsize()}")
+
+    def get_stats(self):
+        """获取写入统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['avg_write_time'] = stats['write_time'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def close(self):
+        """等待队列中的批次全部写入并结束写入线程，写入失败时抛出异常"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+
+        stats = self.get_stats()
+        logger.info(
+            f"弹幕写入统计: {stats['batches']} 批 {stats['rows']} 条, "
+            f"平均写入耗时 {stats['avg_write_time'] * 1000:.1f}ms, 最大 {stats['max_write_time'] * 1000:.1f}ms, "
+            f"最大队列深度 {stats['max_queue_depth']}, 背压等待 {stats['backpressure_waits']} 次 "
+            f"共 {stats['backpressure_time']:.2f}秒"
+        )
+
+        if self._error:
+            raise self._error
+        return stats
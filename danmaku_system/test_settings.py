@@ -0,0 +1,23 @@
+"""
+测试配置：使用 SQLite 和进程内缓存，不需要 MySQL
+
+运行测试: python manage.py test --settings=danmaku_system.test_settings
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        # 入库线程使用独立的连接，内存数据库的共享缓存模式下会互相锁表，测试库使用文件
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+# 爬虫缓存分P列表，测试之间不能共用项目目录下的文件缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
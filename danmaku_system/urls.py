@@ -22,7 +22,7 @@ from rest_framework.routers import DefaultRouter
 import os
 from django.conf import settings
 
-from danmaku_crawler.views import VideoViewSet, DanmakuViewSet, CrawlTaskViewSet
+from danmaku_crawler.views import VideoViewSet, DanmakuViewSet, CrawlTaskViewSet, CrawlBatchViewSet
 from danmaku_analysis.views import AnalysisViewSet
 
 # 创建路由器
@@ -30,6 +30,7 @@ router = DefaultRouter()
 router.register(r'videos', VideoViewSet)
 router.register(r'danmakus', DanmakuViewSet)
 router.register(r'tasks', CrawlTaskViewSet)
+router.register(r'batches', CrawlBatchViewSet)
 router.register(r'analyses', AnalysisViewSet)
 
 